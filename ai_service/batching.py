@@ -0,0 +1,254 @@
+"""
+Dynamic micro-batching for YOLO inference
+
+Requests for the same (model, conf, iou) that arrive within a short window are
+gathered and run as a single batched ultralytics call in a worker thread, then
+each waiting request gets its own result back.
+
+When traffic is light (the previous batch held a single image and nothing is
+queued) a request is dispatched immediately, so single-camera latency does not
+pay the batching window.
+
+All blocking work (inference and result post-processing) runs on a bounded
+executor; AdmissionControl rejects new requests once too many are in flight.
+"""
+
+import asyncio
+import time
+import logging
+from concurrent.futures import Executor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32)
+WAIT_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Histogram:
+    """Minimal cumulative histogram (Prometheus-style `le` buckets)"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        cumulative = {}
+        running = 0
+        for bound, n in zip(self.buckets, self.counts):
+            running += n
+            cumulative[str(bound)] = running
+        cumulative["+Inf"] = self.count
+        return {
+            "buckets": cumulative,
+            "sum": round(self.sum, 6),
+            "count": self.count,
+            "mean": round(self.sum / self.count, 6) if self.count else None
+        }
+
+
+class BatchStats:
+    """Per-model batching metrics"""
+
+    def __init__(self):
+        self.queue_depth = 0
+        self.batches = 0
+        self.images = 0
+        self.batch_size = Histogram(BATCH_SIZE_BUCKETS)
+        self.wait_time = Histogram(WAIT_TIME_BUCKETS)
+        self.inference_time = Histogram(WAIT_TIME_BUCKETS)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.queue_depth,
+            "batches": self.batches,
+            "images": self.images,
+            "batch_size": self.batch_size.as_dict(),
+            "wait_time_seconds": self.wait_time.as_dict(),
+            "inference_time_seconds": self.inference_time.as_dict()
+        }
+
+
+class Overloaded(Exception):
+    """Raised when the inference pool has no free capacity"""
+
+
+class AdmissionControl:
+    """Caps the number of requests waiting on or running inference"""
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max(1, max_pending)
+        self.inflight = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.inflight >= self.max_pending:
+            self.rejected += 1
+            raise Overloaded(f"{self.inflight} requests already in flight")
+        self.inflight += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"inflight": self.inflight, "max_pending": self.max_pending, "rejected": self.rejected}
+
+
+class _Pending:
+    __slots__ = ("model", "image", "postprocess", "future", "enqueued_at")
+
+    def __init__(self, model, image, postprocess, future):
+        self.model = model
+        self.image = image
+        self.postprocess = postprocess
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class ModelBatcher:
+    """Queue + worker task for one (model, conf, iou) combination"""
+
+    def __init__(self, run_batch: Callable[[Any, List[Any]], List[Any]], stats: BatchStats,
+                 window: float, max_batch: int, executor: Optional[Executor] = None):
+        self.run_batch = run_batch
+        self.executor = executor
+        self.stats = stats
+        self.window = window
+        self.max_batch = max_batch
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._last_batch_size = 1
+        self._task = asyncio.create_task(self._worker())
+
+    async def submit(self, model, image, postprocess=None) -> Tuple[Any, float]:
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait(_Pending(model, image, postprocess, future))
+        self.stats.queue_depth += 1
+        return await future
+
+    async def _collect(self) -> List[_Pending]:
+        batch = [await self.queue.get()]
+
+        # 低流量時不等待，直接送出，避免拖慢單一攝影機的延遲
+        under_load = self._last_batch_size > 1 or not self.queue.empty()
+        deadline = time.perf_counter() + (self.window if under_load else 0.0)
+
+        while len(batch) < self.max_batch:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _run(self, batch: List[_Pending]) -> List[Any]:
+        # 在 executor 執行緒中推論並做後處理 (.cpu().numpy() 等)，不佔用 event loop
+        # 模型由請求帶入，batcher 本身不持有模型 (registry 才能真正釋放被淘汰的模型)
+        results = self.run_batch(batch[0].model, [p.image for p in batch])
+        return [p.postprocess(r) if p.postprocess else r for p, r in zip(batch, results)]
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            self.stats.queue_depth -= len(batch)
+
+            # 已被取消的請求 (client 斷線) 不送進 GPU
+            batch = [p for p in batch if not p.future.done()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            for p in batch:
+                self.stats.wait_time.observe(started - p.enqueued_at)
+
+            try:
+                results = await loop.run_in_executor(self.executor, self._run, batch)
+            except Exception as e:
+                logger.error(f"Batched inference failed ({len(batch)} images): {e}")
+                for p in batch:
+                    if not p.future.done():
+                        p.future.set_exception(e)
+                continue
+
+            elapsed = time.perf_counter() - started
+            self._last_batch_size = len(batch)
+            self.stats.batches += 1
+            self.stats.images += len(batch)
+            self.stats.batch_size.observe(len(batch))
+            self.stats.inference_time.observe(elapsed)
+
+            for p, result in zip(batch, results):
+                if not p.future.done():
+                    p.future.set_result((result, elapsed))
+
+    async def close(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+class MicroBatcher:
+    """Routes inference requests to a ModelBatcher per (model, conf, iou)"""
+
+    def __init__(self, window_ms: float, max_batch: int, executor: Optional[Executor] = None):
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.executor = executor
+        self._batchers: Dict[Tuple[str, float, float], ModelBatcher] = {}
+        self.stats: Dict[str, BatchStats] = {}
+
+    async def infer(self, model_name: str, yolo_model, image, conf: float, iou: float,
+                    postprocess: Optional[Callable[[Any], Any]] = None,
+                    max_batch: Optional[int] = None) -> Tuple[Any, float]:
+        """Run `yolo_model` on one image as part of a batch.
+
+        Returns (ultralytics Result for this image, batch inference seconds).
+        If `postprocess` is given it is applied to the Result on the worker
+        thread and its return value is returned instead. `max_batch` caps the
+        batch size for models exported with a fixed batch dimension.
+        """
+        key = (model_name, conf, iou)
+        batcher = self._batchers.get(key)
+        if batcher is None:
+            stats = self.stats.setdefault(model_name, BatchStats())
+
+            def run_batch(model, images):
+                return model(images, conf=conf, iou=iou, verbose=False)
+
+            limit = self.max_batch if max_batch is None else max(1, min(self.max_batch, max_batch))
+            batcher = ModelBatcher(run_batch, stats, self.window, limit, self.executor)
+            self._batchers[key] = batcher
+        return await batcher.submit(yolo_model, image, postprocess)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "models": {name: s.as_dict() for name, s in self.stats.items()}
+        }
+
+    async def close(self):
+        for batcher in self._batchers.values():
+            await batcher.close()
+        self._batchers.clear()
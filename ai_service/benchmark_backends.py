@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Compare inference backends for parity and latency
+
+Every backend available for a model (see model_backends.py) runs on the same
+images. Outputs are matched against the PyTorch reference by class and IoU,
+and per-image latency is measured after warm-up. Each backend is also run on
+one batch of --batch images, the way the service's micro-batcher calls it,
+and those outputs are matched against the single-image reference too.
+
+Usage:
+    python benchmark_backends.py yolov13n yolov11m-segv2 --images test3.jpg
+    python benchmark_backends.py yolov13n --runs 50 --batch 8 --json backends.json
+"""
+
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+import model_backends
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU matrix between (N, 4) and (M, 4) xyxy boxes"""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def to_arrays(result):
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return np.zeros((0, 4)), np.zeros(0), np.zeros(0, dtype=int)
+    return (boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(),
+            boxes.cls.cpu().numpy().astype(int))
+
+
+def parity(reference, candidate, iou_threshold: float):
+    """Fraction of reference boxes matched (same class, IoU >= threshold)"""
+    ref_xyxy, ref_conf, ref_cls = to_arrays(reference)
+    cand_xyxy, cand_conf, cand_cls = to_arrays(candidate)
+    if len(ref_xyxy) == 0:
+        return {"matched": 1.0 if len(cand_xyxy) == 0 else 0.0, "mean_iou": None, "max_conf_diff": None,
+                "ref": 0, "candidate": len(cand_xyxy)}
+
+    ious = box_iou(ref_xyxy, cand_xyxy)
+    ious[ref_cls[:, None] != cand_cls[None, :]] = 0.0
+    best = ious.argmax(axis=1) if ious.shape[1] else np.zeros(len(ref_xyxy), dtype=int)
+    best_iou = ious.max(axis=1) if ious.shape[1] else np.zeros(len(ref_xyxy))
+    hit = best_iou >= iou_threshold
+    conf_diff = np.abs(ref_conf[hit] - cand_conf[best[hit]]) if hit.any() else np.zeros(0)
+    return {
+        "matched": round(float(hit.mean()), 4),
+        "mean_iou": round(float(best_iou[hit].mean()), 4) if hit.any() else None,
+        "max_conf_diff": round(float(conf_diff.max()), 4) if len(conf_diff) else None,
+        "ref": len(ref_xyxy),
+        "candidate": len(cand_xyxy)
+    }
+
+
+def time_backend(model, images, warmup: int, runs: int):
+    for _ in range(warmup):
+        model(images[0], verbose=False)
+    samples = []
+    outputs = []
+    for i in range(runs):
+        img = images[i % len(images)]
+        start = time.perf_counter()
+        out = model(img, verbose=False)
+        samples.append(time.perf_counter() - start)
+        if i < len(images):
+            outputs.append(out[0])
+    ms = np.array(samples) * 1000
+    return outputs, {
+        "mean_ms": round(float(ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "fps": round(1000.0 / float(ms.mean()), 2)
+    }
+
+
+def batched(model, images, reference, batch_size: int, iou_threshold: float):
+    """One batch of `batch_size` images (cycled from `images`) against the single-image reference"""
+    batch = [images[i % len(images)] for i in range(batch_size)]
+    try:
+        start = time.perf_counter()
+        outputs = model(batch, verbose=False)
+        elapsed = time.perf_counter() - start
+    except Exception as e:
+        # 固定 batch 的匯出檔 (--static / TorchScript) 在此失敗；服務端會以 batch 1 執行
+        return {"size": batch_size, "ok": False, "error": str(e)}
+    checks = [parity(reference[i % len(images)], out, iou_threshold) for i, out in enumerate(outputs)]
+    return {
+        "size": batch_size,
+        "ok": len(outputs) == batch_size,
+        "ms_per_image": round(elapsed * 1000 / batch_size, 2),
+        "parity_matched": round(float(np.mean([c["matched"] for c in checks])), 4)
+    }
+
+
+def load_images(paths, size):
+    if paths:
+        images = [cv2.imread(p) for p in paths]
+        missing = [p for p, img in zip(paths, images) if img is None]
+        if missing:
+            raise FileNotFoundError(f"Image not found: {', '.join(missing)}")
+        return images
+    # 沒有指定圖片時使用固定亂數影像 (僅能比較延遲，parity 意義有限)
+    rng = np.random.default_rng(0)
+    width, height = size
+    return [rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(4)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark YOLO inference backends")
+    parser.add_argument("models", nargs="+")
+    parser.add_argument("--images", nargs="*", default=[])
+    parser.add_argument("--size", default="320x240", help="Synthetic image size (WxH) when --images is empty")
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", "."))
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU threshold for parity matching")
+    parser.add_argument("--batch", type=int, default=int(os.getenv("BATCH_MAX_SIZE", "8")),
+                        help="Images per batch for the batched parity check")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    from ultralytics import YOLO
+
+    size = tuple(int(v) for v in args.size.lower().split("x"))
+    images = load_images(args.images, size)
+    report = {}
+
+    for name in args.models:
+        backends = model_backends.available_backends(args.model_dir, name)
+        if "pytorch" not in backends:
+            print(f"{name}: no PyTorch reference weights, skipped")
+            continue
+
+        reference = None
+        report[name] = {}
+        for backend in ["pytorch"] + [b for b in backends if b != "pytorch"]:
+            model = YOLO(model_backends.weights_path(args.model_dir, name, backend))
+            outputs, latency = time_backend(model, images, args.warmup, args.runs)
+            if reference is None:
+                reference = outputs
+            checks = [parity(r, c, args.iou) for r, c in zip(reference, outputs)]
+            batch = batched(model, images, reference, args.batch, args.iou)
+            entry = {
+                **latency,
+                "parity_matched": round(float(np.mean([c["matched"] for c in checks])), 4),
+                "parity": checks,
+                "batch": batch
+            }
+            report[name][backend] = entry
+            batch_note = (f"batch {batch['size']} {batch['ms_per_image']:7.2f} ms/img parity {batch['parity_matched']:.3f}"
+                          if batch["ok"] else f"batch {batch['size']} FAILED")
+            print(f"{name:20s} {backend:12s} mean {entry['mean_ms']:8.2f} ms  p95 {entry['p95_ms']:8.2f} ms  "
+                  f"{entry['fps']:6.2f} FPS  parity {entry['parity_matched']:.3f}  {batch_note}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Export YOLO weights to optimized inference formats
+
+Produces the files the AI service looks for next to the .pt weights
+(see model_backends.py), so CPU-only nodes can serve the same models
+through ONNX Runtime, OpenVINO or TorchScript.
+
+ONNX and OpenVINO are exported with a dynamic batch dimension by default so
+the micro-batcher can send them up to BATCH_MAX_SIZE images at once. A
+--static export (and TorchScript, which is traced at batch 1) is served one
+image per batch.
+
+Usage:
+    python export_models.py yolov13n yolov11m-segv2
+    python export_models.py yolov13n --formats onnx openvino --imgsz 320
+    python export_models.py yolov13n --formats onnx --static
+"""
+
+import argparse
+import logging
+import os
+
+import model_backends
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def export_model(model_dir: str, model_name: str, backends, imgsz: int, half: bool, dynamic: bool):
+    from ultralytics import YOLO
+
+    source = model_backends.weights_path(model_dir, model_name, "pytorch")
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"Weights not found: {source}")
+
+    model = YOLO(source)
+    outputs = {}
+    for backend in backends:
+        fmt = model_backends.EXPORT_FORMATS[backend]
+        kwargs = {"format": fmt, "imgsz": imgsz, "half": half}
+        # dynamic shape 只有 ONNX / OpenVINO 支援；TorchScript 固定 batch 1
+        if dynamic and backend in ("onnx", "openvino"):
+            kwargs["dynamic"] = True
+        logger.info(f"Exporting {model_name} -> {backend} (imgsz={imgsz}, "
+                    f"{'dynamic' if kwargs.get('dynamic') else 'static batch 1'})")
+        outputs[backend] = model.export(**kwargs)
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export YOLO .pt weights to ONNX / OpenVINO / TorchScript")
+    parser.add_argument("models", nargs="+", help="Model names (without .pt)")
+    parser.add_argument("--formats", nargs="+", default=list(model_backends.EXPORT_FORMATS),
+                        choices=list(model_backends.EXPORT_FORMATS))
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", "."))
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--half", action="store_true", help="FP16 export (GPU targets only)")
+    parser.add_argument("--static", dest="dynamic", action="store_false",
+                        help="Fixed batch-1 input shape for ONNX / OpenVINO (served without batching)")
+    args = parser.parse_args()
+
+    for name in args.models:
+        outputs = export_model(args.model_dir, name, args.formats, args.imgsz, args.half, args.dynamic)
+        for backend, path in outputs.items():
+            print(f"{name:20s} {backend:12s} {path}")
+
+
+if __name__ == "__main__":
+    main()
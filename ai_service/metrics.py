@@ -0,0 +1,67 @@
+"""Prometheus metrics for the AI service (exposed on /metrics)"""
+
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from prometheus_client import Counter, Gauge, Histogram
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGE_SECONDS = Histogram("ai_stage_seconds", "Time spent per request stage",
+                          ["endpoint", "stage"], buckets=STAGE_BUCKETS)
+MODEL_SECONDS = Histogram("ai_model_inference_seconds", "Batch inference time per model",
+                          ["model"], buckets=STAGE_BUCKETS)
+REQUESTS = Counter("ai_requests_total", "Inference requests by endpoint and HTTP status",
+                   ["endpoint", "status"])
+ERRORS = Counter("ai_errors_total", "Failed request stages", ["endpoint", "stage"])
+QUEUE_DEPTH = Gauge("ai_batch_queue_depth", "Images waiting for a batch", ["model"])
+IN_FLIGHT = Gauge("ai_requests_in_flight", "Requests holding an admission slot")
+REJECTED = Counter("ai_admission_rejected_total", "Requests rejected with 503 by admission control")
+
+
+class StageTimer:
+    """Times the stages of one request.
+
+    Each stage is observed into ai_stage_seconds and kept in `timings` (ms),
+    which is returned to the caller so it can split its round trip into
+    network and server time. "batch" is the wait for a micro-batch plus the
+    batched inference; "inference" is the model run alone.
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            ERRORS.labels(self.endpoint, name).inc()
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        STAGE_SECONDS.labels(self.endpoint, name).observe(seconds)
+        self.timings[name] = round(seconds * 1000, 2)
+
+    def record_models(self, inference_times: Dict[str, float]):
+        """Batch inference seconds per model; the models run concurrently, so the stage is the slowest"""
+        for model, seconds in inference_times.items():
+            MODEL_SECONDS.labels(model).observe(seconds)
+        self.record("inference", max(inference_times.values()))
+
+    def finish(self) -> Dict[str, float]:
+        self.record("total", time.perf_counter() - self.started)
+        return self.timings
+
+
+def refresh(batcher, admission):
+    """Copy queue state into the gauges right before a scrape"""
+    for model, stats in batcher.stats.items():
+        QUEUE_DEPTH.labels(model).set(stats.queue_depth)
+    IN_FLIGHT.set(admission.inflight)
@@ -1,67 +1,220 @@
-import uvicorn
+"""Deterministic stand-in for the YOLO service, for load tests and local development.
+
+Serves the same routes and response shapes as yolov13_fastapi_api.py
+(/detect, /segment, /analyze, /health, /ready) without a GPU or model
+weights. Results depend only on the image bytes and MOCK_SEED, so a run
+can be repeated exactly; latency is simulated per model and requests beyond
+MOCK_WORKERS wait for a free "GPU" slot, like the real inference pool.
+
+Usage:
+    python mock_yolo.py --port 9000 --detect-ms 40 --segment-ms 120 --jitter-ms 10
+    # backend: AI_TUNNEL_HOSTS= AI_SERVICE_URLS=http://127.0.0.1:9000 uvicorn main:app
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import os
 import random
 import time
-from fastapi import FastAPI, UploadFile, File
-
-app = FastAPI()
-
-
-# 模擬模型 A
-@app.post("/predict/vehicle")
-async def predict_vehicle(file: UploadFile = File(...)):
-    print(f"AI Service (Vehicle): 正在分析車輛... {file.filename}")
-    time.sleep(random.uniform(0.2, 0.5))
-    car_count = random.choices([0, 1, 2, 3], weights=[0.2, 0.5, 0.2, 0.1])[0]
-    boxes = []
-    for _ in range(car_count):
-        w = random.uniform(0.15, 0.30)
-        h = random.uniform(0.15, 0.25)
-
-        # 50% 機率違規，50% 機率安全
-        is_violation_attempt = random.choice([True, False])
-
-        if is_violation_attempt:
-            # 違規模式
-            # 紅線在 y=0.83 附近
-            yc = random.uniform(0.75, 0.90)
-            xc = random.uniform(w / 2, 1.0 - w / 2)
-        else:
-            # 安全模式
-            yc = random.uniform(h / 2, 0.60)
-            xc = random.uniform(w / 2, 1.0 - w / 2)
-
-        boxes.append({
-            "box": [xc, yc, w, h],
-            "confidence": random.uniform(0.8, 0.99)
+from contextlib import asynccontextmanager
+from typing import List
+
+import uvicorn
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from PIL import Image
+
+DETECT_MS = float(os.getenv("MOCK_DETECT_MS", "40"))
+SEGMENT_MS = float(os.getenv("MOCK_SEGMENT_MS", "120"))
+JITTER_MS = float(os.getenv("MOCK_JITTER_MS", "0"))
+WORKERS = int(os.getenv("MOCK_WORKERS", "1"))
+SEED = int(os.getenv("MOCK_SEED", "0"))
+
+VEHICLE_MODELS = {"yolov13n", "yolov13s", "yolov13m", "yolov13l", "yolov13x",
+                  "yolov8n", "yolov8s", "yolov8m", "yolov8l", "yolov8x"}
+
+gpu = None
+stats = {"requests": 0, "images": 0, "busy_seconds": 0.0}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global gpu
+    # WORKERS 可能由命令列參數覆寫，啟動時才建立
+    gpu = asyncio.Semaphore(max(1, WORKERS))
+    yield
+
+
+app = FastAPI(title="Mock YOLO service", lifespan=lifespan)
+
+
+def frame_rng(image_data: bytes, model: str) -> random.Random:
+    """Same image + model + seed -> same detections and latency"""
+    digest = hashlib.blake2b(image_data, digest_size=8, key=f"{SEED}:{model}".encode()).digest()
+    return random.Random(int.from_bytes(digest, "big"))
+
+
+def image_size(image_data: bytes):
+    try:
+        # 只讀表頭，不解碼像素
+        return Image.open(io.BytesIO(image_data)).size
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Image processing failed: {e}")
+
+
+def fake_detections(rng: random.Random, width: int, height: int):
+    # 紅線在畫面底部 (y ≈ 0.83)，約一半的車停在紅線上
+    detections = []
+    for _ in range(rng.choices([0, 1, 2, 3], weights=[0.2, 0.5, 0.2, 0.1])[0]):
+        w = rng.uniform(0.15, 0.30)
+        h = rng.uniform(0.15, 0.25)
+        yc = rng.uniform(0.75, 0.90) if rng.random() < 0.5 else rng.uniform(h / 2, 0.60)
+        xc = rng.uniform(w / 2, 1.0 - w / 2)
+        detections.append({
+            "bbox": [(xc - w / 2) * width, (yc - h / 2) * height, (xc + w / 2) * width, (yc + h / 2) * height],
+            "confidence": rng.uniform(0.8, 0.99),
+            "class_id": 2,
+            "class_name": "car"
         })
+    return detections
 
+
+def fake_segments(rng: random.Random, width: int, height: int):
+    if rng.random() < 0.2:
+        return []
+    y1, y2 = 0.80 * height, 0.86 * height
+    return [{
+        "class_id": 0,
+        "class_name": "red_line",
+        "confidence": rng.uniform(0.8, 0.99),
+        "bbox": [0.0, y1, float(width), y2],
+        "polygon": [[0.0, y1], [float(width), y1], [float(width), y2], [0.0, y2]]
+    }]
+
+
+async def run_model(rng: random.Random, base_ms: float) -> float:
+    """Hold one GPU slot for the simulated inference time; returns it in seconds"""
+    seconds = (base_ms + rng.uniform(0, JITTER_MS)) / 1000
+    async with gpu:
+        await asyncio.sleep(seconds)
+    stats["images"] += 1
+    stats["busy_seconds"] += seconds
+    return seconds
+
+
+async def infer(image_data: bytes, model: str, width: int, height: int):
+    rng = frame_rng(image_data, model)
+    if model in VEHICLE_MODELS:
+        seconds = await run_model(rng, DETECT_MS)
+        return "detections", fake_detections(rng, width, height), seconds
+    seconds = await run_model(rng, SEGMENT_MS)
+    return "segments", fake_segments(rng, width, height), seconds
+
+
+def image_info(width: int, height: int):
+    return {"width": width, "height": height, "channels": 3}
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    return {"ready": True, "mock": True}
+
+
+@app.get("/stats")
+async def get_stats():
+    return {**stats, "detect_ms": DETECT_MS, "segment_ms": SEGMENT_MS, "jitter_ms": JITTER_MS,
+            "workers": WORKERS, "seed": SEED}
+
+
+@app.post("/detect")
+async def detect(image: UploadFile = File(...), model: str = Form("yolov13n")):
+    start = time.perf_counter()
+    stats["requests"] += 1
+    data = await image.read()
+    width, height = image_size(data)
+    _, detections, seconds = await infer(data, model, width, height)
     return {
-        "model": "YOLO",
-        "car_count": car_count,
-        "boxes": boxes
+        "success": True,
+        "model_used": model,
+        "inference_time": round(seconds, 3),
+        "detections": detections,
+        "num_detections": len(detections),
+        "image_info": image_info(width, height),
+        "timings": {"inference": round(seconds * 1000, 2), "total": round((time.perf_counter() - start) * 1000, 2)}
     }
 
 
-# 模擬模型 B
-@app.post("/predict/redline")
-async def predict_redline(file: UploadFile = File(...)):
-    print(f"AI (RedLine): 分析中...")
-    time.sleep(random.uniform(0.1, 0.3))
+@app.post("/segment")
+async def segment(image: UploadFile = File(...), model: str = Form("yolov11m-seg")):
+    start = time.perf_counter()
+    stats["requests"] += 1
+    data = await image.read()
+    width, height = image_size(data)
+    _, segments, seconds = await infer(data, model, width, height)
+    return {
+        "success": True,
+        "model_used": model,
+        "inference_time": round(seconds, 3),
+        "segments": segments,
+        "num_segments": len(segments),
+        "image_info": image_info(width, height),
+        "timings": {"inference": round(seconds * 1000, 2), "total": round((time.perf_counter() - start) * 1000, 2)}
+    }
 
-    has_red_line = random.random() > 0.2
 
-    red_line_box = []
-    if has_red_line:
-        # [x1, y1, x2, y2]
-        red_line_box = [0, 400, 640, 480]
+@app.post("/analyze")
+async def analyze(image: UploadFile = File(...), models: List[str] = Form(...)):
+    start = time.perf_counter()
+    stats["requests"] += 1
+    names = list(dict.fromkeys(m.strip() for field in models for m in field.split(",") if m.strip()))
+    if not names:
+        raise HTTPException(status_code=400, detail="At least one model is required")
+    data = await image.read()
+    width, height = image_size(data)
+    outputs = await asyncio.gather(*(infer(data, name, width, height) for name in names))
 
+    detections, segments, inference_time = [], [], {}
+    for name, (kind, items, seconds) in zip(names, outputs):
+        inference_time[name] = round(seconds, 3)
+        for item in items:
+            item["model"] = name
+        (segments if kind == "segments" else detections).extend(items)
     return {
-        "model": "RedLine-Seg",
-        "red_line_detected": has_red_line,
-        "red_line_box": red_line_box
+        "success": True,
+        "models_used": names,
+        "inference_time": inference_time,
+        "detections": detections,
+        "segments": segments,
+        "num_detections": len(detections),
+        "num_segments": len(segments),
+        "image_info": image_info(width, height),
+        "timings": {"inference": round(max(o[2] for o in outputs) * 1000, 2),
+                    "total": round((time.perf_counter() - start) * 1000, 2)}
     }
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--detect-ms", type=float, default=DETECT_MS, help="vehicle model latency")
+    parser.add_argument("--segment-ms", type=float, default=SEGMENT_MS, help="segmentation model latency")
+    parser.add_argument("--jitter-ms", type=float, default=JITTER_MS, help="extra latency, uniform 0..N per image")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="images inferred concurrently")
+    parser.add_argument("--seed", type=int, default=SEED)
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    print("AI Service Started on port 5000...")
-    uvicorn.run(app, host="0.0.0.0", port=5000)
+    args = parse_args()
+    DETECT_MS, SEGMENT_MS, JITTER_MS = args.detect_ms, args.segment_ms, args.jitter_ms
+    WORKERS, SEED = args.workers, args.seed
+    print(f"Mock AI service on {args.host}:{args.port} (detect {DETECT_MS} ms, segment {SEGMENT_MS} ms, "
+          f"jitter {JITTER_MS} ms, {WORKERS} worker(s), seed {SEED})")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,121 @@
+"""
+Inference backend selection for YOLO weights
+
+The same model can be served from several formats produced by
+`export_models.py`:
+
+    pytorch      {name}.pt
+    torchscript  {name}.torchscript
+    onnx         {name}.onnx                (onnxruntime)
+    openvino     {name}_openvino_model/     (OpenVINO IR, CPU)
+
+ultralytics' YOLO() loads all of them with the same predict API. With
+backend "auto" a GPU host keeps PyTorch; CPU-only hosts pick the fastest
+exported format that exists on disk.
+
+Exports with a fixed batch dimension cannot take the micro-batcher's
+multi-image batches; `batch_limit()` reports the largest batch a loaded
+file accepts so the service can cap its batches for that model.
+"""
+
+import os
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("pytorch", "torchscript", "onnx", "openvino")
+
+# 無 GPU 時的優先順序 (由快到慢)
+CPU_PREFERENCE = ("openvino", "onnx", "torchscript", "pytorch")
+
+# backend -> ultralytics export format
+EXPORT_FORMATS = {"torchscript": "torchscript", "onnx": "onnx", "openvino": "openvino"}
+
+
+def weights_path(model_dir: str, model_name: str, backend: str) -> str:
+    if backend == "pytorch":
+        return os.path.join(model_dir, f"{model_name}.pt")
+    if backend == "torchscript":
+        return os.path.join(model_dir, f"{model_name}.torchscript")
+    if backend == "onnx":
+        return os.path.join(model_dir, f"{model_name}.onnx")
+    if backend == "openvino":
+        return os.path.join(model_dir, f"{model_name}_openvino_model")
+    raise ValueError(f"Unknown backend '{backend}'. Choose from: {', '.join(BACKENDS)}")
+
+
+def available_backends(model_dir: str, model_name: str) -> List[str]:
+    return [b for b in BACKENDS if os.path.exists(weights_path(model_dir, model_name, b))]
+
+
+def cuda_available() -> bool:
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except ImportError:
+        return False
+
+
+def parse_overrides(spec: str) -> Dict[str, str]:
+    """Parse "yolov13n=onnx,yolov11m-segv2=openvino" into a dict"""
+    overrides = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, backend = item.split("=", 1)
+            overrides[name.strip()] = backend.strip().lower()
+    return overrides
+
+
+def resolve(model_dir: str, model_name: str, preferred: str = "auto") -> Tuple[str, str]:
+    """Return (backend, path) to load for `model_name`.
+
+    An explicit backend whose export is missing falls back to PyTorch weights.
+    """
+    if preferred != "auto":
+        path = weights_path(model_dir, model_name, preferred)
+        if os.path.exists(path) or preferred == "pytorch":
+            return preferred, path
+        logger.warning(f"{path} not found, falling back to PyTorch weights for {model_name}")
+        return "pytorch", weights_path(model_dir, model_name, "pytorch")
+
+    if not cuda_available():
+        for backend in CPU_PREFERENCE:
+            path = weights_path(model_dir, model_name, backend)
+            if os.path.exists(path):
+                return backend, path
+
+    return "pytorch", weights_path(model_dir, model_name, "pytorch")
+
+
+def batch_limit(backend: str, path: str) -> Optional[int]:
+    """Largest batch the exported graph accepts, or None when the batch dimension is dynamic.
+
+    TorchScript is traced at batch 1. For ONNX / OpenVINO the input shape is
+    read from the file; if it cannot be inspected, assume batch 1.
+    """
+    if backend == "pytorch":
+        return None
+    try:
+        if backend == "onnx":
+            import onnxruntime
+            dim = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"]).get_inputs()[0].shape[0]
+            return None if not isinstance(dim, int) else dim
+        if backend == "openvino":
+            import openvino
+            xml = next(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".xml"))
+            dim = openvino.Core().read_model(xml).inputs[0].get_partial_shape()[0]
+            return None if dim.is_dynamic else dim.get_length()
+    except Exception as e:
+        logger.warning(f"Could not read the batch dimension of {path} ({e}), assuming batch 1")
+    return 1
+
+
+def load(model_dir: str, model_name: str, preferred: str = "auto", task: Optional[str] = None):
+    """Load `model_name` with the selected backend. Returns (backend, YOLO model, batch limit)."""
+    from ultralytics import YOLO
+
+    backend, path = resolve(model_dir, model_name, preferred)
+    limit = batch_limit(backend, path)
+    logger.info(f"Loading {model_name} model ({backend}: {path}, batch {'dynamic' if limit is None else limit})...")
+    return backend, YOLO(path, task=task), limit
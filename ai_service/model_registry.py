@@ -0,0 +1,90 @@
+"""
+Thread-safe model registry with LRU eviction and pinning
+
+- A per-model lock guarantees that concurrent first requests load a model once.
+- At most `max_resident` models stay in memory; the least recently used
+  unpinned model is evicted when a new one is loaded. The model being
+  loaded is never its own victim: if everything else is pinned, the limit
+  is exceeded with a warning instead.
+- Models declared for preloading are pinned and never evicted.
+"""
+
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    def __init__(self, loader: Callable[[str], Any], max_resident: int = 4):
+        self.loader = loader
+        self.max_resident = max(1, max_resident)
+        self._models: "OrderedDict[str, Any]" = OrderedDict()
+        self._pinned = set()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, name: str):
+        """Return the model, loading it on first use"""
+        with self._lock:
+            model = self._models.get(name)
+            if model is not None:
+                self._models.move_to_end(name)
+                return model
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        # 同一模型只載入一次；其他模型的載入與查詢不受影響
+        with load_lock:
+            with self._lock:
+                model = self._models.get(name)
+                if model is not None:
+                    self._models.move_to_end(name)
+                    return model
+
+            try:
+                model = self.loader(name)
+            except Exception:
+                # 載入失敗不留下鎖，避免錯誤名稱讓 _load_locks 無限增長
+                with self._lock:
+                    self._load_locks.pop(name, None)
+                raise
+
+            with self._lock:
+                self._models[name] = model
+                self.loads += 1
+                self._evict_locked(keep=name)
+            return model
+
+    def pin(self, name: str):
+        with self._lock:
+            self._pinned.add(name)
+
+    def _evict_locked(self, keep: str):
+        while len(self._models) > self.max_resident:
+            # 剛載入的模型不可淘汰，否則每次請求都要重新從磁碟載入
+            victim = next((n for n in self._models if n not in self._pinned and n != keep), None)
+            if victim is None:
+                logger.warning(f"{len(self._models)} resident models exceed MAX_RESIDENT_MODELS="
+                               f"{self.max_resident} (all others pinned), keeping {keep}")
+                return
+            del self._models[victim]
+            self.evictions += 1
+            logger.info(f"Evicted model {victim} (LRU)")
+
+    def loaded(self) -> List[str]:
+        with self._lock:
+            return list(self._models.keys())
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "resident": list(self._models.keys()),
+                "pinned": sorted(self._pinned),
+                "max_resident": self.max_resident,
+                "loads": self.loads,
+                "evictions": self.evictions
+            }
@@ -33,31 +33,153 @@ Usage:
 Author: MohibShaikh
 """
 
+import os
 import time
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
 from typing import List, Dict, Any, Optional
 from pathlib import Path
 
 import cv2
 import numpy as np
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from pydantic import BaseModel
 import uvicorn
 
+from batching import MicroBatcher, AdmissionControl, Overloaded
+from model_registry import ModelRegistry
+from metrics import StageTimer
+import metrics
+import model_backends
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Micro-batching: gather requests arriving within BATCH_WINDOW_MS (up to BATCH_MAX_SIZE images)
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "10"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+
+# Bounded inference pool: blocking decode/inference never runs on the event loop.
+# Beyond MAX_PENDING_REQUESTS in-flight requests, new ones get 503 + Retry-After.
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+MAX_PENDING_REQUESTS = int(os.getenv("MAX_PENDING_REQUESTS", "32"))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "1"))
+
+# Startup: preload (and pin) these models, run WARMUP_RUNS dummy inferences at each
+# WARMUP_SIZES (WxH), then report ready on /ready. At most MAX_RESIDENT_MODELS stay loaded.
+PRELOAD_MODELS = [m.strip() for m in os.getenv("PRELOAD_MODELS", "yolov13n,yolov11m-segv2").split(",") if m.strip()]
+WARMUP_RUNS = int(os.getenv("WARMUP_RUNS", "2"))
+WARMUP_SIZES = [tuple(int(v) for v in size.lower().split("x"))
+                for size in os.getenv("WARMUP_SIZES", "320x240,160x120").split(",") if size.strip()]
+MAX_RESIDENT_MODELS = int(os.getenv("MAX_RESIDENT_MODELS", "4"))
+
+# Model names accepted by /detect; /analyze additionally accepts the segmentation
+# models and anything preloaded. 其他名稱一律 400，不會觸發載入或 LRU 淘汰
+AVAILABLE_MODELS = ["yolov13n", "yolov13s", "yolov13m", "yolov13l", "yolov13x",
+                    "yolov8n", "yolov8s", "yolov8m", "yolov8l", "yolov8x", "yolov11m-seg"]
+ANALYZE_MODELS = list(dict.fromkeys(AVAILABLE_MODELS + ["yolov11m-segv2"] + PRELOAD_MODELS))
+
+# Inference backend per model: pytorch / torchscript / onnx / openvino / auto
+# (auto = PyTorch on GPU, otherwise the fastest exported format found in MODEL_DIR)
+MODEL_DIR = os.getenv("MODEL_DIR", ".")
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "auto").lower()
+MODEL_BACKEND_OVERRIDES = model_backends.parse_overrides(os.getenv("MODEL_BACKENDS", ""))
+
+readiness = {"ready": False, "warmed_up": [], "error": None}
+
+executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+batcher = MicroBatcher(window_ms=BATCH_WINDOW_MS, max_batch=BATCH_MAX_SIZE, executor=executor)
+admission = AdmissionControl(max_pending=MAX_PENDING_REQUESTS)
+
+
+# model name -> backend it was loaded with
+loaded_backends = {}
+# model name -> largest batch its export accepts (absent: dynamic batch)
+batch_limits = {}
+
+
+def _load_weights(model_name: str):
+    preferred = MODEL_BACKEND_OVERRIDES.get(model_name, MODEL_BACKEND)
+    backend, model, limit = model_backends.load(MODEL_DIR, model_name, preferred)
+    loaded_backends[model_name] = backend
+    if limit is None:
+        batch_limits.pop(model_name, None)
+    else:
+        batch_limits[model_name] = limit
+    logger.info(f"Model {model_name} loaded successfully ({backend})")
+    return model
+
+
+registry = ModelRegistry(loader=_load_weights, max_resident=MAX_RESIDENT_MODELS)
+
+
+def warm_up_model(model_name: str):
+    """Load, pin and run dummy inferences so the first real frame is fast"""
+    registry.pin(model_name)
+    yolo_model = registry.get(model_name)
+    for width, height in WARMUP_SIZES:
+        dummy = np.zeros((height, width, 3), dtype=np.uint8)
+        for _ in range(WARMUP_RUNS):
+            yolo_model(dummy, verbose=False)
+    logger.info(f"Model {model_name} warmed up at {WARMUP_SIZES}")
+
+
+async def warm_up():
+    try:
+        for model_name in PRELOAD_MODELS:
+            await run_blocking(warm_up_model, model_name)
+            readiness["warmed_up"].append(model_name)
+        readiness["ready"] = True
+        logger.info("AI service ready")
+    except Exception as e:
+        readiness["error"] = str(e)
+        logger.error(f"Warm-up failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 背景暖機：/health 可立即回應，暖機完成後 /ready 才回 200
+    warmup_task = asyncio.create_task(warm_up())
+    yield
+    warmup_task.cancel()
+    await batcher.close()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="YOLOv13 Real-Time Detection API",
     description="Scalable real-time object detection supporting multiple YOLO models",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-# Global model cache
-models = {}
+INFERENCE_ENDPOINTS = ("/detect", "/segment", "/analyze")
+
+
+@app.middleware("http")
+async def frame_id_middleware(request: Request, call_next):
+    """Echo the caller's X-Frame-Id and log it with the outcome, so backend and AI logs line up"""
+    frame_id = request.headers.get("X-Frame-Id")
+    start = time.perf_counter()
+    response = await call_next(request)
+    path = request.url.path
+    if path in INFERENCE_ENDPOINTS:
+        metrics.REQUESTS.labels(path.lstrip("/"), str(response.status_code)).inc()
+        if frame_id:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            log = logger.warning if response.status_code >= 400 else logger.info
+            log(f"[{frame_id}] {path} -> {response.status_code} in {elapsed_ms:.1f} ms")
+    if frame_id:
+        response.headers["X-Frame-Id"] = frame_id
+    return response
+
 
 class DetectionResult(BaseModel):
     """Detection result model"""
@@ -67,6 +189,7 @@ class DetectionResult(BaseModel):
     detections: List[Dict[str, Any]]
     num_detections: int
     image_info: Dict[str, int]
+    timings: Dict[str, float] = {}
 
 
 class SegmentationResult(BaseModel):
@@ -76,21 +199,29 @@ class SegmentationResult(BaseModel):
     segments: List[Dict[str, Any]]
     num_segments: int
     image_info: Dict[str, int]
+    timings: Dict[str, float] = {}
+
+
+class AnalysisResult(BaseModel):
+    """Combined result of several models run on one decoded image"""
+    success: bool
+    models_used: List[str]
+    inference_time: Dict[str, float]
+    detections: List[Dict[str, Any]]
+    segments: List[Dict[str, Any]]
+    num_detections: int
+    num_segments: int
+    image_info: Dict[str, int]
+    timings: Dict[str, float] = {}
 
 
 def load_model(model_name: str):
-    """Load and cache YOLO model"""
-    if model_name not in models:
-        try:
-            from ultralytics import YOLO
-            logger.info(f"Loading {model_name} model...")
-            models[model_name] = YOLO(f"{model_name}.pt")
-            logger.info(f"Model {model_name} loaded successfully")
-        except Exception as e:
-            logger.error(f"Failed to load {model_name}: {e}")
-            raise HTTPException(status_code=500, detail=f"Model loading failed: {e}")
-    
-    return models[model_name]
+    """Load and cache YOLO model (blocking; call via run_blocking)"""
+    try:
+        return registry.get(model_name)
+    except Exception as e:
+        logger.error(f"Failed to load {model_name}: {e}")
+        raise HTTPException(status_code=500, detail=f"Model loading failed: {e}")
 
 
 def process_image(image_data: bytes) -> np.ndarray:
@@ -108,7 +239,81 @@ def process_image(image_data: bytes) -> np.ndarray:
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Image processing failed: {e}")
 
-        
+
+async def run_blocking(func, *args):
+    """Run a blocking call on the bounded inference executor"""
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(func, *args))
+
+
+@asynccontextmanager
+async def inference_slot():
+    """Admission control: fail fast with 503 when the inference pool is saturated"""
+    try:
+        async with admission.slot():
+            yield
+    except Overloaded as e:
+        metrics.REJECTED.inc()
+        raise HTTPException(
+            status_code=503,
+            detail=f"Inference pool busy: {e}",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+
+
+def extract_detections(yolo_model, result) -> List[Dict[str, Any]]:
+    """Convert one ultralytics result into detection dicts"""
+    detections = []
+    if result.boxes is not None:
+        boxes = result.boxes
+        xyxy = boxes.xyxy.cpu().numpy()
+        confs = boxes.conf.cpu().numpy()
+        classes = boxes.cls.cpu().numpy().astype(int)
+
+        for i in range(len(boxes)):
+            detections.append({
+                "bbox": xyxy[i].tolist(),  # [x1, y1, x2, y2]
+                "confidence": float(confs[i]),
+                "class_id": int(classes[i]),
+                "class_name": yolo_model.names[int(classes[i])]
+            })
+    return detections
+
+
+def extract_segments(yolo_model, result) -> List[Dict[str, Any]]:
+    """Convert one ultralytics segmentation result into segment dicts"""
+    segments = []
+    if result.masks is not None:
+        boxes = result.boxes
+        xyxy = boxes.xyxy.cpu().numpy()
+        confs = boxes.conf.cpu().numpy()
+        classes = boxes.cls.cpu().numpy().astype(int)
+
+        for i, poly in enumerate(result.masks.xy):
+            segments.append({
+                "class_id": int(classes[i]),
+                "class_name": yolo_model.names[int(classes[i])],
+                "confidence": float(confs[i]),
+                "bbox": xyxy[i].tolist(),
+                "polygon": poly.tolist()   # pixel coordinates
+            })
+    return segments
+
+
+def extract_any(yolo_model, result):
+    """Segmentation models yield ("segments", ...), detectors ("detections", ...)"""
+    if result.masks is not None or yolo_model.task == "segment":
+        return "segments", extract_segments(yolo_model, result)
+    return "detections", extract_detections(yolo_model, result)
+
+
+def image_info(img: np.ndarray) -> Dict[str, int]:
+    return {
+        "width": img.shape[1],
+        "height": img.shape[0],
+        "channels": img.shape[2]
+    }
+
+
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
@@ -127,22 +332,48 @@ async def root():
         },
         "endpoints": {
             "/detect": "POST - Real-time object detection",
+            "/segment": "POST - Instance segmentation",
+            "/analyze": "POST - Detection + segmentation on one upload",
             "/models": "GET - Available models",
+            "/health": "GET - Liveness probe",
+            "/ready": "GET - Readiness (models preloaded and warmed up)",
+            "/batching": "GET - Micro-batching queue metrics",
+            "/metrics": "GET - Prometheus metrics (stage latency, queues, errors)",
             "/performance": "GET - Performance metrics",
             "/docs": "GET - API documentation"
         }
     }
 
 
+@app.get("/health")
+async def health():
+    """Liveness probe: the event loop is responsive"""
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once every PRELOAD_MODELS entry is loaded and warmed up"""
+    body = {**readiness, "preload_models": PRELOAD_MODELS}
+    if not readiness["ready"]:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+
 @app.get("/models")
 async def get_models():
     """Get available YOLO models for real-time detection"""
-    available_models = ["yolov13n", "yolov13s", "yolov13m", "yolov13l", "yolov13x", 
-                       "yolov8n", "yolov8s", "yolov8m", "yolov8l", "yolov8x", "yolov11m-seg"]
-    
     return {
-        "available_models": available_models,
-        "loaded_models": list(models.keys()),
+        "available_models": AVAILABLE_MODELS,
+        "analyze_models": ANALYZE_MODELS,
+        "loaded_models": registry.loaded(),
+        "registry": registry.snapshot(),
+        "backends": {
+            "default": MODEL_BACKEND,
+            "overrides": MODEL_BACKEND_OVERRIDES,
+            "loaded": {name: loaded_backends.get(name) for name in registry.loaded()},
+            "batch_limits": dict(batch_limits)
+        },
         "recommended_for_realtime": "yolov13n",
         "model_info": {
             "nano_models": ["yolov13n", "yolov8n"],
@@ -172,46 +403,37 @@ async def detect_objects(
     """
     
     # Validate model name
-    valid_models = ["yolov13n", "yolov13s", "yolov13m", "yolov13l", "yolov13x",
-                   "yolov8n", "yolov8s", "yolov8m", "yolov8l", "yolov8x", "yolov11m-seg"]
-    
-    if model not in valid_models:
+    if model not in AVAILABLE_MODELS:
         raise HTTPException(
             status_code=400, 
-            detail=f"Invalid model. Choose from: {', '.join(valid_models)}"
+            detail=f"Invalid model. Choose from: {', '.join(AVAILABLE_MODELS)}"
         )
     
     # Validate image
     if not image.content_type or not image.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File must be an image")
     
+    timer = StageTimer("detect")
     try:
-        # Read and process image
-        image_data = await image.read()
-        img = process_image(image_data)
-        
-        # Load model
-        yolo_model = load_model(model)
-        
-        # Run inference with timing
-        start_time = time.time()
-        results = yolo_model(img, conf=conf, iou=iou, verbose=False)
-        inference_time = time.time() - start_time
-        
-        # Process results
-        detections = []
-        if len(results) > 0 and results[0].boxes is not None:
-            boxes = results[0].boxes
-            
-            for i in range(len(boxes)):
-                box = boxes[i]
-                detection = {
-                    "bbox": box.xyxy[0].cpu().numpy().tolist(),  # [x1, y1, x2, y2]
-                    "confidence": float(box.conf[0]),
-                    "class_id": int(box.cls[0]),
-                    "class_name": yolo_model.names[int(box.cls[0])]
-                }
-                detections.append(detection)
+        async with inference_slot():
+            # Read and process image
+            with timer.stage("read"):
+                image_data = await image.read()
+            with timer.stage("decode"):
+                img = await run_blocking(process_image, image_data)
+
+            # Load model
+            with timer.stage("model_load"):
+                yolo_model = await run_blocking(load_model, model)
+
+            # Run inference (batched with concurrent requests for the same model)
+            with timer.stage("batch"):
+                detections, inference_time = await batcher.infer(
+                    model, yolo_model, img, conf, iou,
+                    postprocess=partial(extract_detections, yolo_model),
+                    max_batch=batch_limits.get(model)
+                )
+            timer.record_models({model: inference_time})
         
         # Return results
         return DetectionResult(
@@ -220,11 +442,8 @@ async def detect_objects(
             inference_time=round(inference_time, 3),
             detections=detections,
             num_detections=len(detections),
-            image_info={
-                "width": img.shape[1],
-                "height": img.shape[0],
-                "channels": img.shape[2]
-            }
+            image_info=image_info(img),
+            timings=timer.finish()
         )
         
     except HTTPException:
@@ -245,49 +464,132 @@ async def segment_objects(
     if not image.content_type or not image.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
 
-    # 2. Load image
-    image_data = await image.read()
-    img = process_image(image_data)
+    timer = StageTimer("segment")
+    async with inference_slot():
+        # 2. Load image
+        with timer.stage("read"):
+            image_data = await image.read()
+        with timer.stage("decode"):
+            img = await run_blocking(process_image, image_data)
+
+        # 3. Load model
+        with timer.stage("model_load"):
+            yolo_model = await run_blocking(load_model, model)
+
+        # 4. Inference (batched, post-processed on the worker thread)
+        with timer.stage("batch"):
+            segments, inference_time = await batcher.infer(
+                model, yolo_model, img, conf, iou,
+                postprocess=partial(extract_segments, yolo_model),
+                max_batch=batch_limits.get(model)
+            )
+        timer.record_models({model: inference_time})
 
-    # 3. Load model
-    yolo_model = load_model(model)
+    return SegmentationResult(
+        success=True,
+        model_used=model,
+        inference_time=round(inference_time, 3),
+        segments=segments,
+        num_segments=len(segments),
+        image_info=image_info(img),
+        timings=timer.finish()
+    )
 
-    # 4. Inference
-    start_time = time.time()
-    results = yolo_model(img, conf=conf, iou=iou, verbose=False)
-    inference_time = time.time() - start_time
 
+@app.post("/analyze", response_model=AnalysisResult)
+async def analyze_image(
+    image: UploadFile = File(...),
+    models: List[str] = Form(..., description="Models to run on the same image (repeat the field)"),
+    conf: float = Form(0.25, ge=0.0, le=1.0),
+    iou: float = Form(0.45, ge=0.0, le=1.0)
+):
+    """
+    Single-pass analysis: decode the upload once and run every requested model on it
+
+    Detection models contribute to `detections`, segmentation models to `segments`.
+    Each item is tagged with the model that produced it.
+    """
+    if not image.content_type or not image.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="File must be an image")
+
+    # 允許 "a,b" 或重複欄位兩種寫法
+    model_names = [m.strip() for field in models for m in field.split(",") if m.strip()]
+    if not model_names:
+        raise HTTPException(status_code=400, detail="At least one model is required")
+    unknown = [m for m in model_names if m not in ANALYZE_MODELS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid model(s) {', '.join(unknown)}. Choose from: {', '.join(ANALYZE_MODELS)}"
+        )
+
+    detections = []
     segments = []
+    timings = {}
+    timer = StageTimer("analyze")
 
-    r = results[0]
-    if r.masks is not None:
-        masks = r.masks
-        boxes = r.boxes
-
-        for i, poly in enumerate(masks.xy):
-            segment = {
-                "class_id": int(boxes.cls[i]),
-                "class_name": yolo_model.names[int(boxes.cls[i])],
-                "confidence": float(boxes.conf[i]),
-                "bbox": boxes.xyxy[i].cpu().numpy().tolist(),
-                "polygon": poly.tolist()   # normalized coordinates
-            }
-            segments.append(segment)
+    try:
+        async with inference_slot():
+            with timer.stage("read"):
+                image_data = await image.read()
+            with timer.stage("decode"):
+                img = await run_blocking(process_image, image_data)
+
+            names = list(dict.fromkeys(model_names))
+            with timer.stage("model_load"):
+                loaded = [await run_blocking(load_model, name) for name in names]
+
+            # 各模型各自進入自己的 batch 佇列，同時執行
+            with timer.stage("batch"):
+                outputs = await asyncio.gather(*(
+                    batcher.infer(name, yolo_model, img, conf, iou, postprocess=partial(extract_any, yolo_model),
+                                  max_batch=batch_limits.get(name))
+                    for name, yolo_model in zip(names, loaded)
+                ))
+
+        for name, ((kind, items), inference_time) in zip(names, outputs):
+            timings[name] = round(inference_time, 3)
+            for item in items:
+                item["model"] = name
+            (segments if kind == "segments" else detections).extend(items)
+        timer.record_models({name: seconds for name, (_, seconds) in zip(names, outputs)})
 
-    return SegmentationResult(
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Analysis failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+
+    return AnalysisResult(
         success=True,
-        model_used=model,
-        inference_time=round(inference_time, 3),
+        models_used=list(timings.keys()),
+        inference_time=timings,
+        detections=detections,
         segments=segments,
+        num_detections=len(detections),
         num_segments=len(segments),
-        image_info={
-            "width": img.shape[1],
-            "height": img.shape[0],
-            "channels": img.shape[2]
-        }
+        image_info=image_info(img),
+        timings=timer.finish()
     )
 
 
+@app.get("/batching")
+async def get_batching_metrics():
+    """Queue depth, batch size and wait-time histograms per model"""
+    return {
+        **batcher.snapshot(),
+        "executor_workers": INFERENCE_WORKERS,
+        "admission": admission.as_dict()
+    }
+
+
+@app.get("/metrics")
+async def get_prometheus_metrics():
+    """Prometheus exposition: stage latency histograms, batch queue depth, admission and error counters"""
+    metrics.refresh(batcher, admission)
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/performance")
 async def get_performance_metrics():
     """Get real-time performance metrics and scaling information"""
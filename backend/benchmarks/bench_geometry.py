@@ -0,0 +1,85 @@
+"""Benchmark car x zone overlap: original per-pair loop vs geometry.py modes.
+
+Usage (from backend/):
+    python benchmarks/bench_geometry.py
+    python benchmarks/bench_geometry.py --sizes 50x50 200x200 --repeat 20
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geometry import overlap_matrix, OVERLAP_MODES  # noqa: E402
+
+
+def loop_intersections(car_boxes, zone_boxes):
+    """The pre-vectorization nested loop (any positive bbox intersection)."""
+    hits = 0
+    for c in car_boxes:
+        for z in zone_boxes:
+            if min(c[2], z[2]) - max(c[0], z[0]) > 0 and min(c[3], z[3]) - max(c[1], z[1]) > 0:
+                hits += 1
+                break
+    return hits
+
+
+def make_scene(rng, n_cars, n_zones, width, height):
+    cars = []
+    for _ in range(n_cars):
+        w, h = rng.uniform(0.08, 0.25) * width, rng.uniform(0.08, 0.2) * height
+        x, y = rng.uniform(0, width - w), rng.uniform(0, height - h)
+        cars.append([x, y, x + w, y + h])
+
+    zones = []
+    for _ in range(n_zones):
+        # 斜線型標線：細長多邊形
+        x0, y0 = rng.uniform(0, width), rng.uniform(0, height)
+        x1, y1 = rng.uniform(0, width), rng.uniform(0, height)
+        t = rng.uniform(3, 10)
+        polygon = [[x0, y0 - t], [x1, y1 - t], [x1, y1 + t], [x0, y0 + t]]
+        xs, ys = [p[0] for p in polygon], [p[1] for p in polygon]
+        zones.append({"type": "Red Line", "bbox": [min(xs), min(ys), max(xs), max(ys)], "polygon": polygon})
+    return cars, zones
+
+
+def timeit(fn, repeat):
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", default=["10x10", "50x50", "100x100", "200x200"],
+                        help="CARSxZONES")
+    parser.add_argument("--frame", default="640x480")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.frame.split("x"))
+    rng = np.random.default_rng(0)
+
+    print(f"frame {width}x{height}, median of {args.repeat} runs (ms)")
+    print(f"{'cars x zones':>14s} {'loop':>9s} " + " ".join(f"{m:>9s}" for m in OVERLAP_MODES))
+    for size in args.sizes:
+        n_cars, n_zones = (int(v) for v in size.split("x"))
+        cars, zones = make_scene(rng, n_cars, n_zones, width, height)
+        zone_boxes = [z["bbox"] for z in zones]
+
+        row = [timeit(lambda: loop_intersections(cars, zone_boxes), args.repeat)]
+        for mode in OVERLAP_MODES:
+            row.append(timeit(lambda: overlap_matrix(cars, zones, width, height, mode=mode), args.repeat))
+        print(f"{size:>14s} " + " ".join(f"{v:9.3f}" for v in row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""Benchmark the per-frame hot paths of the backend and track regressions.
+
+Covers raw frame decoding and format detection, the motion-gate signature,
+JPEG encoding, yolo_to_bbox, car x zone overlap (every mode), box drawing
+and the post-inference classification step of detect_parking (zones from
+segments, overlap, tracker update, verdict). Inputs are synthetic and
+seeded, from QVGA to 1080p and 0 to 200 detections, so runs on the same
+machine are comparable.
+
+Usage (from backend/):
+    python benchmarks/bench_hotpaths.py run --label baseline
+    python benchmarks/bench_hotpaths.py run --filter overlap --repeat 50 --compare benchmarks/results/baseline.json
+    python benchmarks/bench_hotpaths.py compare benchmarks/results/baseline.json benchmarks/results/after.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+import PIL
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main.py 匯入時會建立資料表：改用暫存的 SQLite，不碰實際的資料庫
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.gettempdir(), "bench_hotpaths.db")
+
+import config  # noqa: E402
+from bench_geometry import make_scene  # noqa: E402
+from frame_store import encode_jpeg  # noqa: E402
+from geometry import OVERLAP_MODES, car_zone_types, find_violations  # noqa: E402
+from main import draw_violation_boxes, tracker_verdict, yolo_to_bbox, zones_from_segments  # noqa: E402
+from pixel_decoder import PixelDecoder  # noqa: E402
+from scene import luma_signature  # noqa: E402
+from tracker import ViolationTracker  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+RESOLUTIONS = {"QVGA": (320, 240), "VGA": (640, 480), "720p": (1280, 720), "1080p": (1920, 1080)}
+DETECTIONS = (0, 10, 50, 200)
+# 一般路口畫面的禁停區數量
+ZONES = 4
+
+
+class Fixtures:
+    """Seeded synthetic inputs, built once per size and shared by the cases."""
+
+    def __init__(self, seed=0):
+        self.seed = seed
+        self._cache = {}
+
+    def _get(self, key, build):
+        if key not in self._cache:
+            # hash() 每個行程不同，種子改用 CRC 以便跨次執行重現
+            self._cache[key] = build(np.random.default_rng([self.seed, zlib.crc32(repr(key).encode())]))
+        return self._cache[key]
+
+    def raw(self, res):
+        width, height = RESOLUTIONS[res]
+        # 平滑畫面 + 雜訊：格式偵測與 JPEG 的行為接近真實影像
+        def build(rng):
+            y, x = np.mgrid[0:height, 0:width]
+            word = ((x * 31 // width) | ((y * 63 // height) << 5) | (((x + y) * 31 // (width + height)) << 11))
+            word = word.astype(np.uint16) ^ rng.integers(0, 4, (height, width), dtype=np.uint16)
+            return bytearray(word.astype(">u2").tobytes())
+        return self._get(("raw", res), build)
+
+    def image(self, res):
+        width, height = RESOLUTIONS[res]
+        return self._get(("image", res), lambda rng: PixelDecoder().decode(self.raw(res), width, height))
+
+    def scene(self, res, n_cars):
+        width, height = RESOLUTIONS[res]
+        return self._get(("scene", res, n_cars), lambda rng: make_scene(rng, n_cars, ZONES, width, height))
+
+    def segments(self, res, n_cars):
+        """AI /segment output for the scene's zones (red, yellow, crosswalk, ...)."""
+        _, zones = self.scene(res, n_cars)
+        names = ("red_line", "yellow_line", "crosswalk", "red_line")
+        return [{"class_name": names[i % len(names)], "confidence": 0.9, "bbox": z["bbox"], "polygon": z["polygon"]}
+                for i, z in enumerate(zones)]
+
+    def yolo_boxes(self, n):
+        return self._get(("yolo", n), lambda rng: [
+            [float(v) for v in (rng.uniform(0.1, 0.9), rng.uniform(0.1, 0.9), rng.uniform(0.05, 0.3),
+                                rng.uniform(0.05, 0.3))] for _ in range(n)])
+
+
+def classify(fixtures, res, n_cars, tracker, clock):
+    """detect_parking after the AI round trip, without the DB writes and evidence files."""
+    width, height = RESOLUTIONS[res]
+    cars, _ = fixtures.scene(res, n_cars)
+    zones = zones_from_segments(fixtures.segments(res, n_cars))
+    car_types = [set() for _ in cars]
+    if cars and zones:
+        _, _, overlap = find_violations(cars, zones, width, height, mode=config.OVERLAP_MODE,
+                                        min_overlap=config.MIN_OVERLAP_FRACTION,
+                                        min_overlap_by_type=config.MIN_OVERLAP_BY_TYPE)
+        car_types = car_zone_types(overlap, zones, config.MIN_OVERLAP_FRACTION, config.MIN_OVERLAP_BY_TYPE)
+    # 固定畫面：每次呼叫視為下一張影像 (1 秒後)，追蹤器維持穩定狀態
+    clock[0] += 1.0
+    tracker.update(cars, car_types, now=clock[0])
+    return tracker_verdict(tracker)
+
+
+def build_cases(fixtures):
+    """name -> zero-argument callable; names are stable keys in the results file."""
+    decoder = PixelDecoder()
+    cases = {}
+    for res, (width, height) in RESOLUTIONS.items():
+        cases[f"decode/bgr565_be/{res}"] = (lambda r=res, w=width, h=height:
+                                            decoder.decode(fixtures.raw(r), w, h, "bgr565_be"))
+        cases[f"decode/yuv422/{res}"] = (lambda r=res, w=width, h=height:
+                                         decoder.decode(fixtures.raw(r), w, h, "yuv422"))
+        cases[f"detect_format/{res}"] = lambda r=res, w=width, h=height: decoder.detect(fixtures.raw(r), w, h)
+        cases[f"luma_signature/{res}"] = lambda r=res: luma_signature(fixtures.image(r))
+        cases[f"jpeg_encode/{res}"] = lambda r=res: encode_jpeg(fixtures.image(r), config.JPEG_QUALITY)
+        cases[f"draw_boxes/{res}/10"] = lambda r=res: draw_boxes(fixtures, r, 10)
+    cases["draw_boxes/1080p/200"] = lambda: draw_boxes(fixtures, "1080p", 200)
+
+    for n in DETECTIONS:
+        cases[f"yolo_to_bbox/{n}"] = lambda n=n: [yolo_to_bbox(b, 640, 480) for b in fixtures.yolo_boxes(n)]
+        for mode in OVERLAP_MODES:
+            cases[f"overlap/{mode}/VGA/{n}"] = lambda n=n, m=mode: overlap(fixtures, "VGA", n, m)
+        cases[f"classify/VGA/{n}"] = classify_case(fixtures, "VGA", n)
+    cases["overlap/mask/1080p/200"] = lambda: overlap(fixtures, "1080p", 200, "mask")
+    cases["classify/1080p/200"] = classify_case(fixtures, "1080p", 200)
+    return cases
+
+
+def draw_boxes(fixtures, res, n_cars):
+    cars, zones = fixtures.scene(res, n_cars)
+    boxes = [z["bbox"] for z in zones]
+    return draw_violation_boxes(fixtures.image(res), cars, boxes[0::3], boxes[1::3], boxes[2::3],
+                                quality=config.JPEG_QUALITY)
+
+
+def overlap(fixtures, res, n_cars, mode):
+    width, height = RESOLUTIONS[res]
+    cars, zones = fixtures.scene(res, n_cars)
+    return find_violations(cars, zones, width, height, mode=mode, min_overlap=config.MIN_OVERLAP_FRACTION,
+                           min_overlap_by_type=config.MIN_OVERLAP_BY_TYPE)
+
+
+def classify_case(fixtures, res, n_cars):
+    tracker = ViolationTracker(dwell_seconds=30.0)
+    clock = [0.0]
+    return lambda: classify(fixtures, res, n_cars, tracker, clock)
+
+
+def measure(fn, repeat, min_time):
+    """Median/min/p95 in ms over at least `repeat` runs and `min_time` seconds, after one warm-up call."""
+    fn()
+    samples = []
+    deadline = time.perf_counter() + min_time
+    while len(samples) < repeat or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    ms = np.array(samples) * 1000
+    return {
+        "median_ms": round(float(np.median(ms)), 4),
+        "min_ms": round(float(ms.min()), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "runs": len(samples),
+    }
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "host": platform.node(),
+    }
+
+
+def compare(base, current, threshold, min_delta):
+    """Print median changes per case; returns the number of regressions."""
+    regressions = 0
+    common = [name for name in current["results"] if name in base["results"]]
+    if base.get("environment", {}).get("host") != current.get("environment", {}).get("host"):
+        print("warning: results come from different machines")
+    print(f"{'case':>26s} {'base ms':>10s} {'now ms':>10s} {'change':>9s}")
+    for name in common:
+        old = base["results"][name]["median_ms"]
+        new = current["results"][name]["median_ms"]
+        change = (new - old) / old * 100 if old else 0.0
+        # 微秒級的差異是量測雜訊，不算退步
+        flag = ""
+        if change > threshold and new - old >= min_delta:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -threshold and old - new >= min_delta:
+            flag = "  faster"
+        print(f"{name:>26s} {old:10.3f} {new:10.3f} {change:+8.1f}%{flag}")
+    missing = len(set(base["results"]) - set(current["results"]))
+    if missing:
+        print(f"{missing} baseline case(s) not in this run")
+    return regressions
+
+
+def cmd_run(args):
+    fixtures = Fixtures(args.seed)
+    cases = build_cases(fixtures)
+    selected = {name: fn for name, fn in cases.items() if not args.filter or any(f in name for f in args.filter)}
+
+    print(f"{len(selected)} case(s), >= {args.repeat} runs and {args.min_time}s each (ms)")
+    print(f"{'case':>26s} {'median':>10s} {'min':>10s} {'p95':>10s}")
+    results = {}
+    for name, fn in selected.items():
+        results[name] = measure(fn, args.repeat, args.min_time)
+        r = results[name]
+        print(f"{name:>26s} {r['median_ms']:10.3f} {r['min_ms']:10.3f} {r['p95_ms']:10.3f}")
+
+    label = args.label or datetime.now().strftime("%Y%m%d-%H%M%S")
+    report = {
+        "label": label,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "config": {"seed": args.seed, "repeat": args.repeat, "min_time": args.min_time,
+                   "overlap_mode": config.OVERLAP_MODE, "min_overlap_by_type": config.MIN_OVERLAP_BY_TYPE},
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{label}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"saved {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)
+        if compare(base, report, args.threshold, args.min_delta):
+            sys.exit(1)
+
+
+def cmd_compare(args):
+    with open(args.baseline) as f:
+        base = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare(base, current, args.threshold, args.min_delta)
+    if regressions:
+        print(f"{regressions} case(s) slower by more than {args.threshold}%")
+        sys.exit(1)
+
+
+def add_compare_options(parser):
+    parser.add_argument("--threshold", type=float, default=10, help="percent slowdown counted as a regression")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="ignore slowdowns smaller than this (ms)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="run the benchmarks and save the results")
+    run.add_argument("--filter", nargs="+", help="only cases whose name contains one of these")
+    run.add_argument("--repeat", type=int, default=20, help="minimum runs per case")
+    run.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per case")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--label", help="name of the run (default: timestamp)")
+    run.add_argument("--output", help="result file (default: benchmarks/results/<label>.json)")
+    run.add_argument("--compare", metavar="BASELINE", help="compare against a saved run; exits 1 on regressions")
+    add_compare_options(run)
+    run.set_defaults(func=cmd_run)
+
+    cmp = sub.add_parser("compare", help="compare two saved runs; exits 1 on regressions")
+    cmp.add_argument("baseline")
+    cmp.add_argument("current")
+    add_compare_options(cmp)
+    cmp.set_defaults(func=cmd_compare)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.func(args)
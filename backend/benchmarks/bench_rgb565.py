@@ -0,0 +1,71 @@
+"""Benchmark raw camera frame decoding: original RGB565 decoder vs pixel_decoder.py.
+
+Usage (from backend/):
+    python benchmarks/bench_rgb565.py
+    python benchmarks/bench_rgb565.py --sizes 320x240 --repeat 200
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pixel_decoder import PixelDecoder  # noqa: E402
+
+SIZES = {"QQVGA": "160x120", "QVGA": "320x240", "VGA": "640x480"}
+
+
+def legacy_decode(raw_bytes, w, h):
+    """The original decode_rgb565 from main.py (three uint16 temporaries + np.stack)."""
+    data = np.frombuffer(raw_bytes, dtype='>u2')
+    r = ((data & 0x1F) << 3).astype(np.uint8)
+    g = (((data >> 5) & 0x3F) << 2).astype(np.uint8)
+    b = (((data >> 11) & 0x1F) << 3).astype(np.uint8)
+    rgb = np.stack((r, g, b), axis=-1).reshape((h, w, 3))
+    return Image.fromarray(rgb)
+
+
+def timeit(fn, repeat):
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", default=list(SIZES.values()), help="WIDTHxHEIGHT")
+    parser.add_argument("--repeat", type=int, default=100)
+    args = parser.parse_args()
+
+    decoder = PixelDecoder()
+    rng = np.random.default_rng(0)
+    columns = ["legacy", "bgr565_be", "rgb565_le", "yuv422", "detect"]
+
+    print(f"median of {args.repeat} runs (ms)")
+    print(f"{'size':>10s} " + " ".join(f"{c:>10s}" for c in columns) + f" {'speedup':>8s}")
+    for size in args.sizes:
+        width, height = (int(v) for v in size.split("x"))
+        # 與組裝後的分片緩衝區相同：bytearray，不先轉成 bytes
+        raw = bytearray(rng.integers(0, 256, width * height * 2, dtype=np.uint8).tobytes())
+
+        row = [
+            timeit(lambda: legacy_decode(raw, width, height), args.repeat),
+            timeit(lambda: decoder.decode(raw, width, height, "bgr565_be"), args.repeat),
+            timeit(lambda: decoder.decode(raw, width, height, "rgb565_le"), args.repeat),
+            timeit(lambda: decoder.decode(raw, width, height, "yuv422"), args.repeat),
+            timeit(lambda: decoder.detect(raw, width, height), args.repeat),
+        ]
+        print(f"{size:>10s} " + " ".join(f"{v:10.3f}" for v in row) + f" {row[0] / row[1]:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import asyncio
+import json
+
+
+class Broadcaster:
+    """Fan-out of dashboard updates to Server-Sent Events subscribers.
+
+    Each subscriber has a one-slot queue: a slow client only ever receives
+    the most recent update, so publishing never blocks and memory does not
+    grow with the number of missed events.
+    """
+
+    def __init__(self):
+        # queue -> device id 篩選 (None = 所有裝置)
+        self._subscribers = {}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, device_id=None):
+        queue = asyncio.Queue(maxsize=1)
+        self._subscribers[queue] = device_id
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.pop(queue, None)
+
+    def publish(self, data):
+        self.published += 1
+        message = json.dumps(data, default=str)
+        device_id = data.get("device_id")
+        for queue, wanted in self._subscribers.items():
+            if wanted is None or wanted == device_id:
+                self._offer(queue, message)
+
+    def _offer(self, queue, message):
+        if queue.full():
+            queue.get_nowait()
+            self.dropped += 1
+        queue.put_nowait(message)
+
+    def close(self):
+        # None 讓每個串流結束
+        for queue in self._subscribers:
+            self._offer(queue, None)
+
+    def stats(self):
+        return {"subscribers": len(self._subscribers), "published": self.published, "dropped": self.dropped}
@@ -3,14 +3,131 @@ import os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 UPLOAD_DIR = os.path.join(STATIC_DIR, "uploads")
+# 重啟後仍需保留的狀態 (禁停區快取等)
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "data"))
 
-LIVE_IMG_FILENAME = "live.jpg"
-LIVE_IMG_PATH = os.path.join(STATIC_DIR, LIVE_IMG_FILENAME)
+# 即時影像只保留在記憶體 (frame_store)；送 AI 與證據檔皆使用此品質編碼
+JPEG_QUALITY = int(os.getenv("JPEG_QUALITY", "90"))
 
 AI_SERVICE_PORT = 9000
 AI_HOST = os.getenv("AI_SERVICE_URL", f"http://localhost:{AI_SERVICE_PORT}")
 
-VEHICLE_API_URL = f"{AI_HOST}/detect"
-REDLINE_API_URL = f"{AI_HOST}/segment"
+# AI 端點：每個 ssh 主機一條 tunnel (本機埠從 AI_TUNNEL_LOCAL_PORT 依序遞增)，另可加直連 URL；
+# 兩者皆空時直連 AI_SERVICE_URL。請求分配給進行中請求最少的健康端點
+AI_TUNNEL_HOSTS = [h.strip() for h in os.getenv("AI_TUNNEL_HOSTS", "vcppx").split(",") if h.strip()]
+AI_TUNNEL_LOCAL_PORT = int(os.getenv("AI_TUNNEL_LOCAL_PORT", str(AI_SERVICE_PORT)))
+AI_TUNNEL_REMOTE_PORT = int(os.getenv("AI_TUNNEL_REMOTE_PORT", "8000"))
+AI_SERVICE_URLS = [u.strip() for u in os.getenv("AI_SERVICE_URLS", "").split(",") if u.strip()]
+if not AI_TUNNEL_HOSTS and not AI_SERVICE_URLS:
+    AI_SERVICE_URLS = [AI_HOST]
 
-os.makedirs(UPLOAD_DIR, exist_ok=True)
\ No newline at end of file
+# tunnel 監控：定期打健康檢查，連續失敗即熔斷 (請求立即失敗不等逾時)，ssh 斷線以指數退避重啟
+AI_HEALTH_PATH = os.getenv("AI_HEALTH_PATH", "/health")
+TUNNEL_PROBE_INTERVAL = float(os.getenv("TUNNEL_PROBE_INTERVAL", "5"))
+TUNNEL_PROBE_TIMEOUT = float(os.getenv("TUNNEL_PROBE_TIMEOUT", "2"))
+AI_CIRCUIT_FAILURES = int(os.getenv("AI_CIRCUIT_FAILURES", "2"))
+TUNNEL_RESTART_AFTER = int(os.getenv("TUNNEL_RESTART_AFTER", "3"))
+TUNNEL_BACKOFF_INITIAL = float(os.getenv("TUNNEL_BACKOFF_INITIAL", "1"))
+TUNNEL_BACKOFF_MAX = float(os.getenv("TUNNEL_BACKOFF_MAX", "60"))
+# ssh ControlMaster socket 目錄 (空字串 = 不使用)
+SSH_CONTROL_DIR = os.getenv("SSH_CONTROL_DIR", os.path.join(DATA_DIR, "ssh"))
+
+VEHICLE_MODEL = os.getenv("VEHICLE_MODEL", "yolov13n")
+REDLINE_MODEL = os.getenv("REDLINE_MODEL", "yolov11m-segv2")
+
+# AI 推論連線設定 (httpx 連線池)
+AI_CONNECT_TIMEOUT = float(os.getenv("AI_CONNECT_TIMEOUT", "3"))
+AI_READ_TIMEOUT = float(os.getenv("AI_READ_TIMEOUT", "20"))
+AI_RETRIES = int(os.getenv("AI_RETRIES", "1"))
+AI_RETRY_BACKOFF = float(os.getenv("AI_RETRY_BACKOFF", "0.2"))
+# AI 端滿載回 503 + Retry-After 時，重試前最多等待的秒數
+AI_RETRY_AFTER_MAX = float(os.getenv("AI_RETRY_AFTER_MAX", "1"))
+AI_MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", "10"))
+# 使用 /analyze 單次上傳 (關閉則並行呼叫 /detect + /segment)
+AI_USE_ANALYZE = os.getenv("AI_USE_ANALYZE", "1") == "1"
+
+# 違規判定：bbox / polygon (多邊形精確交集) / mask (原解析度點陣)
+# 門檻為「車框」被禁停區覆蓋的比例；細的路緣紅黃線最多只蓋住車框一小部分，依類型另設門檻
+# (MIN_OVERLAP_BY_TYPE="Red Line=0.05,Yellow Line=0.05"，未列出的類型用 MIN_OVERLAP_FRACTION)
+OVERLAP_MODE = os.getenv("OVERLAP_MODE", "polygon")
+MIN_OVERLAP_FRACTION = float(os.getenv("MIN_OVERLAP_FRACTION", "0.1"))
+MIN_OVERLAP_BY_TYPE = {
+    name.strip(): float(value)
+    for name, value in (item.split("=", 1) for item in
+                        os.getenv("MIN_OVERLAP_BY_TYPE", "Red Line=0.05,Yellow Line=0.05").split(",") if "=" in item)
+}
+
+# 禁停區快取：固定攝影機的紅黃線/斑馬線只在排程、畫面變化或手動要求時重新分割
+ZONE_CACHE_ENABLED = os.getenv("ZONE_CACHE_ENABLED", "1") == "1"
+ZONE_CACHE_PATH = os.getenv("ZONE_CACHE_PATH", os.path.join(DATA_DIR, "zones.json"))
+ZONE_REFRESH_SECONDS = float(os.getenv("ZONE_REFRESH_SECONDS", "3600"))
+ZONE_SCENE_CHANGE_THRESHOLD = float(os.getenv("ZONE_SCENE_CHANGE_THRESHOLD", "0.15"))
+
+# 動態閘門：與上一張已分析影像幾乎相同時沿用上次判定，不送 AI
+MOTION_GATE_ENABLED = os.getenv("MOTION_GATE_ENABLED", "1") == "1"
+# 32x24 縮圖中亮度變化超過 MOTION_PIXEL_DELTA 的格子比例 (0.004 約 3 格，640x480 下約 40x30 像素的車)
+MOTION_THRESHOLD = float(os.getenv("MOTION_THRESHOLD", "0.004"))
+MOTION_PIXEL_DELTA = float(os.getenv("MOTION_PIXEL_DELTA", "12"))
+# 即使畫面不變，超過此秒數也強制重新推論一次
+MOTION_MAX_SKIP_SECONDS = float(os.getenv("MOTION_MAX_SKIP_SECONDS", "30"))
+
+# 違規事件追蹤：車輛停留超過 DWELL 秒才開立事件，離開 (或消失) LEAVE 秒後結案
+TRACK_IOU_THRESHOLD = float(os.getenv("TRACK_IOU_THRESHOLD", "0.3"))
+VIOLATION_DWELL_SECONDS = float(os.getenv("VIOLATION_DWELL_SECONDS", "30"))
+TRACK_LEAVE_SECONDS = float(os.getenv("TRACK_LEAVE_SECONDS", "20"))
+# 事件進行中每隔多久更新一次 DB (停留時間、最後出現時間)
+EVENT_UPDATE_SECONDS = float(os.getenv("EVENT_UPDATE_SECONDS", "60"))
+
+# /api/history 每頁筆數上限
+HISTORY_MAX_LIMIT = int(os.getenv("HISTORY_MAX_LIMIT", "200"))
+
+# /api/stream (SSE) 無更新時的心跳間隔
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+
+# /api/live/{device}.mjpeg：每位觀看者 fps 上限、同時觀看人數上限、無新影像時重送間隔
+MJPEG_MAX_FPS = float(os.getenv("MJPEG_MAX_FPS", "5"))
+MJPEG_MAX_VIEWERS = int(os.getenv("MJPEG_MAX_VIEWERS", "20"))
+MJPEG_KEEPALIVE_SECONDS = float(os.getenv("MJPEG_KEEPALIVE_SECONDS", "10"))
+
+# 裝置上傳統計寫回 DB 的間隔
+DEVICE_FLUSH_SECONDS = float(os.getenv("DEVICE_FLUSH_SECONDS", "30"))
+# 裝置 id 格式與數量上限 (不符或已滿的新裝置上傳被拒)；未設定名稱/類型/停留秒數的裝置
+# 超過 DEVICE_EXPIRE_DAYS 沒有上傳即移除 (0 = 不移除)，也可 DELETE /api/devices/{id}
+DEVICE_ID_PATTERN = os.getenv("DEVICE_ID_PATTERN", r"[A-Za-z0-9._:-]{1,64}")
+MAX_DEVICES = int(os.getenv("MAX_DEVICES", "256"))
+DEVICE_EXPIRE_DAYS = float(os.getenv("DEVICE_EXPIRE_DAYS", "7"))
+
+# 違規證據：內容雜湊命名、分層目錄，存檔時產生縮圖；超過天數或總容量時由舊到新刪除
+EVIDENCE_DIR = os.getenv("EVIDENCE_DIR", os.path.join(STATIC_DIR, "evidence"))
+EVIDENCE_THUMB_WIDTH = int(os.getenv("EVIDENCE_THUMB_WIDTH", "320"))
+EVIDENCE_THUMB_HEIGHT = int(os.getenv("EVIDENCE_THUMB_HEIGHT", "240"))
+EVIDENCE_THUMB_FORMAT = os.getenv("EVIDENCE_THUMB_FORMAT", "webp")
+EVIDENCE_THUMB_QUALITY = int(os.getenv("EVIDENCE_THUMB_QUALITY", "70"))
+EVIDENCE_MAX_AGE_DAYS = float(os.getenv("EVIDENCE_MAX_AGE_DAYS", "30"))
+EVIDENCE_MAX_MB = float(os.getenv("EVIDENCE_MAX_MB", "2048"))
+EVIDENCE_RETENTION_SECONDS = float(os.getenv("EVIDENCE_RETENTION_SECONDS", "600"))
+
+# DB 寫入批次：累積 N 筆或等待 T 毫秒即 commit 一次
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "50"))
+DB_WRITE_FLUSH_MS = float(os.getenv("DB_WRITE_FLUSH_MS", "200"))
+DB_WRITE_QUEUE_MAX = int(os.getenv("DB_WRITE_QUEUE_MAX", "10000"))
+
+# 相機像素格式：bgr565_be (原本的解碼方式)、rgb565_be、bgr565_le、rgb565_le、yuv422，
+# 或 auto (每台裝置自動判斷位元組順序 / YUV：有把握的影像累積 3 張才確定，暗場/平滑畫面不算；
+# R/B 順序無法判斷，沿用 bgr。解析度改變或 POST /api/system/decoder/{device}/redetect 時重新判斷)
+PIXEL_FORMAT = os.getenv("PIXEL_FORMAT", "bgr565_be")
+
+# 分片上傳組裝
+FRAME_TTL_SECONDS = float(os.getenv("FRAME_TTL_SECONDS", "30"))
+FRAME_POOL_PER_SIZE = int(os.getenv("FRAME_POOL_PER_SIZE", "4"))
+FRAME_MAX_PARTIAL_PER_DEVICE = int(os.getenv("FRAME_MAX_PARTIAL_PER_DEVICE", "3"))
+# /api/frame 單次上傳的封包上限 (640x480 RGB565 未壓縮約 600 KB)
+FRAME_MAX_BYTES = int(os.getenv("FRAME_MAX_BYTES", str(1024 * 1024)))
+# 表頭宣告的解壓後大小上限 (預設 1280x960 RGB565)；壓縮封包很小也可能宣告巨大影像
+FRAME_MAX_RAW_BYTES = int(os.getenv("FRAME_MAX_RAW_BYTES", str(1280 * 960 * 2)))
+
+# 推論 pipeline worker 數量 (每台裝置僅保留最新一張待處理影像)
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "2"))
+
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+os.makedirs(DATA_DIR, exist_ok=True)
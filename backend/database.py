@@ -1,5 +1,6 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
@@ -10,16 +11,79 @@ load_dotenv()
 # 2. 讀取連線字串 (預設為 SQLite)
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./traffic.db")
 
-# 3. 針對 SQLite 的特殊參數處理
+# 3. 連線池設定 (同步與非同步引擎共用)
+POOL_OPTIONS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    # 取用前先 ping，DB 重啟後的失效連線不會讓請求失敗
+    "pool_pre_ping": True,
+}
+
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+
+# 4. 針對 SQLite 的特殊參數處理
 connect_args = {}
-if "sqlite" in SQLALCHEMY_DATABASE_URL:
+if IS_SQLITE:
     connect_args = {"check_same_thread": False}
 
-# 4. 建立通用引擎
+
+def async_database_url(url):
+    """Same database through an async driver: aiosqlite for SQLite, asyncpg for PostgreSQL."""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    for prefix in ("postgresql+psycopg2:", "postgresql:", "postgres:"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg:" + url[len(prefix):]
+    return url
+
+
+# 5. 同步引擎：啟動時建表/遷移，以及在 threadpool 執行的查詢端點
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
-    connect_args=connect_args
+    connect_args=connect_args,
+    **POOL_OPTIONS
 )
 
+# 6. 非同步引擎：event loop 上的寫入 (db_writer) 使用
+async_engine = create_async_engine(async_database_url(SQLALCHEMY_DATABASE_URL), **POOL_OPTIONS)
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL：寫入時讀取不被鎖住；NORMAL 在 WAL 下仍可保證一致性且少一次 fsync
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+if IS_SQLITE:
+    event.listen(engine, "connect", _sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
 Base = declarative_base()
+
+
+def ensure_columns(table):
+    """Add columns declared on `table` but missing in an existing database.
+
+    create_all() only creates missing tables; databases created before a
+    column was added keep working after this (nullable columns only).
+    """
+    existing = {c["name"] for c in inspect(engine).get_columns(table.name)}
+    missing = [c for c in table.columns if c.name not in existing]
+    if not missing:
+        return
+    with engine.begin() as conn:
+        for column in missing:
+            col_type = column.type.compile(dialect=engine.dialect)
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+
+
+def ensure_indexes(table):
+    """Create indexes declared on `table` that an existing database does not have yet."""
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+
+from sqlalchemy import delete, update
+
+logger = logging.getLogger(__name__)
+
+
+class _Insert:
+    def __init__(self, obj, future):
+        self.obj = obj
+        self.future = future
+
+
+class _Update:
+    def __init__(self, model, where, values):
+        self.model = model
+        self.where = where
+        self.values = values
+
+
+class _Merge:
+    def __init__(self, obj):
+        self.obj = obj
+
+
+class _Delete:
+    def __init__(self, model, where):
+        self.model = model
+        self.where = where
+
+
+class DBWriter:
+    """Write-behind queue: DB writes are applied in batches off the request path.
+
+    Callers enqueue without waiting. A background task collects operations
+    until `batch_size` are pending or `flush_ms` has passed since the first
+    one, then applies them in order in a single transaction (one commit per
+    batch instead of per row). If that transaction fails, the ops are
+    retried one per transaction so only the failing ones are lost. Inserts
+    return a future resolved with the new primary key once committed, and
+    `on_commit(models)` receives the model classes a batch wrote.
+    """
+
+    def __init__(self, session_factory, batch_size=50, flush_ms=200, max_queue=10000, on_commit=None,
+                 on_batch=None):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000.0
+        self.on_commit = on_commit
+        # on_batch(seconds, error)：每批寫入後呼叫 (error 為 None 表示成功)
+        self.on_batch = on_batch
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._task = None
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_batch_size = 0
+        self.last_commit_ms = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Flush everything still queued, then stop."""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    def insert(self, obj):
+        future = asyncio.get_running_loop().create_future()
+        if not self._enqueue(_Insert(obj, future)):
+            future.set_exception(RuntimeError("DB write queue full"))
+        return future
+
+    def update(self, model, where, values):
+        self._enqueue(_Update(model, where, values))
+
+    def merge(self, obj):
+        self._enqueue(_Merge(obj))
+
+    def delete(self, model, where):
+        self._enqueue(_Delete(model, where))
+
+    def _enqueue(self, op):
+        try:
+            self._queue.put_nowait(op)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.error(f"DB write queue full ({self._queue.maxsize}), dropping {type(op).__name__[1:].lower()}")
+            return False
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            op = await self._queue.get()
+            if op is None:
+                break
+            batch = [op]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    op = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if op is None:
+                    stopping = True
+                    break
+                batch.append(op)
+            await self._write(batch)
+
+        # 關閉時把剩餘的寫完
+        remaining = []
+        while not self._queue.empty():
+            op = self._queue.get_nowait()
+            if op is not None:
+                remaining.append(op)
+        for i in range(0, len(remaining), self.batch_size):
+            await self._write(remaining[i:i + self.batch_size])
+
+    async def _apply(self, ops):
+        async with self.session_factory() as session:
+            for op in ops:
+                if isinstance(op, _Insert):
+                    session.add(op.obj)
+                elif isinstance(op, _Merge):
+                    await session.merge(op.obj)
+                elif isinstance(op, _Delete):
+                    await session.execute(delete(op.model).where(op.where))
+                else:
+                    # execute 前會 autoflush，同批先前的 insert 已寫入
+                    await session.execute(update(op.model).where(op.where).values(**op.values))
+            await session.commit()
+
+    async def _write(self, batch):
+        start = time.perf_counter()
+        try:
+            await self._apply(batch)
+            committed = batch
+            error = None
+        except Exception as e:
+            # 一筆壞資料不拖累同批其他寫入：逐筆重試，只丟棄失敗的那幾筆
+            logger.error(f"DB batch of {len(batch)} failed ({e}), retrying one by one")
+            committed = []
+            error = e
+            for op in batch:
+                try:
+                    await self._apply([op])
+                    committed.append(op)
+                except Exception as op_error:
+                    self.failed += 1
+                    logger.error(f"DB {type(op).__name__[1:].lower()} dropped: {op_error}")
+                    if isinstance(op, _Insert) and not op.future.done():
+                        op.future.set_exception(op_error)
+
+        for op in committed:
+            if isinstance(op, _Insert) and not op.future.done():
+                op.future.set_result(op.obj.id)
+        elapsed = time.perf_counter() - start
+        if committed:
+            self.batches += 1
+            self.written += len(committed)
+            self.last_batch_size = len(committed)
+            self.last_commit_ms = round(elapsed * 1000, 2)
+        if self.on_batch is not None:
+            self.on_batch(elapsed, error)
+        if committed and self.on_commit is not None:
+            self.on_commit({op.model if isinstance(op, (_Update, _Delete)) else type(op.obj) for op in committed})
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "batch_size": self.batch_size,
+            "flush_ms": self.flush_interval * 1000,
+            "batches": self.batches,
+            "written": self.written,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "last_batch_size": self.last_batch_size,
+            "last_commit_ms": self.last_commit_ms,
+            "avg_batch_size": round(self.written / self.batches, 2) if self.batches else None,
+        }
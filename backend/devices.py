@@ -0,0 +1,193 @@
+import logging
+import re
+import time
+from collections import deque
+from datetime import datetime
+
+from database import SessionLocal
+from models import CameraDevice
+
+logger = logging.getLogger(__name__)
+
+FPS_WINDOW = 30
+# 超過此秒數沒有新影像，fps 視為 0
+FPS_IDLE_SECONDS = 60
+
+
+class Device:
+    """In-memory state of one camera: settings, upload counters and last verdict."""
+
+    def __init__(self, device_id, name=None, width=None, height=None, zone_types=None, dwell_seconds=None,
+                 frames_received=0, bytes_received=0, last_seen=None, remote_addr=None):
+        self.id = device_id
+        self.name = name
+        self.width = width
+        self.height = height
+        self.zone_types = zone_types
+        self.dwell_seconds = dwell_seconds
+        self.frames_received = frames_received
+        self.bytes_received = bytes_received
+        self.chunks_received = 0
+        self.last_seen = last_seen
+        self.remote_addr = remote_addr
+        self.last_frame_id = None
+        # 最近幾張影像的到達時間，計算上傳 fps
+        self._frame_times = deque(maxlen=FPS_WINDOW)
+        # 該裝置最新一次判定 (與 state.latest_cache 同格式)
+        self.latest = None
+        self.dirty = False
+
+    def record_chunk(self, nbytes, remote_addr):
+        self.chunks_received += 1
+        self.bytes_received += nbytes
+        self.remote_addr = remote_addr
+        self.last_seen = datetime.now()
+        self.dirty = True
+
+    def record_frame(self, frame_id, width, height):
+        self.frames_received += 1
+        self.last_frame_id = frame_id
+        self._frame_times.append(time.monotonic())
+        self.width = width
+        self.height = height
+        self.dirty = True
+
+    @property
+    def fps(self):
+        times = self._frame_times
+        if len(times) < 2 or time.monotonic() - times[-1] > FPS_IDLE_SECONDS:
+            return 0.0
+        return round((len(times) - 1) / (times[-1] - times[0]), 3) if times[-1] > times[0] else 0.0
+
+    @property
+    def configured(self):
+        """An operator set a name, zone types or dwell time for this camera."""
+        return self.name is not None or self.zone_types is not None or self.dwell_seconds is not None
+
+    def enforces(self, zone_type):
+        return not self.zone_types or zone_type in self.zone_types
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "resolution": f"{self.width}x{self.height}" if self.width else None,
+            "zone_types": sorted(self.zone_types) if self.zone_types else None,
+            "dwell_seconds": self.dwell_seconds,
+            "last_seen": self.last_seen,
+            "remote_addr": self.remote_addr,
+            "frames_received": self.frames_received,
+            "bytes_received": self.bytes_received,
+            "fps": self.fps,
+            "last_frame_id": self.last_frame_id,
+            "latest": self.latest,
+        }
+
+
+def parse_zone_types(value):
+    types = {t.strip() for t in (value or "").split(",") if t.strip()}
+    return types or None
+
+
+class DeviceRegistry:
+    """All known cameras, keyed by device id, mirrored to the `devices` table.
+
+    Counters change on every chunk, so they are only written back by
+    `flush()` (called periodically); new devices and settings changes are
+    queued immediately. Writes go through the DB writer, so nothing here
+    blocks the event loop; `load()` runs once at startup.
+
+    Ids come from the uploading client, so new ones must match `id_pattern`
+    and at most `max_devices` are registered; `expire()` and `remove()`
+    drop devices that are gone.
+    """
+
+    def __init__(self, writer, id_pattern=r"[A-Za-z0-9._:-]{1,64}", max_devices=256):
+        self.writer = writer
+        self.id_pattern = re.compile(id_pattern)
+        self.max_devices = max_devices
+        self._devices = {}
+        self.rejected = 0
+
+    def load(self):
+        with SessionLocal() as db:
+            for row in db.query(CameraDevice).all():
+                self._devices[row.id] = Device(
+                    row.id, row.name, row.width, row.height, parse_zone_types(row.zone_types), row.dwell_seconds,
+                    row.frames_received or 0, row.bytes_received or 0, row.last_seen, row.remote_addr
+                )
+        logger.info(f"Device registry loaded: {len(self._devices)} device(s)")
+
+    def get(self, device_id):
+        return self._devices.get(device_id)
+
+    def get_or_create(self, device_id):
+        """Existing device, or a newly registered one; ValueError for a bad id or a full registry."""
+        device = self._devices.get(device_id)
+        if device is None:
+            if not self.id_pattern.fullmatch(device_id or ""):
+                self.rejected += 1
+                raise ValueError(f"Invalid device id {device_id[:80]!r}")
+            if len(self._devices) >= self.max_devices:
+                self.rejected += 1
+                raise ValueError(f"Device limit reached ({self.max_devices}), {device_id} not registered")
+            device = self._devices[device_id] = Device(device_id)
+            self.writer.merge(CameraDevice(id=device_id))
+            logger.info(f"New device registered: {device_id}")
+        return device
+
+    def update_settings(self, device_id, **settings):
+        device = self.get_or_create(device_id)
+        if "name" in settings:
+            device.name = settings["name"]
+        if "zone_types" in settings:
+            device.zone_types = set(settings["zone_types"]) if settings["zone_types"] else None
+        if "dwell_seconds" in settings:
+            device.dwell_seconds = settings["dwell_seconds"]
+
+        self.writer.update(CameraDevice, CameraDevice.id == device_id, {
+            "name": device.name,
+            "zone_types": ",".join(sorted(device.zone_types)) if device.zone_types else None,
+            "dwell_seconds": device.dwell_seconds,
+        })
+        return device
+
+    def remove(self, device_id):
+        """Forget a device and delete its row. Returns False if it was unknown."""
+        if self._devices.pop(device_id, None) is None:
+            return False
+        self.writer.delete(CameraDevice, CameraDevice.id == device_id)
+        logger.info(f"Device removed: {device_id}")
+        return True
+
+    def expire(self, max_idle_seconds, now=None):
+        """Remove unconfigured devices without uploads for `max_idle_seconds`; returns their ids."""
+        cutoff = (now or datetime.now()).timestamp() - max_idle_seconds
+        idle = [d.id for d in self._devices.values()
+                if not d.configured and (d.last_seen is None or d.last_seen.timestamp() < cutoff)]
+        for device_id in idle:
+            self.remove(device_id)
+        return idle
+
+    def flush(self):
+        """Write upload counters / resolution of devices that changed since the last flush."""
+        dirty = [d for d in self._devices.values() if d.dirty]
+        if not dirty:
+            return 0
+        for device in dirty:
+            self.writer.update(CameraDevice, CameraDevice.id == device.id, {
+                "width": device.width,
+                "height": device.height,
+                "last_seen": device.last_seen,
+                "remote_addr": device.remote_addr,
+                "frames_received": device.frames_received,
+                "bytes_received": device.bytes_received,
+            })
+            device.dirty = False
+        return len(dirty)
+
+    def all(self):
+        return list(self._devices.values())
+
+    def __contains__(self, device_id):
+        return device_id in self._devices
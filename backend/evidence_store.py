@@ -0,0 +1,162 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+
+from PIL import Image, features
+
+logger = logging.getLogger(__name__)
+
+
+class EvidenceStore:
+    """Content-addressed evidence images with thumbnails and bounded retention.
+
+    Each image is stored once under `full/ab/cd/<sha256>.jpg` (two levels of
+    shards keep directories small) with a thumbnail under
+    `thumb/ab/cd/<sha256>.<ext>`. Paths are returned relative to `base_dir`,
+    the directory `/static` is served from, like the old upload paths.
+    `prune()` deletes images older than `max_age` seconds, then the oldest
+    ones until the store fits in `max_bytes`.
+    """
+
+    def __init__(self, root, base_dir, thumb_size=(320, 240), thumb_format="webp", thumb_quality=70,
+                 max_age=30 * 86400, max_bytes=2 * 1024 ** 3, legacy_dir=None):
+        self.root = root
+        self.base_dir = base_dir
+        self.thumb_size = thumb_size
+        if thumb_format == "webp" and not features.check("webp"):
+            logger.warning("Pillow built without WebP, evidence thumbnails fall back to JPEG")
+            thumb_format = "jpeg"
+        self.thumb_format = thumb_format
+        self.thumb_ext = "webp" if thumb_format == "webp" else "jpg"
+        self.thumb_quality = thumb_quality
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        # 舊版 static/uploads/*_evidence.jpg 也納入保留期限
+        self.legacy_dir = legacy_dir
+        self.saved = 0
+        self.deduplicated = 0
+        self.deleted = 0
+        self.deleted_bytes = 0
+        self.last_prune = None
+        # save() 與 prune() 都在 worker thread 執行：去重命中與刪除需互斥
+        self._lock = threading.Lock()
+
+    def _shard(self, kind, digest, ext):
+        return os.path.join(self.root, kind, digest[:2], digest[2:4], f"{digest}.{ext}")
+
+    def _relative(self, path):
+        return os.path.relpath(path, self.base_dir).replace(os.sep, "/")
+
+    def save(self, jpeg):
+        """Store one evidence JPEG; returns (image_path, thumbnail_path)."""
+        digest = hashlib.sha256(jpeg).hexdigest()
+        image_path = self._shard("full", digest, "jpg")
+        thumb_path = self._shard("thumb", digest, self.thumb_ext)
+        with self._lock:
+            try:
+                # 已存在：更新 mtime，保留期限 (依 mtime 由舊到新刪除) 才不會刪掉新紀錄指向的檔案
+                os.utime(image_path)
+                os.utime(thumb_path)
+                self.deduplicated += 1
+                return self._relative(image_path), self._relative(thumb_path)
+            except FileNotFoundError:
+                pass
+
+        _write_atomic(image_path, jpeg)
+        _write_atomic(thumb_path, self.thumbnail(jpeg))
+        self.saved += 1
+        return self._relative(image_path), self._relative(thumb_path)
+
+    def thumbnail(self, jpeg):
+        img = Image.open(io.BytesIO(jpeg))
+        # draft 讓 JPEG 以 1/2~1/8 尺寸解碼，不必先解出全圖
+        img.draft("RGB", self.thumb_size)
+        img = img.convert("RGB")
+        img.thumbnail(self.thumb_size, reducing_gap=2.0)
+        buf = io.BytesIO()
+        img.save(buf, format=self.thumb_format, quality=self.thumb_quality)
+        return buf.getvalue()
+
+    def _scan(self):
+        """(mtime, bytes, image path, thumbnail path or None) of every stored image."""
+        entries = []
+        full_root = os.path.join(self.root, "full")
+        for dirpath, _, filenames in os.walk(full_root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                digest = os.path.splitext(name)[0]
+                thumb = self._shard("thumb", digest, self.thumb_ext)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                size = st.st_size
+                try:
+                    size += os.stat(thumb).st_size
+                except FileNotFoundError:
+                    thumb = None
+                entries.append((st.st_mtime, size, path, thumb))
+        if self.legacy_dir and os.path.isdir(self.legacy_dir):
+            with os.scandir(self.legacy_dir) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.endswith("_evidence.jpg"):
+                        st = entry.stat()
+                        entries.append((st.st_mtime, st.st_size, entry.path, None))
+        return entries
+
+    def prune(self, now=None):
+        """Apply the retention limits; returns the image paths (relative) that were deleted."""
+        now = time.time() if now is None else now
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _, _ in entries)
+        deleted = []
+        for mtime, size, path, thumb in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            with self._lock:
+                # 掃描後才被去重命中 (mtime 已更新) 的檔案仍被新紀錄引用，略過
+                try:
+                    if os.stat(path).st_mtime > mtime:
+                        continue
+                except FileNotFoundError:
+                    pass
+                for p in (path, thumb):
+                    if p is not None:
+                        try:
+                            os.remove(p)
+                        except FileNotFoundError:
+                            pass
+            total -= size
+            self.deleted += 1
+            self.deleted_bytes += size
+            deleted.append(self._relative(path))
+        self.last_prune = {"at": now, "files": len(entries) - len(deleted), "bytes": total, "deleted": len(deleted)}
+        if deleted:
+            logger.info(f"Evidence retention removed {len(deleted)} image(s), {total / 1024 ** 2:.1f} MB kept")
+        return deleted
+
+    def stats(self):
+        return {
+            "root": self.root,
+            "thumb_format": self.thumb_format,
+            "thumb_size": self.thumb_size,
+            "max_age_days": round(self.max_age / 86400, 2),
+            "max_mb": round(self.max_bytes / 1024 ** 2, 1),
+            "saved": self.saved,
+            "deduplicated": self.deduplicated,
+            "deleted": self.deleted,
+            "deleted_mb": round(self.deleted_bytes / 1024 ** 2, 2),
+            "last_prune": self.last_prune,
+        }
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # save() 在 threadpool 執行：同內容同時存檔時各用自己的暫存檔
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
@@ -0,0 +1,186 @@
+import bisect
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class BufferPool:
+    """Reusable frame buffers, one free list per frame size (resolution)."""
+
+    def __init__(self, max_free_per_size=4):
+        self.max_free_per_size = max_free_per_size
+        self._free = {}
+        self.allocated = 0
+        self.reused = 0
+
+    def acquire(self, size):
+        free = self._free.get(size)
+        if free:
+            self.reused += 1
+            return free.pop()
+        self.allocated += 1
+        return bytearray(size)
+
+    def release(self, buf):
+        free = self._free.setdefault(len(buf), [])
+        if len(free) < self.max_free_per_size:
+            free.append(buf)
+
+    def stats(self):
+        return {
+            "allocated": self.allocated,
+            "reused": self.reused,
+            "free": {size: len(bufs) for size, bufs in self._free.items()},
+        }
+
+
+class PartialFrame:
+    """One frame being assembled; tracks which byte ranges have arrived."""
+
+    def __init__(self, device_id, frame_id, total, width, height, buffer):
+        self.device_id = device_id
+        self.frame_id = frame_id
+        self.total = total
+        self.width = width
+        self.height = height
+        self.buffer = buffer
+        self.received = 0
+        self.created_at = time.monotonic()
+        self.updated_at = self.created_at
+        # 已收到的區段，排序且不重疊: [(start, end), ...]
+        self._ranges = []
+
+    def add(self, offset, data):
+        end = offset + len(data)
+        self.buffer[offset:end] = data
+        self.updated_at = time.monotonic()
+        self._merge(offset, end)
+
+    def _merge(self, start, end):
+        ranges = self._ranges
+        i = bisect.bisect_left(ranges, (start, start))
+        # 往前一段若相接或重疊也要合併
+        if i > 0 and ranges[i - 1][1] >= start:
+            i -= 1
+
+        new_start, new_end = start, end
+        covered = 0
+        j = i
+        while j < len(ranges) and ranges[j][0] <= end:
+            s, e = ranges[j]
+            covered += min(e, end) - max(s, start) if min(e, end) > max(s, start) else 0
+            new_start = min(new_start, s)
+            new_end = max(new_end, e)
+            j += 1
+
+        ranges[i:j] = [(new_start, new_end)]
+        self.received += (end - start) - covered
+
+    @property
+    def complete(self):
+        return self.received >= self.total
+
+    def missing(self, limit=8):
+        gaps = []
+        pos = 0
+        for s, e in self._ranges:
+            if s > pos:
+                gaps.append((pos, s))
+            pos = e
+        if pos < self.total:
+            gaps.append((pos, self.total))
+        return gaps[:limit]
+
+
+class FrameAssembler:
+    """Assembles chunked uploads keyed by (device id, frame id).
+
+    Chunks may arrive out of order or be retransmitted; a frame is only
+    handed out once every byte has arrived. Partial frames that stop
+    receiving data for `ttl` seconds are dropped and their buffers recycled.
+    """
+
+    def __init__(self, pool, ttl=30.0, max_partial_per_device=3):
+        self.pool = pool
+        self.ttl = ttl
+        self.max_partial_per_device = max_partial_per_device
+        self._frames = {}
+        self.completed = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def add_chunk(self, device_id, frame_id, offset, total, width, height, data):
+        """Store one chunk. Returns the PartialFrame (check `.complete`)."""
+        if offset < 0 or total <= 0 or offset + len(data) > total:
+            raise ValueError("Data overflow")
+
+        self.expire()
+
+        key = (device_id, frame_id)
+        frame = self._frames.get(key)
+        if frame is not None and (frame.total != total or frame.width != width or frame.height != height):
+            self._drop(key)
+            frame = None
+
+        if frame is None:
+            self._limit_device(device_id)
+            frame = PartialFrame(device_id, frame_id, total, width, height, self.pool.acquire(total))
+            self._frames[key] = frame
+            logger.info(f"New frame {frame_id} from {device_id}, total size: {total}")
+
+        frame.add(offset, data)
+
+        if frame.complete:
+            del self._frames[key]
+            self.completed += 1
+        return frame
+
+    def release(self, frame):
+        """Return a completed frame's buffer to the pool once it has been decoded."""
+        self.pool.release(frame.buffer)
+        frame.buffer = None
+
+    def discard(self, device_id, frame_id):
+        if (device_id, frame_id) in self._frames:
+            self._drop((device_id, frame_id))
+
+    def expire(self, now=None):
+        now = time.monotonic() if now is None else now
+        stale = [k for k, f in self._frames.items() if now - f.updated_at > self.ttl]
+        for key in stale:
+            frame = self._frames[key]
+            logger.warning(f"Frame {key[1]} from {key[0]} expired with {frame.received}/{frame.total} bytes")
+            self._drop(key)
+            self.expired += 1
+
+    def _limit_device(self, device_id):
+        # 同一台裝置同時進行中的 frame 數量有上限，超過則丟棄最舊的
+        partial = sorted((f.created_at, k) for k, f in self._frames.items() if k[0] == device_id)
+        while len(partial) >= self.max_partial_per_device:
+            _, key = partial.pop(0)
+            self._drop(key)
+            self.evicted += 1
+
+    def _drop(self, key):
+        frame = self._frames.pop(key)
+        self.pool.release(frame.buffer)
+        frame.buffer = None
+
+    def stats(self):
+        return {
+            "in_progress": [
+                {
+                    "device_id": f.device_id,
+                    "frame_id": f.frame_id,
+                    "received": f.received,
+                    "total": f.total,
+                    "missing": f.missing(),
+                }
+                for f in self._frames.values()
+            ],
+            "completed": self.completed,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "pool": self.pool.stats(),
+        }
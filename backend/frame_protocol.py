@@ -0,0 +1,177 @@
+import struct
+import zlib
+
+import numpy as np
+
+# 單次上傳的影像封包：固定表頭 + 裝置 id + 像素資料 (可壓縮)
+#
+#   magic     4s  b"TPF1"
+#   version   B   1
+#   format    B   像素格式：0 = 依後端 PIXEL_FORMAT 設定，其餘見 FORMAT_NAMES
+#   codec     B   壓縮方式 (CODEC_*)
+#   flags     B   保留 (0)
+#   width     H
+#   height    H
+#   frame_id  I
+#   raw_len   I   解壓後位元組數 (width * height * 2)
+#   data_len  I   表頭之後 payload 的位元組數
+#   crc32     I   解壓後像素資料的 CRC-32
+#   id_len    B   後接 id_len 個位元組的裝置 id (UTF-8)
+#
+# 全部 little-endian。韌體 (pico0v7670.py) 與 mock_pico.py 各自實作相同的編碼。
+MAGIC = b"TPF1"
+VERSION = 1
+HEADER = struct.Struct("<4sBBBBHHIIIIB")
+
+FORMAT_RGB565 = 0
+FORMAT_NAMES = {1: "bgr565_be", 2: "rgb565_be", 3: "bgr565_le", 4: "rgb565_le", 5: "yuv422"}
+
+CODEC_NONE = 0
+# 每一行與上一行 XOR，再以 PackBits 做 run-length 編碼
+CODEC_ROW_XOR_RLE = 1
+
+CODECS = {CODEC_NONE: "none", CODEC_ROW_XOR_RLE: "row-xor-rle"}
+
+
+class FrameHeader:
+    def __init__(self, device_id, frame_id, width, height, fmt=FORMAT_RGB565, codec=CODEC_NONE,
+                 raw_len=None, data_len=None, crc=0, size=None):
+        self.device_id = device_id
+        self.frame_id = frame_id
+        self.width = width
+        self.height = height
+        self.format = fmt
+        self.codec = codec
+        self.raw_len = width * height * 2 if raw_len is None else raw_len
+        self.data_len = data_len
+        self.crc = crc
+        # 表頭總長 (含裝置 id)
+        self.size = size
+
+
+def parse_header(data, max_raw_bytes=None):
+    """Parse the header at the start of `data`; raises ValueError on anything malformed.
+
+    `max_raw_bytes` caps the decoded frame size the header may declare, so an
+    untrusted header cannot make decode_frame() allocate gigabytes.
+    """
+    if len(data) < HEADER.size:
+        raise ValueError(f"Frame shorter than its header ({len(data)} bytes)")
+    magic, version, fmt, codec, _, width, height, frame_id, raw_len, data_len, crc, id_len = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a frame packet (bad magic)")
+    if version != VERSION:
+        raise ValueError(f"Unsupported frame protocol version {version}")
+    if fmt != FORMAT_RGB565 and fmt not in FORMAT_NAMES:
+        raise ValueError(f"Unknown pixel format {fmt}")
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec {codec}")
+    if width == 0 or height == 0 or raw_len != width * height * 2:
+        raise ValueError(f"Size {raw_len} does not match {width}x{height} at 2 bytes per pixel")
+    if max_raw_bytes is not None and raw_len > max_raw_bytes:
+        raise ValueError(f"Frame {width}x{height} ({raw_len} bytes) exceeds the {max_raw_bytes} byte limit")
+    size = HEADER.size + id_len
+    if len(data) < size:
+        raise ValueError("Frame truncated inside the device id")
+    try:
+        device_id = bytes(data[HEADER.size:size]).decode("utf-8")
+    except UnicodeDecodeError:
+        raise ValueError("Device id is not UTF-8")
+    return FrameHeader(device_id, frame_id, width, height, fmt, codec, raw_len, data_len, crc, size)
+
+
+def decode_frame(data, max_raw_bytes=None):
+    """Header and raw pixel bytes of one packet; checks lengths and the CRC."""
+    header = parse_header(data, max_raw_bytes)
+    payload = memoryview(data)[header.size:]
+    if len(payload) != header.data_len:
+        raise ValueError(f"Payload is {len(payload)} bytes, header says {header.data_len}")
+
+    if header.codec == CODEC_NONE:
+        if header.data_len != header.raw_len:
+            raise ValueError("Uncompressed payload size does not match the frame size")
+        raw = payload
+    else:
+        raw = unrow_xor(unpackbits(payload, header.raw_len), header.width * 2)
+
+    if zlib.crc32(raw) != header.crc:
+        raise ValueError("CRC mismatch")
+    return header, raw
+
+
+def encode_frame(device_id, frame_id, width, height, raw, codec=CODEC_NONE):
+    """Build a packet (used by mock_pico.py and tests; the firmware has its own copy)."""
+    payload = raw if codec == CODEC_NONE else packbits(row_xor(raw, width * 2))
+    device = device_id.encode("utf-8")
+    header = HEADER.pack(MAGIC, VERSION, FORMAT_RGB565, codec, 0, width, height, frame_id,
+                         len(raw), len(payload), zlib.crc32(raw), len(device))
+    return header + device + bytes(payload)
+
+
+def row_xor(raw, row_bytes):
+    """XOR every row with the row above (the first row is kept); still image rows become mostly zeros."""
+    out = bytearray(raw[:row_bytes])
+    prev = int.from_bytes(raw[:row_bytes], "big")
+    for start in range(row_bytes, len(raw), row_bytes):
+        row = int.from_bytes(raw[start:start + row_bytes], "big")
+        out += (row ^ prev).to_bytes(row_bytes, "big")
+        prev = row
+    return out
+
+
+def unrow_xor(delta, row_bytes):
+    rows = np.frombuffer(delta, dtype=np.uint8).reshape(-1, row_bytes)
+    return np.bitwise_xor.accumulate(rows, axis=0).tobytes()
+
+
+def packbits(data):
+    """PackBits RLE: n < 128 -> n+1 literal bytes follow; n > 128 -> next byte repeated 257-n times."""
+    out = bytearray()
+    n = len(data)
+    i = 0
+    while i < n:
+        j = i + 1
+        while j < n and j - i < 128 and data[j] == data[i]:
+            j += 1
+        if j - i >= 3:
+            out.append(257 - (j - i))
+            out.append(data[i])
+            i = j
+            continue
+        j = i
+        while j < n and j - i < 128:
+            if j + 2 < n and data[j] == data[j + 1] == data[j + 2]:
+                break
+            j += 1
+        out.append(j - i - 1)
+        out += data[i:j]
+        i = j
+    return out
+
+
+def unpackbits(data, size):
+    out = bytearray(size)
+    o = 0
+    i = 0
+    n = len(data)
+    while i < n:
+        c = data[i]
+        i += 1
+        if c < 128:
+            length = c + 1
+            if i + length > n or o + length > size:
+                raise ValueError("RLE literal overruns the frame")
+            out[o:o + length] = data[i:i + length]
+            i += length
+        elif c > 128:
+            length = 257 - c
+            if i >= n or o + length > size:
+                raise ValueError("RLE run overruns the frame")
+            out[o:o + length] = bytes((data[i],)) * length
+            i += 1
+        else:
+            continue
+        o += length
+    if o != size:
+        raise ValueError(f"RLE payload decodes to {o} bytes, expected {size}")
+    return out
@@ -0,0 +1,111 @@
+import asyncio
+import io
+import time
+
+import numpy as np
+
+
+class Frame:
+    """One decoded camera frame kept in memory.
+
+    The JPEG sent to the AI service is encoded once and cached; the annotated
+    JPEG (boxes drawn) is what the dashboard and evidence files use.
+    """
+
+    def __init__(self, device_id, frame_id, image, jpeg=None, quality=90, trace=None):
+        self.device_id = device_id
+        self.frame_id = frame_id
+        self.image = image.convert("RGB") if image.mode != "RGB" else image
+        self.width, self.height = self.image.size
+        self.timestamp = time.time()
+        self.quality = quality
+        self._jpeg = jpeg
+        self._array = None
+        self.annotated_jpeg = None
+        # metrics.FrameTrace：各階段耗時
+        self.trace = trace
+
+    @property
+    def array(self):
+        if self._array is None:
+            self._array = np.asarray(self.image)
+        return self._array
+
+    def jpeg(self):
+        if self._jpeg is None:
+            self._jpeg = encode_jpeg(self.image, self.quality)
+        return self._jpeg
+
+    def display_jpeg(self):
+        return self.annotated_jpeg or self.jpeg()
+
+
+def encode_jpeg(image, quality):
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+class FrameStore:
+    """Latest frame per device, served to the dashboard straight from memory.
+
+    `put` stores a frame as soon as it is decoded; `publish` marks the
+    device's current frame as final (annotated) and wakes live-stream
+    viewers waiting in `wait_published`.
+    """
+
+    def __init__(self):
+        self._frames = {}
+        self._latest_device = None
+        self._versions = {}
+        self._published = {}
+        self._waiters = {}
+
+    def put(self, frame):
+        self._frames[frame.device_id] = frame
+        self._latest_device = frame.device_id
+
+    def publish(self, frame):
+        device_id = frame.device_id
+        self._published[device_id] = frame
+        self._versions[device_id] = self._versions.get(device_id, 0) + 1
+        waiter = self._waiters.pop(device_id, None)
+        if waiter is not None:
+            waiter.set()
+
+    def get(self, device_id):
+        return self._frames.get(device_id)
+
+    def published(self, device_id):
+        """(frame, version) of the last published frame of a device; (None, 0) if none yet."""
+        return self._published.get(device_id), self._versions.get(device_id, 0)
+
+    async def wait_published(self, device_id, version, timeout):
+        """Wait until `device_id` publishes a frame newer than `version` (or `timeout` passes)."""
+        if self._versions.get(device_id, 0) > version:
+            return True
+        waiter = self._waiters.get(device_id)
+        if waiter is None:
+            waiter = self._waiters[device_id] = asyncio.Event()
+        try:
+            await asyncio.wait_for(waiter.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def remove(self, device_id):
+        self._frames.pop(device_id, None)
+        self._published.pop(device_id, None)
+        self._versions.pop(device_id, None)
+        if self._latest_device == device_id:
+            self._latest_device = None
+        # 叫醒仍在等待的觀看者，並移除該裝置的等待事件
+        waiter = self._waiters.pop(device_id, None)
+        if waiter is not None:
+            waiter.set()
+
+    def latest(self):
+        return self._frames.get(self._latest_device)
+
+    def devices(self):
+        return list(self._frames.keys())
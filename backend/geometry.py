@@ -0,0 +1,260 @@
+"""Vectorized car / restricted-zone overlap.
+
+All functions work on every car x zone pair at once and return an (N, M)
+matrix holding the fraction of each car's box covered by each zone. The
+fraction is always relative to the car box (not the zone), so a thin curb
+line under a car covers only a few percent of it; thresholds can be set per
+zone type for that reason (see zone_thresholds).
+
+Modes:
+    bbox     zone = its axis-aligned bbox (analytic, cheapest)
+    polygon  zone = its segmentation polygon, intersected with each car box exactly
+    mask     zone = its polygon rasterized at full frame resolution (pixel centres)
+
+All modes measure the same quantity, so one threshold means the same in
+each; mask only differs from polygon by under a pixel along the edges.
+Polygon and mask only evaluate cars whose box touches the zone's bbox.
+"""
+
+import numpy as np
+
+OVERLAP_MODES = ("bbox", "polygon", "mask")
+
+
+def as_boxes(boxes):
+    """List of [x1, y1, x2, y2] -> (N, 4) float array."""
+    if len(boxes) == 0:
+        return np.zeros((0, 4), dtype=np.float64)
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def box_areas(boxes):
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def bbox_overlap(car_boxes, zone_boxes):
+    cars = as_boxes(car_boxes)
+    zones = as_boxes(zone_boxes)
+    if len(cars) == 0 or len(zones) == 0:
+        return np.zeros((len(cars), len(zones)))
+
+    x1 = np.maximum(cars[:, None, 0], zones[None, :, 0])
+    y1 = np.maximum(cars[:, None, 1], zones[None, :, 1])
+    x2 = np.minimum(cars[:, None, 2], zones[None, :, 2])
+    y2 = np.minimum(cars[:, None, 3], zones[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    return inter / np.maximum(box_areas(cars), 1e-9)[:, None]
+
+
+def box_iou(a_boxes, b_boxes):
+    """IoU matrix between two box lists: (len(a_boxes), len(b_boxes))."""
+    a = as_boxes(a_boxes)
+    b = as_boxes(b_boxes)
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    union = box_areas(a)[:, None] + box_areas(b)[None, :] - inter
+    return inter / np.maximum(union, 1e-9)
+
+
+def zone_polygon(zone):
+    """Polygon of a zone; zones without one fall back to their bbox rectangle."""
+    polygon = zone.get("polygon")
+    if polygon is not None and len(polygon) >= 3:
+        return polygon
+    x1, y1, x2, y2 = zone["bbox"]
+    return [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+
+
+def _clamped_integral(y_start, y_end, length, lo, hi):
+    """Integral over a segment of length `length` of clip(y, lo, hi) - lo, y linear from y_start to y_end."""
+    span = hi - lo
+
+    def antiderivative(y):
+        below = np.clip(y, lo, hi) - lo
+        return below * below / 2 + span * np.clip(y - hi, 0, None)
+
+    dy = y_end - y_start
+    sloped = np.abs(dy) > 1e-6
+    safe_dy = np.where(sloped, dy, 1.0)
+    mid = np.clip((y_start + y_end) / 2, lo, hi) - lo
+    return np.where(sloped, (antiderivative(y_end) - antiderivative(y_start)) * length / safe_dy, mid * length)
+
+
+def polygon_box_areas(polygon, boxes):
+    """Exact area of `polygon` inside each box: (len(boxes),).
+
+    Sums, over the polygon's edges, the signed area between each edge and the
+    box's top, with x limited to the box and y clamped to it (the trapezoid
+    form of the shoelace formula). Works for concave polygons.
+    """
+    pts = np.asarray(polygon, dtype=np.float64)
+    p = pts
+    q = np.roll(pts, -1, axis=0)
+    dx = q[:, 0] - p[:, 0]
+    slope = np.divide(q[:, 1] - p[:, 1], dx, out=np.zeros_like(dx), where=dx != 0)
+
+    bx1, by1, bx2, by2 = (boxes[:, k, None] for k in range(4))
+    u = np.clip(np.minimum(p[:, 0], q[:, 0]), bx1, bx2)
+    v = np.clip(np.maximum(p[:, 0], q[:, 0]), bx1, bx2)
+    y_u = p[:, 1] + slope * (u - p[:, 0])
+    y_v = p[:, 1] + slope * (v - p[:, 0])
+    # 垂直邊 u == v，貢獻為 0
+    signed = np.sign(dx) * _clamped_integral(y_u, y_v, v - u, by1, by2)
+    return np.abs(signed.sum(axis=1))
+
+
+def polygon_overlap(car_boxes, polygons, candidates=None):
+    """Exact fraction of each car box covered by each polygon.
+
+    `candidates` is an optional (N, M) bool matrix of pairs worth evaluating;
+    every other pair is reported as 0.
+    """
+    cars = as_boxes(car_boxes)
+    out = np.zeros((len(cars), len(polygons)))
+    if len(cars) == 0 or len(polygons) == 0:
+        return out
+
+    areas = np.maximum(box_areas(cars), 1e-9)
+    for j, polygon in enumerate(polygons):
+        rows = np.flatnonzero(candidates[:, j]) if candidates is not None else np.arange(len(cars))
+        if len(rows) == 0:
+            continue
+        out[rows, j] = np.minimum(polygon_box_areas(polygon, cars[rows]) / areas[rows], 1.0)
+    return out
+
+
+def rasterize_window(polygon, width, height):
+    """Rasterize one polygon inside its own bbox window, sampling pixel centres.
+
+    A pixel is inside when its centre is (non-zero winding), so a 2 px wide
+    line fills exactly 2 rows. Returns (mask, x0, y0) where mask covers
+    pixels [y0:y0+h, x0:x0+w], or None when the polygon lies outside the frame.
+    """
+    pts = np.asarray(polygon, dtype=np.float64)
+    x0 = int(np.clip(np.floor(pts[:, 0].min()), 0, width))
+    y0 = int(np.clip(np.floor(pts[:, 1].min()), 0, height))
+    x1 = int(np.clip(np.ceil(pts[:, 0].max()), 0, width))
+    y1 = int(np.clip(np.ceil(pts[:, 1].max()), 0, height))
+    if x1 <= x0 or y1 <= y0:
+        return None
+    w, h = x1 - x0, y1 - y0
+
+    p = pts
+    q = np.roll(pts, -1, axis=0)
+    keep = p[:, 1] != q[:, 1]
+    p, q = p[keep], q[keep]
+    centres = y0 + np.arange(h)[:, None] + 0.5
+    crosses = (centres >= np.minimum(p[:, 1], q[:, 1])) & (centres < np.maximum(p[:, 1], q[:, 1]))
+    row, edge = np.nonzero(crosses)
+    x = p[edge, 0] + (centres[row, 0] - p[edge, 1]) * (q[edge, 0] - p[edge, 0]) / (q[edge, 1] - p[edge, 1])
+    # 每條邊在穿越處 +-1，沿列累加即為 winding number
+    col = np.clip(np.ceil(x - x0 - 0.5), 0, w).astype(np.intp)
+    winding = np.zeros((h, w + 1), dtype=np.int32)
+    np.add.at(winding, (row, col), np.where(q[edge, 1] > p[edge, 1], 1, -1))
+    return np.cumsum(winding, axis=1)[:, :w] != 0, x0, y0
+
+
+def integral_image(mask):
+    """Summed-area table with a zero first row/column: (h + 1, w + 1)."""
+    h, w = mask.shape
+    sat = np.zeros((h + 1, w + 1), dtype=np.int32)
+    np.cumsum(np.cumsum(mask, axis=0, dtype=np.int32), axis=1, out=sat[1:, 1:])
+    return sat
+
+
+def mask_overlap(car_boxes, polygons, width, height, candidates=None):
+    """Fraction of each car box's pixels covered by each rasterized polygon.
+
+    Each zone gets one summed-area table, so the cost per car is four lookups
+    regardless of box size. `candidates` as in polygon_overlap.
+    """
+    cars = as_boxes(car_boxes)
+    out = np.zeros((len(cars), len(polygons)))
+    if len(cars) == 0 or len(polygons) == 0:
+        return out
+
+    # 車框內的像素 (中心點落在框內)
+    cx1 = np.clip(np.ceil(cars[:, 0] - 0.5), 0, width).astype(np.intp)
+    cy1 = np.clip(np.ceil(cars[:, 1] - 0.5), 0, height).astype(np.intp)
+    cx2 = np.clip(np.ceil(cars[:, 2] - 0.5), 0, width).astype(np.intp)
+    cy2 = np.clip(np.ceil(cars[:, 3] - 0.5), 0, height).astype(np.intp)
+    cells = np.maximum((cx2 - cx1) * (cy2 - cy1), 1)
+
+    for j, polygon in enumerate(polygons):
+        rows = np.flatnonzero(candidates[:, j]) if candidates is not None else np.arange(len(cars))
+        if len(rows) == 0:
+            continue
+        window = rasterize_window(polygon, width, height)
+        if window is None:
+            continue
+        mask, x0, y0 = window
+        h, w = mask.shape
+        sat = integral_image(mask)
+
+        # 只在該禁停區的 bbox 視窗內查表
+        x1 = np.clip(cx1[rows] - x0, 0, w)
+        y1 = np.clip(cy1[rows] - y0, 0, h)
+        x2 = np.clip(cx2[rows] - x0, 0, w)
+        y2 = np.clip(cy2[rows] - y0, 0, h)
+        inside = sat[y2, x2] - sat[y1, x2] - sat[y2, x1] + sat[y1, x1]
+        out[rows, j] = inside / cells[rows]
+    return out
+
+
+def overlap_matrix(car_boxes, zones, width, height, mode="polygon"):
+    """Fraction of each car box covered by each zone: (len(car_boxes), len(zones))."""
+    if mode not in OVERLAP_MODES:
+        raise ValueError(f"Unknown overlap mode '{mode}'. Choose from: {', '.join(OVERLAP_MODES)}")
+    if len(car_boxes) == 0 or len(zones) == 0:
+        return np.zeros((len(car_boxes), len(zones)))
+
+    bbox = bbox_overlap(car_boxes, [z["bbox"] for z in zones])
+    if mode == "bbox":
+        return bbox
+
+    # 多邊形一定在 bbox 內：bbox 不相交的組合不必計算
+    polygons = [zone_polygon(z) for z in zones]
+    if mode == "polygon":
+        return polygon_overlap(car_boxes, polygons, candidates=bbox > 0)
+    return mask_overlap(car_boxes, polygons, width, height, candidates=bbox > 0)
+
+
+def zone_thresholds(zones, min_overlap=0.1, min_overlap_by_type=None):
+    """Minimum covered fraction of the car box per zone: (len(zones),).
+
+    `min_overlap_by_type` ({"Red Line": 0.05, ...}) overrides `min_overlap`
+    for thin markings, which can only ever cover a small part of a car box.
+    """
+    by_type = min_overlap_by_type or {}
+    return np.array([by_type.get(z["type"], min_overlap) for z in zones], dtype=np.float64)
+
+
+def car_zone_types(overlap, zones, min_overlap=0.1, min_overlap_by_type=None):
+    """For each car (row of `overlap`), the set of zone types it violates."""
+    hits = (overlap > 0) & (overlap >= zone_thresholds(zones, min_overlap, min_overlap_by_type))
+    return [{zones[j]["type"] for j in np.flatnonzero(row)} for row in hits]
+
+
+def find_violations(car_boxes, zones, width, height, mode="polygon", min_overlap=0.1, min_overlap_by_type=None):
+    """Return (number of cars in any zone, set of violated zone types, overlap matrix).
+
+    A car violates a zone when the zone covers more than zero and at least
+    the zone type's threshold (`min_overlap_by_type`, else `min_overlap`) of
+    the car's box. Each zone dict needs "type" and "bbox", and optionally
+    "polygon".
+    """
+    overlap = overlap_matrix(car_boxes, zones, width, height, mode)
+    if overlap.size == 0:
+        return 0, set(), overlap
+
+    hits = (overlap > 0) & (overlap >= zone_thresholds(zones, min_overlap, min_overlap_by_type))
+    car_hit = hits.any(axis=1)
+    zone_hit = hits.any(axis=0)
+    violation_types = {zones[j]["type"] for j in np.flatnonzero(zone_hit)}
+    return int(car_hit.sum()), violation_types, overlap
@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import time
+
+import httpx
+
+import config
+from ssh_tunnel import AIUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+class ModelLatency:
+    """Rolling latency counters for one remote model."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.last = None
+        self.max = 0.0
+        self.last_inference_time = None
+
+    def record(self, seconds, inference_time=None):
+        self.calls += 1
+        self.total += seconds
+        self.last = seconds
+        self.max = max(self.max, seconds)
+        if inference_time is not None:
+            self.last_inference_time = inference_time
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_ms": round(self.total / self.calls * 1000, 1) if self.calls else None,
+            "last_ms": round(self.last * 1000, 1) if self.last is not None else None,
+            "max_ms": round(self.max * 1000, 1),
+            "last_inference_time": self.last_inference_time,
+        }
+
+
+def is_backpressure(error):
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 503
+
+
+def retry_after(resp, default):
+    """Seconds from a Retry-After header (delay-seconds form), or `default`."""
+    try:
+        return max(0.0, float(resp.headers["Retry-After"]))
+    except (KeyError, ValueError):
+        return default
+
+
+class InferenceClient:
+    """Async client for the remote AI services sharing one connection pool.
+
+    Each request goes to the endpoint chosen by the tunnel supervisor;
+    a retry prefers a different endpoint, and when none is healthy the
+    call fails at once with AIUnavailable.
+    """
+
+    def __init__(self, tunnels, connect_timeout, read_timeout, retries, retry_backoff, max_connections,
+                 use_analyze=True, retry_after_max=1.0):
+        self.tunnels = tunnels
+        self.use_analyze = use_analyze
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.retry_after_max = retry_after_max
+        self.busy = 0
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_connections)
+        self.latency = {}
+        self.frame_latency = ModelLatency()
+        self._client = None
+
+    async def start(self):
+        self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post(self, path, key, img_bytes, data, frame_id=None):
+        stats = self.latency.setdefault(key, ModelLatency())
+        last_error = None
+        tried = []
+        # AI 端回傳並記錄同一個 frame id，兩邊的 log 可以對應
+        headers = {"X-Frame-Id": frame_id} if frame_id else None
+
+        for attempt in range(self.retries + 1):
+            delay = self.retry_backoff * (2 ** attempt)
+            try:
+                endpoint = self.tunnels.acquire(exclude=tried)
+            except AIUnavailable:
+                # 所有端點都熔斷：立即失敗，不等逾時
+                stats.errors += 1
+                raise
+            tried.append(endpoint)
+            start = time.perf_counter()
+            try:
+                resp = await self._client.post(
+                    endpoint.base_url + path,
+                    files={'image': ('live.jpg', img_bytes, 'image/jpeg')},
+                    data=data,
+                    headers=headers
+                )
+                # 4xx 不重試 (參數錯誤重送也沒用)
+                if resp.status_code < 500:
+                    self.tunnels.success(endpoint)
+                    resp.raise_for_status()
+                    body = resp.json()
+                    stats.record(time.perf_counter() - start, body.get("inference_time"))
+                    return body
+                last_error = httpx.HTTPStatusError(
+                    f"AI service {endpoint.name} returned {resp.status_code}", request=resp.request, response=resp)
+            except httpx.TransportError as e:
+                last_error = e
+            except httpx.HTTPStatusError:
+                stats.errors += 1
+                raise
+            finally:
+                self.tunnels.release(endpoint)
+
+            if is_backpressure(last_error):
+                # 503 是 AI 端的背壓 (佇列已滿)，端點本身正常：不計入熔斷，依 Retry-After 稍候再試
+                self.busy += 1
+                delay = min(retry_after(last_error.response, delay), self.retry_after_max)
+            else:
+                self.tunnels.failure(endpoint, repr(last_error))
+
+            if attempt < self.retries:
+                logger.warning(f"{path} ({key}) attempt {attempt + 1} failed: {last_error}")
+                await asyncio.sleep(delay)
+
+        stats.errors += 1
+        raise last_error
+
+    async def detect(self, img_bytes, model=config.VEHICLE_MODEL, frame_id=None):
+        return await self._post("/detect", model, img_bytes, {'model': model}, frame_id)
+
+    async def segment(self, img_bytes, model=config.REDLINE_MODEL, frame_id=None):
+        return await self._post("/segment", model, img_bytes, {'model': model}, frame_id)
+
+    async def analyze(self, img_bytes, models=(config.VEHICLE_MODEL, config.REDLINE_MODEL), frame_id=None):
+        """One upload to /analyze; the AI service decodes once and runs every model."""
+        body = await self._post("/analyze", "analyze", img_bytes, {'models': list(models)}, frame_id)
+        for name, seconds in body.get("inference_time", {}).items():
+            self.latency.setdefault(name, ModelLatency()).last_inference_time = seconds
+        return body
+
+    async def infer(self, img_bytes, segment=True, frame_id=None):
+        """Run vehicle detection and road-marking segmentation on one frame.
+
+        Returns {"detections": [...], "segments": [...], "segmented": bool,
+        "timings": {...}} where timings are the AI service's own stage
+        times in ms (empty if it does not report them); `frame_id` is sent
+        as the X-Frame-Id header.
+        Uses the combined /analyze endpoint and falls back to concurrent
+        /detect + /segment calls when the AI service does not provide it.
+        With `segment=False` only the vehicle model runs; "segmented" is
+        False whenever the segments list is not a fresh segmentation result.
+        """
+        start = time.perf_counter()
+        models = (config.VEHICLE_MODEL, config.REDLINE_MODEL) if segment else (config.VEHICLE_MODEL,)
+        if self.use_analyze:
+            try:
+                body = await self.analyze(img_bytes, models, frame_id)
+                self.frame_latency.record(time.perf_counter() - start)
+                return {"detections": body.get("detections", []), "segments": body.get("segments", []),
+                        "segmented": segment, "timings": body.get("timings", {})}
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 404:
+                    raise
+                logger.warning("AI service has no /analyze, falling back to /detect + /segment")
+                self.use_analyze = False
+
+        if not segment:
+            body = await self.detect(img_bytes, frame_id=frame_id)
+            self.frame_latency.record(time.perf_counter() - start)
+            return {"detections": body.get("detections", []), "segments": [], "segmented": False,
+                    "timings": body.get("timings", {})}
+        return await self._infer_parallel(img_bytes, start, frame_id)
+
+    async def _infer_parallel(self, img_bytes, start, frame_id=None):
+        # 單一呼叫失敗時該列表為空；兩者皆失敗才拋出例外
+        v_data, r_data = await asyncio.gather(
+            self.detect(img_bytes, frame_id=frame_id), self.segment(img_bytes, frame_id=frame_id),
+            return_exceptions=True
+        )
+
+        for name, res in (("vehicle", v_data), ("redline", r_data)):
+            if isinstance(res, Exception):
+                logger.error(f"{name} inference failed: {res}")
+        if isinstance(v_data, Exception) and isinstance(r_data, Exception):
+            raise v_data
+
+        self.frame_latency.record(time.perf_counter() - start)
+        return {
+            "detections": [] if isinstance(v_data, Exception) else v_data.get("detections", []),
+            "segments": [] if isinstance(r_data, Exception) else r_data.get("segments", []),
+            "segmented": not isinstance(r_data, Exception),
+            # 兩個請求並行，以車輛偵測的耗時為代表
+            "timings": {} if isinstance(v_data, Exception) else v_data.get("timings", {}),
+        }
+
+    def stats(self):
+        return {
+            "endpoints": [e.name for e in self.tunnels.endpoints],
+            "timeout": {"connect": self.timeout.connect, "read": self.timeout.read},
+            "retries": self.retries,
+            "busy": self.busy,
+            "use_analyze": self.use_analyze,
+            "max_connections": self.limits.max_connections,
+            "frame": self.frame_latency.as_dict(),
+            "models": {name: s.as_dict() for name, s in self.latency.items()},
+        }
+
+
+def create_inference_client(tunnels):
+    return InferenceClient(
+        tunnels,
+        connect_timeout=config.AI_CONNECT_TIMEOUT,
+        read_timeout=config.AI_READ_TIMEOUT,
+        retries=config.AI_RETRIES,
+        retry_backoff=config.AI_RETRY_BACKOFF,
+        max_connections=config.AI_MAX_CONNECTIONS,
+        use_analyze=config.AI_USE_ANALYZE,
+        retry_after_max=config.AI_RETRY_AFTER_MAX,
+    )
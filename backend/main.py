@@ -1,19 +1,39 @@
-import shutil
+import asyncio
+import hashlib
+import io
+import json
+import time
 from contextlib import asynccontextmanager
-import requests
+from functools import partial
 import logging
 from models import ParkingViolationLog
+from starlette.background import BackgroundTask
 from starlette.requests import ClientDisconnect
 from datetime import datetime
-from fastapi import FastAPI, UploadFile, File, Depends, Request, Query, BackgroundTasks
+from typing import List, Optional
+from fastapi import FastAPI, UploadFile, File, Depends, Request, Query, BackgroundTasks, HTTPException, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from pydantic import BaseModel
+from sqlalchemy import or_
 from sqlalchemy.orm import Session
-from database import engine, SessionLocal, Base
+from database import engine, async_engine, SessionLocal, AsyncSessionLocal, Base, ensure_columns, ensure_indexes
 from PIL import Image, ImageDraw
-import numpy as np
-from ssh_tunnel import start_ssh_tunnel
+from ssh_tunnel import AIUnavailable, TunnelSupervisor, build_endpoints
+from inference_client import create_inference_client
+from db_writer import DBWriter
+from devices import DeviceRegistry
+from pipeline import InferencePipeline
+from frame_store import Frame, encode_jpeg
+from metrics import FrameTrace, frame_key
+from frame_protocol import CODECS, FORMAT_NAMES, decode_frame
+from geometry import find_violations, car_zone_types
+from scene import luma_signature
+from tracker import ViolationTracker
 import config
+import metrics
 import state
 
 logging.basicConfig(
@@ -25,29 +45,70 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 Base.metadata.create_all(bind=engine)
+ensure_columns(ParkingViolationLog.__table__)
+ensure_indexes(ParkingViolationLog.__table__)
+
+MANUAL_DEVICE_ID = "manual"
+
+# segmentation class name 關鍵字 -> 禁停區類型
+ZONE_TYPES = (("red", "Red Line"), ("yellow", "Yellow Line"), ("crosswalk", "Crosswalk"))
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("System Starting...")
 
-    state.ssh_proc = start_ssh_tunnel()
-
-    if state.ssh_proc:
-        logger.info(f"SSH Tunnel active (PID: {state.ssh_proc.pid})")
-    else:
-        logger.error("SSH Tunnel failed!")
+    state.tunnels = TunnelSupervisor(
+        build_endpoints(config.AI_TUNNEL_HOSTS, config.AI_TUNNEL_LOCAL_PORT, config.AI_TUNNEL_REMOTE_PORT,
+                        config.AI_SERVICE_URLS),
+        health_path=config.AI_HEALTH_PATH,
+        probe_interval=config.TUNNEL_PROBE_INTERVAL,
+        probe_timeout=config.TUNNEL_PROBE_TIMEOUT,
+        failure_threshold=config.AI_CIRCUIT_FAILURES,
+        restart_after=config.TUNNEL_RESTART_AFTER,
+        backoff_initial=config.TUNNEL_BACKOFF_INITIAL,
+        backoff_max=config.TUNNEL_BACKOFF_MAX,
+        control_dir=config.SSH_CONTROL_DIR or None
+    )
+    state.tunnels.start()
+
+    state.zone_cache.load()
+
+    # DB 寫入改由背景批次執行，不在請求路徑上 commit
+    state.db_writer = DBWriter(
+        AsyncSessionLocal,
+        batch_size=config.DB_WRITE_BATCH_SIZE,
+        flush_ms=config.DB_WRITE_FLUSH_MS,
+        max_queue=config.DB_WRITE_QUEUE_MAX,
+        on_commit=mark_history_changed,
+        on_batch=metrics.record_db_batch
+    )
+    state.db_writer.start()
+    state.devices = DeviceRegistry(state.db_writer, id_pattern=config.DEVICE_ID_PATTERN,
+                                   max_devices=config.MAX_DEVICES)
+    state.devices.load()
+    close_stale_events()
+    flush_task = asyncio.create_task(flush_devices_periodically())
+    retention_task = asyncio.create_task(prune_evidence_periodically())
+
+    state.inference_client = create_inference_client(state.tunnels)
+    await state.inference_client.start()
+
+    state.pipeline = InferencePipeline(process_frame, workers=config.PIPELINE_WORKERS)
+    state.pipeline.start()
 
     yield
 
     logger.info("System Shutting down...")
-    if state.ssh_proc:
-        state.ssh_proc.terminate()
-        try:
-            state.ssh_proc.wait(timeout=3)
-        except:
-            state.ssh_proc.kill()
-        logger.info("SSH Tunnel closed.")
+    state.broadcaster.close()
+    flush_task.cancel()
+    retention_task.cancel()
+    await state.pipeline.stop()
+    state.devices.flush()
+    await state.db_writer.close()
+    await async_engine.dispose()
+    await state.inference_client.close()
+    await state.tunnels.close()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -86,235 +147,432 @@ def yolo_to_bbox(yolo_box, img_w, img_h):
     return [x1, y1, x2, y2]
 
 
-def check_intersection(boxA, boxB):
-    # box = [x1, y1, x2, y2]
-
-    xA = max(boxA[0], boxB[0])
-    yA = max(boxA[1], boxB[1])
-    xB = min(boxA[2], boxB[2])
-    yB = min(boxA[3], boxB[3])
+def draw_violation_boxes(image, car_boxes, red_line_boxes, yellow_line_boxes, crosswalk_boxes, quality=90):
+    """Draw boxes on a copy of the frame and return it as JPEG bytes (None on failure)."""
+    try:
+        img = image.copy()
+        draw = ImageDraw.Draw(img)
+
+        for r_box in red_line_boxes:
+            if r_box and len(r_box) == 4:
+                box = [int(c) for c in r_box]
+                draw.rectangle(box, outline="red", width=5)
+
+        for y_box in yellow_line_boxes:
+            if y_box and len(y_box) == 4:
+                box = [int(c) for c in y_box]
+                draw.rectangle(box, outline="yellow", width=5)
+
+        for c_box in crosswalk_boxes:
+            if c_box and len(c_box) == 4:
+                box = [int(c) for c in c_box]
+                draw.rectangle(box, outline="orange", width=5)
+
+        for car in car_boxes:
+            if len(car) == 4:
+                box = [int(c) for c in car]
+                draw.rectangle(box, outline="blue", width=3)
+
+        return encode_jpeg(img, quality)
+    except Exception as e:
+        logger.error(f"Failed to draw boxes: {e}")
+        return None
 
-    interWidth = max(0, xB - xA)
-    interHeight = max(0, yB - yA)
 
-    return interWidth > 0 and interHeight > 0
+def zones_from_segments(segments):
+    zones = []
+    for seg in segments:
+        class_name = seg.get("class_name", "").lower()
+        zone_type = next((t for key, t in ZONE_TYPES if key in class_name), None)
+        if zone_type and seg.get("bbox"):
+            zones.append({"type": zone_type, "bbox": seg["bbox"], "polygon": seg.get("polygon")})
+    return zones
 
 
-def draw_violation_boxes(input_path, output_path, car_boxes, red_line_boxes, yellow_line_boxes, crosswalk_boxes):
-    try:
-        with Image.open(input_path) as img:
-            img = img.convert("RGB")
-            draw = ImageDraw.Draw(img)
-
-            for r_box in red_line_boxes:
-                if r_box and len(r_box) == 4:
-                    box = [int(c) for c in r_box]
-                    draw.rectangle(box, outline="red", width=5)
-
-            for y_box in yellow_line_boxes:
-                if y_box and len(y_box) == 4:
-                    box = [int(c) for c in y_box]
-                    draw.rectangle(box, outline="yellow", width=5)
-
-            for c_box in crosswalk_boxes:
-                if c_box and len(c_box) == 4:
-                    box = [int(c) for c in c_box]
-                    draw.rectangle(box, outline="orange", width=5)
-
-            for car in car_boxes:
-                if len(car) == 4:
-                    box = [int(c) for c in car]
-                    draw.rectangle(box, outline="blue", width=3)
-
-            img.save(output_path, quality=95)
-            logger.info(f"Evidence saved: {output_path}")
-            return True
-    except Exception as e:
-        logger.error(f"Failed to draw boxes: {e}")
+async def flush_devices_periodically():
+    while True:
+        await asyncio.sleep(config.DEVICE_FLUSH_SECONDS)
         try:
-            shutil.copy(input_path, output_path)
-        except:
-            pass
-        return False
+            state.devices.flush()
+            if config.DEVICE_EXPIRE_DAYS > 0:
+                for device_id in state.devices.expire(config.DEVICE_EXPIRE_DAYS * 86400):
+                    forget_device_state(device_id)
+        except Exception as e:
+            logger.error(f"Device registry flush failed: {e}")
 
 
-def decode_rgb565(raw_bytes, w, h):
-    # 將 bytes 轉為 uint16 數組 (Big-endian)
-    data = np.frombuffer(raw_bytes, dtype='>u2')
+def forget_device_state(device_id):
+    """Drop everything kept per device once it is removed from the registry."""
+    state.pipeline.discard(device_id)
+    state.motion_gate.reset(device_id)
+    state.pixel_decoder.forget(device_id)
+    state.zone_cache.remove(device_id)
+    state.frame_store.remove(device_id)
+    state.trackers.pop(device_id, None)
+    state.legacy_frame_ids.pop(device_id, None)
+    state.device_commands.pop(device_id, None)
+    metrics.forget_device(device_id)
 
-    # 提取顏色分量
-    r = ((data & 0x1F) << 3).astype(np.uint8)  # Low 5 bits
-    g = (((data >> 5) & 0x3F) << 2).astype(np.uint8)  # Mid 6 bits
-    b = (((data >> 11) & 0x1F) << 3).astype(np.uint8)  # High 5 bits
 
-    # 合併成 RGB 並轉為圖片
-    rgb = np.stack((r, g, b), axis=-1).reshape((h, w, 3))
-    return Image.fromarray(rgb)
+async def prune_evidence_periodically():
+    while True:
+        try:
+            # 掃描/刪檔在 threadpool 進行；被刪除的證據在 DB 中改為 NULL
+            deleted = await asyncio.to_thread(state.evidence_store.prune)
+            for i in range(0, len(deleted), 500):
+                state.db_writer.update(ParkingViolationLog, ParkingViolationLog.image_path.in_(deleted[i:i + 500]),
+                                       {"image_path": None, "thumbnail_path": None})
+        except Exception as e:
+            logger.error(f"Evidence retention failed: {e}")
+        await asyncio.sleep(config.EVIDENCE_RETENTION_SECONDS)
+
+
+def device_dwell_seconds(device_id):
+    device = state.devices.get(device_id)
+    if device is not None and device.dwell_seconds is not None:
+        return device.dwell_seconds
+    return config.VIOLATION_DWELL_SECONDS
 
 
-def detect_parking(img_w, img_h):
-    logger.info(f"Image size: {img_w}x{img_h}")
+def get_tracker(device_id):
+    tracker = state.trackers.get(device_id)
+    if tracker is None:
+        tracker = ViolationTracker(
+            iou_threshold=config.TRACK_IOU_THRESHOLD,
+            dwell_seconds=device_dwell_seconds(device_id),
+            leave_seconds=config.TRACK_LEAVE_SECONDS,
+            update_seconds=config.EVENT_UPDATE_SECONDS
+        )
+        state.trackers[device_id] = tracker
+    return tracker
+
+
+def mark_history_changed(models):
+    # /api/history 的 ETag 依此版本號產生；只有寫入違規紀錄的批次才遞增 (裝置統計等不影響)
+    if ParkingViolationLog in models:
+        state.history_version += 1
+
+
+def close_stale_events():
+    """Events left open by a previous run can no longer be tracked; close them at their last sighting."""
+    with SessionLocal() as db:
+        closed = db.query(ParkingViolationLog) \
+            .filter(ParkingViolationLog.event_state == "open") \
+            .update({"event_state": "closed", "ended_at": ParkingViolationLog.last_seen_at},
+                    synchronize_session=False)
+        db.commit()
+    if closed:
+        mark_history_changed({ParkingViolationLog})
+        logger.info(f"Closed {closed} violation event(s) left open by the previous run")
+
+
+async def save_evidence(frame):
+    # 只有違規證據才寫入磁碟；檔名為內容雜湊，同一秒內多筆也不會互相覆蓋
+    # 雜湊、縮圖編碼與寫檔在 threadpool 進行，不阻塞 event loop
+    with frame.trace.stage("evidence"):
+        return await asyncio.to_thread(state.evidence_store.save, frame.display_jpeg())
+
+
+async def persist_events(frame, events):
+    """Queue tracker events: one row and one evidence image per event, updated in place by event key."""
+    for kind, track in events:
+        zone_type = ", ".join(sorted(track.event_zone_types))
+        if kind == "open":
+            evidence_path, thumbnail_path = await save_evidence(frame)
+            track.event_key = f"{frame.device_id}:{track.id}:{int(track.event_started * 1000)}"
+            track.event_id = None
+            log = ParkingViolationLog(
+                image_path=evidence_path,
+                thumbnail_path=thumbnail_path,
+                is_violation=True,
+                car_detected=True,
+                status=f"VIOLATION: Car in {zone_type}!",
+                device_id=frame.device_id,
+                track_id=track.id,
+                zone_type=zone_type,
+                started_at=datetime.fromtimestamp(track.event_started),
+                last_seen_at=datetime.fromtimestamp(track.last_seen),
+                dwell_seconds=round(track.event_dwell(), 1),
+                frames=track.hits,
+                event_state="open",
+                event_key=track.event_key
+            )
+            state.db_writer.insert(log).add_done_callback(partial(event_inserted, track, evidence_path))
+            continue
+
+        values = {
+            "zone_type": zone_type,
+            "last_seen_at": datetime.fromtimestamp(track.last_seen),
+            "dwell_seconds": round(track.event_dwell(), 1),
+            "frames": track.hits,
+        }
+        if kind == "close":
+            values["ended_at"] = values["last_seen_at"]
+            values["event_state"] = "closed"
+            logger.info(f"違規事件 {track.event_key} 結案: 停留 {values['dwell_seconds']} 秒")
+        state.db_writer.update(ParkingViolationLog, ParkingViolationLog.event_key == track.event_key, values)
+
+
+def event_inserted(track, evidence_path, future):
+    if future.exception() is not None:
+        logger.error(f"Violation event {track.event_key} was not saved: {future.exception()}")
+        return
+    track.event_id = future.result()
+    logger.info(f"違規事件 #{track.event_id} 開立: {track.event_key}, {evidence_path}")
+
+
+def tracker_verdict(tracker):
+    """(is_violation, status) from a camera's tracker, or None when no car is in a zone."""
+    open_tracks = tracker.open_tracks()
+    if open_tracks:
+        v_str = ", ".join(sorted(set().union(*(t.event_zone_types for t in open_tracks))))
+        n = len(open_tracks)
+        return True, f"VIOLATION: {n} Car{'s' if n > 1 else ''} in {v_str}!"
+
+    pending = tracker.pending_tracks()
+    if pending:
+        v_str = ", ".join(sorted(set().union(*(t.zone_types for t in pending))))
+        dwell = max(t.dwell(tracker.last_update) for t in pending)
+        n = len(pending)
+        return False, (f"Pending: {n} Car{'s' if n > 1 else ''} in {v_str} "
+                       f"({dwell:.0f}/{tracker.dwell_seconds:.0f} s)")
+    return None
+
+
+def latest_event_id(tracker):
+    ids = [t.event_id for t in tracker.open_tracks() if t.event_id is not None]
+    return max(ids) if ids else 0
+
+
+async def detect_parking(frame, use_zone_cache=True, signature=None, tracker=None):
+    """Analyze one frame. Camera frames go through `tracker` (one event per parked car);
+    without a tracker every violating frame is logged on its own (manual uploads)."""
+    logger.info(f"Image size: {frame.width}x{frame.height}")
+    trace = frame.trace
     car_count = 0
     car_boxes = []
-    red_line_detected = False
-    red_line_boxes = []
-    yellow_line_detected = False
-    yellow_line_boxes = []
-    crosswalk_detected = False
-    crosswalk_boxes = []
     is_violation = False
     status_msg = "Analyzing..."
-    try:
-        with open(config.LIVE_IMG_PATH, 'rb') as f:
-            img_bytes = f.read()
-    except FileNotFoundError:
-        return False, "Error: Image not found"
+    log_id = 0
 
     try:
-        # 呼叫車輛模型
-        resp_veh = requests.post(config.VEHICLE_API_URL,
-                                 files={'image': ('live.jpg', img_bytes, 'image/jpeg')},
-                                 data={'model': 'yolov13n'}, timeout=20)
-        if resp_veh.status_code == 200:
-            v_data = resp_veh.json()
-            # logging.info(f"Vehicle detected: {v_data}")
-            detections = v_data.get("detections", [])
-            for det in detections:
-                if det.get("class_name") == "car":
-                    car_boxes.append(det["bbox"])
-
-            car_count = len(car_boxes)
-            logging.info(f"Cars detected: {car_count}")
-
-        # 呼叫紅線模型
-        resp_red = requests.post(config.REDLINE_API_URL,
-                                 files={'image': ('live.jpg', img_bytes, 'image/jpeg')},
-                                 data={'model': 'yolov11m-segv2'}, timeout=20)
-        if resp_red.status_code == 200:
-            r_data = resp_red.json()
-            # logging.info(f"Red line detected: {r_data}")
-            segments = r_data.get("segments", [])
-
-            for seg in segments:
-                class_name = seg.get("class_name", "").lower()
-                if "red" in class_name:
-                    red_line_detected = True
-                    red_line_boxes.append(seg.get("bbox"))
-                elif "yellow" in class_name:
-                    yellow_line_detected = True
-                    yellow_line_boxes.append(seg.get("bbox"))
-                elif "crosswalk" in class_name:
-                    crosswalk_detected = True
-                    crosswalk_boxes.append(seg.get("bbox"))
-
-            # red_line_count = len(red_line_boxes)
-            logging.info(f"Red: {len(red_line_boxes)}, Yellow: {len(yellow_line_boxes)}, Crosswalk: {len(crosswalk_boxes)}")
-
-        draw_violation_boxes(
-            config.LIVE_IMG_PATH,
-            config.LIVE_IMG_PATH,
-            car_boxes,
-            red_line_boxes,
-            yellow_line_boxes,
-            crosswalk_boxes
-        )
-        # 核心判斷邏輯
-        any_restricted_zone = red_line_detected or yellow_line_detected or crosswalk_detected
-        
-        if car_count > 0 and any_restricted_zone:
-            overlap_count = 0
-            violation_types = set()
-
-            for c_box in car_boxes:
-                car_hit = False
-                # Check Red Line
-                for r_box in red_line_boxes:
-                    if check_intersection(c_box, r_box):
-                        car_hit = True
-                        violation_types.add("Red Line")
-                        break
-                
-                # Check Yellow Line if not already hit
-                # (You can separate logic if you want to track multiple violations per car, but simple is ok)
-                for y_box in yellow_line_boxes:
-                    if check_intersection(c_box, y_box):
-                        car_hit = True
-                        violation_types.add("Yellow Line")
-                        break
-                        
-                # Check Crosswalk
-                for cr_box in crosswalk_boxes:
-                    if check_intersection(c_box, cr_box):
-                        car_hit = True
-                        violation_types.add("Crosswalk")
-                        break
-
-                if car_hit:
-                    overlap_count += 1
-
-            if overlap_count > 0:
-                is_violation = True
-                v_str = ", ".join(violation_types)
-                status_msg = f"VIOLATION: {overlap_count} Car{'s' if overlap_count > 1 else ''} in {v_str}!"
-            else:
-                status_msg = "Safe: Car detected but not in restricted zones"
-
+        # 固定攝影機的禁停區不會移動：快取有效時只跑車輛偵測
+        refresh_reason = "uncached"
+        if use_zone_cache and config.ZONE_CACHE_ENABLED:
+            if signature is None:
+                signature = luma_signature(frame.image)
+            refresh_reason = state.zone_cache.refresh_reason(frame.device_id, frame.width, frame.height, signature)
+
+        with trace.stage("jpeg_encode"):
+            jpeg = frame.jpeg()
+        # 單次上傳：車輛與紅線模型在 AI 端共用同一張解碼影像
+        with trace.stage("inference"):
+            result = await state.inference_client.infer(jpeg, segment=refresh_reason is not None,
+                                                        frame_id=trace.frame_key)
+        record_ai_timings(trace, result["timings"])
+
+        for det in result["detections"]:
+            if det.get("class_name") == "car":
+                car_boxes.append(det["bbox"])
+
+        car_count = len(car_boxes)
+        logging.info(f"Cars detected: {car_count}")
+
+        if refresh_reason is None:
+            zones = state.zone_cache.get(frame.device_id).zones
+        else:
+            zones = zones_from_segments(result["segments"])
+            if refresh_reason != "uncached" and result["segmented"]:
+                state.zone_cache.update(frame.device_id, zones, frame.width, frame.height, signature, refresh_reason)
+                logger.info(f"Zones for {frame.device_id} refreshed ({refresh_reason}): {len(zones)}")
+
+        red_line_boxes = [z["bbox"] for z in zones if z["type"] == "Red Line"]
+        yellow_line_boxes = [z["bbox"] for z in zones if z["type"] == "Yellow Line"]
+        crosswalk_boxes = [z["bbox"] for z in zones if z["type"] == "Crosswalk"]
+        logging.info(f"Red: {len(red_line_boxes)}, Yellow: {len(yellow_line_boxes)}, Crosswalk: {len(crosswalk_boxes)}")
+
+        with trace.stage("annotate"):
+            frame.annotated_jpeg = draw_violation_boxes(
+                frame.image,
+                car_boxes,
+                red_line_boxes,
+                yellow_line_boxes,
+                crosswalk_boxes,
+                quality=config.JPEG_QUALITY
+            )
+        # 該攝影機有指定判定的禁停區類型時，其餘類型只畫出不判定
+        device = state.devices.get(frame.device_id)
+        if device is not None and device.zone_types:
+            zones = [z for z in zones if device.enforces(z["type"])]
+
+        # 核心判斷邏輯：所有車輛 x 禁停區一次以 NumPy 計算重疊比例
+        car_types = [set() for _ in car_boxes]
+        overlap_count = 0
+        if car_count > 0 and zones:
+            with trace.stage("overlap"):
+                overlap_count, violation_types, overlap = find_violations(
+                    car_boxes, zones, frame.width, frame.height,
+                    mode=config.OVERLAP_MODE,
+                    min_overlap=config.MIN_OVERLAP_FRACTION,
+                    min_overlap_by_type=config.MIN_OVERLAP_BY_TYPE
+                )
+                car_types = car_zone_types(overlap, zones, config.MIN_OVERLAP_FRACTION, config.MIN_OVERLAP_BY_TYPE)
+
+        verdict = None
+        if tracker is not None:
+            with trace.stage("tracking"):
+                await persist_events(frame, tracker.update(car_boxes, car_types))
+            verdict = tracker_verdict(tracker)
+            log_id = latest_event_id(tracker)
+        elif overlap_count > 0:
+            v_str = ", ".join(sorted(violation_types))
+            verdict = True, f"VIOLATION: {overlap_count} Car{'s' if overlap_count > 1 else ''} in {v_str}!"
+
+        if verdict is not None:
+            is_violation, status_msg = verdict
+        elif car_count > 0 and zones:
+            status_msg = "Safe: Car detected but not in restricted zones"
         elif car_count > 0:
             status_msg = "Safe: Car detected, No Restricted Zones"
-        elif any_restricted_zone:
+        elif zones:
             status_msg = "Safe: Restricted Zones detected, No Cars"
         else:
             status_msg = "Safe: Clear"
 
+    except AIUnavailable as e:
+        # tunnel 斷線中：熔斷器讓這張影像立即失敗，不佔用 pipeline 等逾時
+        logger.warning(f"Frame {trace.frame_key} not analyzed: {e}")
+        status_msg = "AI Offline"
     except Exception as e:
-        print(f"Error: {e}")
+        logger.error(f"Analysis failed ({trace.frame_key}): {e}")
         status_msg = "System Error"
 
-    log_id = 0
-
-    if is_violation:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        evidence_path = f"static/uploads/{timestamp}_evidence.jpg"
-        shutil.copy(config.LIVE_IMG_PATH, evidence_path)
-
-        with SessionLocal() as db:
-            new_log = ParkingViolationLog(
+    if is_violation and tracker is None:
+        evidence_path, thumbnail_path = await save_evidence(frame)
+        try:
+            log_id = await state.db_writer.insert(ParkingViolationLog(
                 image_path=evidence_path,
+                thumbnail_path=thumbnail_path,
                 is_violation=True,
                 car_detected=True,
-                status=status_msg
-            )
-            db.add(new_log)
-            db.commit()
-            db.refresh(new_log)
-            log_id = new_log.id
-            print(f"違規存檔: {evidence_path}")
+                status=status_msg,
+                device_id=frame.device_id
+            ))
+            logger.debug(f"違規存檔: {evidence_path}")
+        except Exception as e:
+            logger.error(f"Violation log not saved: {e}")
+
+    update_latest(frame, log_id, is_violation, car_count > 0, status_msg)
+    return is_violation, status_msg
+
+
+def record_ai_timings(trace, timings):
+    """Add the AI service's own stage times to the trace; the rest of the round trip is network + HTTP."""
+    for stage, ms in timings.items():
+        trace.record(f"ai_{stage}", ms / 1000, observe=False)
+    if "total" in timings and "inference" in trace.stages:
+        trace.record("network", max(0.0, (trace.stages["inference"] - timings["total"]) / 1000))
+
+
+def update_latest(frame, log_id, is_violation, car_detected, status_msg, image_changed=True):
+    device = state.devices.get(frame.device_id)
+    previous = device.latest if device is not None and device.latest else state.latest_cache
+    image_url = previous["image_url"]
+    # 顯示的影像沒變 (沿用標註圖) 就保留原網址，瀏覽器不必重抓
+    if image_changed or not image_url or not image_url.startswith(f"/api/live/{frame.device_id}.jpg"):
+        image_url = f"/api/live/{frame.device_id}.jpg?t={datetime.now().timestamp()}"
 
     timestamp_now = datetime.now().isoformat()
     state.latest_cache = {
         "id": log_id,
         "timestamp": timestamp_now,
         "is_violation": is_violation,
-        "car_detected": (car_count > 0),
+        "car_detected": car_detected,
         "status": status_msg,
-        "image_url": f"/static/{config.LIVE_IMG_FILENAME}?t={datetime.now().timestamp()}"
+        "image_url": image_url,
+        "device_id": frame.device_id,
+        "frame_id": frame.frame_id,
+        # 各階段耗時 (ms)：上傳、解碼、排隊、AI、標註、存證...
+        "timings": frame.trace.finish()
     }
-    return is_violation, status_msg
+    device = state.devices.get(frame.device_id)
+    if device is not None:
+        device.latest = state.latest_cache
+    state.broadcaster.publish(state.latest_cache)
+
+
+def ring_command(device_id):
+    """Latest alert command for a device (from its most recently analyzed frame)."""
+    return state.device_commands.get(device_id, {"command": "ring", "value": "false", "frame": None})
+
+
+async def process_frame(job):
+    device_id = job["device_id"]
+    trace = job["trace"]
+    trace.record("queue_wait", time.perf_counter() - job["queued_at"])
+    frame = Frame(device_id, job["frame_id"], job["image"], quality=config.JPEG_QUALITY, trace=trace)
+    with trace.stage("motion_gate"):
+        signature = luma_signature(frame.image)
+        gate_reason = state.motion_gate.check(device_id, signature) if config.MOTION_GATE_ENABLED else "disabled"
+    if gate_reason is None:
+        # 畫面與上一張已分析影像相同：沿用判定與標註圖，不送 AI
+        baseline = state.motion_gate.baseline(device_id)
+        previous = state.frame_store.get(device_id)
+        if previous is not None:
+            frame.annotated_jpeg = previous.annotated_jpeg
+        state.frame_store.put(frame)
+        state.frame_store.publish(frame)
+        # 畫面不變代表車輛仍在原處：以上次觀測推進追蹤器 (停留時間照樣累積)
+        tracker = get_tracker(device_id)
+        await persist_events(frame, tracker.update(*tracker.last_observations))
+        is_violation, status_msg = tracker_verdict(tracker) or baseline.verdict
+        update_latest(frame, latest_event_id(tracker), is_violation, bool(tracker.last_observations[0]), status_msg,
+                      image_changed=frame.annotated_jpeg is None)
+        state.device_commands[device_id] = {
+            "command": "ring",
+            "value": 'true' if is_violation else 'false',
+            "frame": job["frame_id"],
+            "message": status_msg,
+            "reused_from": baseline.frame_id
+        }
+        metrics.PROCESSED.labels(device_id, "reused").inc()
+        return
+
+    state.frame_store.put(frame)
+    is_violation, status_msg = await detect_parking(frame, signature=signature, tracker=get_tracker(device_id))
+    state.frame_store.publish(frame)
+    state.device_commands[device_id] = {
+        "command": "ring",
+        "value": 'true' if is_violation else 'false',
+        "frame": job["frame_id"],
+        "message": status_msg
+    }
+    # 推論失敗不當作基準，下一張影像照常分析
+    if status_msg in ("System Error", "AI Offline"):
+        metrics.PROCESSED.labels(device_id, "ai_offline" if status_msg == "AI Offline" else "error").inc()
+        return
+    metrics.PROCESSED.labels(device_id, "analyzed").inc()
+    state.motion_gate.record(device_id, signature, job["frame_id"], (is_violation, status_msg), gate_reason)
 
 
 @app.post("/api/upload_form")
 async def upload_form(file: UploadFile = File(...)):
-    with open(config.LIVE_IMG_PATH, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    img_w, img_h = 640, 480
+    data = await file.read()
     try:
-        with Image.open(config.LIVE_IMG_PATH) as img:
-            img_w, img_h = img.size
+        img = Image.open(io.BytesIO(data))
+        img.load()
     except Exception as e:
-        print(f"Warning: Cannot read image size, using default 640x480. Error: {e}")
+        return {"status": "error", "message": f"Cannot read image: {e}"}
+
+    # 已是 JPEG 就直接送 AI，不再重新編碼
+    jpeg = data if img.format == "JPEG" else None
+    frame = Frame(MANUAL_DEVICE_ID, 0, img, jpeg=jpeg, quality=config.JPEG_QUALITY,
+                  trace=FrameTrace(frame_key(MANUAL_DEVICE_ID, 0)))
+    state.frame_store.put(frame)
 
-    is_violation, status_msg = detect_parking(img_w, img_h)
+    # 手動上傳的影像不是固定攝影機畫面，每次都重新分割
+    is_violation, status_msg = await detect_parking(frame, use_zone_cache=False)
+    state.frame_store.publish(frame)
 
     return {
         "status": "processed",
@@ -324,96 +582,468 @@ async def upload_form(file: UploadFile = File(...)):
     }
 
 
+@app.get("/api/live/{device_id}.jpg")
+def get_live_image(device_id: str):
+    frame = state.frame_store.get(device_id)
+    if frame is None:
+        raise HTTPException(status_code=404, detail="No frame for this device")
+    return Response(content=frame.display_jpeg(), media_type="image/jpeg",
+                    headers={"Cache-Control": "no-store"})
+
+
+MJPEG_BOUNDARY = "frame"
+
+
+@app.get("/api/live/{device_id}.mjpeg")
+async def stream_live_video(device_id: str, request: Request,
+                            fps: float = Query(None, gt=0, description="Frame-rate cap for this viewer")):
+    """multipart/x-mixed-replace stream of the device's annotated frames, straight from memory.
+
+    Each viewer is capped at `fps` (at most MJPEG_MAX_FPS). A viewer that
+    is slower than the camera skips to the newest frame instead of queueing.
+    """
+    if state.live_stats["viewers"] >= config.MJPEG_MAX_VIEWERS:
+        raise HTTPException(status_code=503, detail="Too many live viewers", headers={"Retry-After": "5"})
+    # 檢查與佔位在同一步完成，併發連線才不會一起通過上限
+    state.live_stats["viewers"] += 1
+    interval = 1.0 / min(fps or config.MJPEG_MAX_FPS, config.MJPEG_MAX_FPS)
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            state.live_stats["viewers"] -= 1
+
+    async def frames():
+        loop = asyncio.get_running_loop()
+        sent_version = 0
+        next_send = 0.0
+        try:
+            while not await request.is_disconnected():
+                # 無新影像時定期重送上一張，保持連線並讓新觀看者立即看到畫面
+                updated = await state.frame_store.wait_published(device_id, sent_version,
+                                                                 config.MJPEG_KEEPALIVE_SECONDS)
+                if updated:
+                    # 每位觀看者的 fps 上限；等待期間到達的舊影像直接略過
+                    delay = next_send - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                frame, version = state.frame_store.published(device_id)
+                if frame is None:
+                    continue
+                if updated and sent_version and version - sent_version > 1:
+                    state.live_stats["dropped"] += version - sent_version - 1
+
+                jpeg = frame.display_jpeg()
+                next_send = loop.time() + interval
+                sent_version = version
+                state.live_stats["sent"] += 1
+                yield (f"--{MJPEG_BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                       f"Content-Length: {len(jpeg)}\r\n\r\n").encode() + jpeg + b"\r\n"
+        finally:
+            release()
+
+    # 連線在 generator 啟動前就中斷時 finally 不會執行，由 background 補釋放
+    return StreamingResponse(frames(), media_type=f"multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}",
+                             headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+                             background=BackgroundTask(release))
+
+
+@app.get("/api/system/live")
+def get_live_stats():
+    return state.live_stats
+
+
 @app.get("/api/system/status")
 def get_system_status():
-    tunnel_active = state.ssh_proc.poll() is None
+    # tunnel_active / tunnel_pid 沿用舊欄位：任一端點可用 / 第一條存活的 tunnel
+    pids = [e.proc.pid for e in state.tunnels.endpoints if e.tunnel_alive()] if state.tunnels else []
     return {
         "status": "online",
-        "tunnel_active": tunnel_active,
-        "tunnel_pid": state.ssh_proc.pid if tunnel_active else None,
+        "tunnel_active": state.tunnels is not None and state.tunnels.healthy,
+        "tunnel_pid": pids[0] if pids else None,
+        "ai_endpoints": state.tunnels.stats()["endpoints"] if state.tunnels else [],
         "timestamp": datetime.now().isoformat()
     }
 
 
+@app.get("/api/system/tunnels")
+def get_tunnel_stats():
+    return state.tunnels.stats()
+
+
+@app.get("/api/system/inference")
+def get_inference_stats():
+    return state.inference_client.stats()
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus exposition: per-stage latency histograms, per-device frame counters and fps,
+    queue depths, AI endpoint state and error counters."""
+    body, content_type = metrics.render(state.devices, state.pipeline, state.db_writer, state.frame_assembler,
+                                        state.broadcaster, state.tunnels)
+    return Response(content=body, media_type=content_type)
+
+
 @app.post("/api/upload")
 async def upload_chunk(
         request: Request,
+        response: Response,
         # background_tasks: BackgroundTasks,
         offset: int = Query(...),
         total: int = Query(...),
         width: int = Query(320),
-        height: int = Query(240)
+        height: int = Query(240),
+        device: Optional[str] = Query(None),
+        frame: Optional[int] = Query(None)
 ):
     client_ip = request.client.host
+    device_id = device or client_ip
+    try:
+        camera = state.devices.get_or_create(device_id)
+    except ValueError as e:
+        logger.warning(f"Rejected upload from {client_ip}: {e}")
+        return {"status": "error", "message": str(e)}
 
     try:
         # 1. 安全讀取數據
         chunk_data = await request.body()
     except ClientDisconnect:
-        logger.warning(f"Client {client_ip} disconnected prematurelly.")
+        logger.warning(f"Client {device_id} disconnected prematurelly.")
         return {"status": "error", "message": "Disconnected"}
+    camera.record_chunk(len(chunk_data), client_ip)
 
-    # 2. 初始化或取得緩衝區
-    if client_ip not in state.active_transmissions or offset == 0:
-        state.active_transmissions[client_ip] = bytearray(total)
-        logger.info(f"New upload from {client_ip}, total size: {total}")
-
-    # 3. 寫入片段
-    buffer = state.active_transmissions[client_ip]
-    end_index = offset + len(chunk_data)
-
-    # 防止 offset 溢出導致 Crash
-    if end_index > total:
-        return {"status": "error", "message": "Data overflow"}
-
-    buffer[offset:end_index] = chunk_data
+    # 2. 舊版韌體不帶 frame id：offset == 0 視為新的一張
+    if frame is None:
+        if offset == 0 or device_id not in state.legacy_frame_ids:
+            state.legacy_frame_ids[device_id] = state.legacy_frame_ids.get(device_id, 0) + 1
+        frame = state.legacy_frame_ids[device_id]
 
-    # 4. 檢查是否完成
-    if end_index >= total:
-        logger.info(f"Image complete ({width}x{height}) from {client_ip}")
+    # 3. 寫入片段 (可亂序、可重送)
+    try:
+        partial = state.frame_assembler.add_chunk(device_id, frame, offset, total, width, height, chunk_data)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+
+    # 4. 所有位元組都到齊才解碼
+    if partial.complete:
+        logger.info(f"Image complete ({width}x{height}) frame {frame} from {device_id}")
+        camera.record_frame(frame, width, height)
+        trace = FrameTrace(frame_key(device_id, frame))
+        response.headers["X-Frame-Id"] = trace.frame_key
+        # 第一個分片到最後一個分片的時間
+        trace.record("upload", partial.updated_at - partial.created_at)
         try:
-            # 使用解碼函式
-            img = decode_rgb565(buffer, width, height)
-            img.save(config.LIVE_IMG_PATH)
-
-            # 清理記憶體
-            del state.active_transmissions[client_ip]
-            is_violation, status_msg = detect_parking(width, height)
-            # background_tasks.add_task(detect_parking, width, height)
-            return {"status": "complete", "message": "Saved successfully", "command": "ring", "value": 'true' if is_violation else 'false'}
+            with trace.stage("decode"):
+                # 直接讀組裝好的緩衝區 (不複製)；格式依設定或自動偵測
+                fmt = state.pixel_decoder.format_for(device_id, partial.buffer, width, height)
+                img = state.pixel_decoder.decode(partial.buffer, width, height, fmt)
         except Exception as e:
-            logger.error(f"Decode failed: {e}")
-            if client_ip in state.active_transmissions:
-                del state.active_transmissions[client_ip]
+            logger.error(f"Decode failed ({trace.frame_key}): {e}")
             return {"status": "error", "message": str(e)}
+        finally:
+            # 緩衝區歸還 pool 重複使用
+            state.frame_assembler.release(partial)
+
+        return queue_frame(device_id, frame, img, width, height, trace)
+
+    return {"status": "chunk_received", "frame": frame, "progress": f"{int(partial.received / total * 100)}%"}
+
+
+def queue_frame(device_id, frame_id, img, width, height, trace):
+    # 推論交給 pipeline，立即回應；警報指令為該裝置上一張已分析影像的結果
+    metrics.FRAMES.labels(device_id).inc()
+    replaced = state.pipeline.submit(device_id, {
+        "device_id": device_id,
+        "frame_id": frame_id,
+        "image": img,
+        "width": width,
+        "height": height,
+        "trace": trace,
+        "queued_at": time.perf_counter()
+    })
+    command = ring_command(device_id)
+    return {
+        "status": "complete",
+        "frame": frame_id,
+        "message": "Queued for analysis",
+        "replaced_pending": replaced,
+        "command": command["command"],
+        "value": command["value"],
+        "analyzed_frame": command["frame"]
+    }
+
+
+@app.post("/api/frame")
+async def upload_frame(request: Request, response: Response):
+    """Whole frame in one request: binary header (device, frame id, size, codec, CRC) + pixels.
+
+    See frame_protocol.py for the layout. Replaces the chunked /api/upload for
+    firmware that can send one body per frame over a keep-alive connection.
+    """
+    client_ip = request.client.host
+    body = bytearray()
+    upload_start = None
+    try:
+        async for chunk in request.stream():
+            if upload_start is None:
+                upload_start = time.perf_counter()
+            body += chunk
+            if len(body) > config.FRAME_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"Frame larger than {config.FRAME_MAX_BYTES} bytes")
+    except ClientDisconnect:
+        logger.warning(f"Client {client_ip} disconnected before the frame was complete.")
+        return {"status": "error", "message": "Disconnected"}
+    upload_seconds = time.perf_counter() - upload_start if upload_start is not None else 0.0
 
-    return {"status": "chunk_received", "progress": f"{int(end_index / total * 100)}%"}
+    decode_start = time.perf_counter()
+    stage = "decode"
+    try:
+        # PackBits 解壓是純 Python 迴圈，移出 event loop
+        header, raw = await asyncio.to_thread(decode_frame, body, config.FRAME_MAX_RAW_BYTES)
+        device_id = header.device_id or client_ip
+        # 未登錄且 id 不合法或裝置數已滿：不建立任何該裝置的狀態
+        stage = "device"
+        camera = state.devices.get_or_create(device_id)
+        stage = "decode"
+        # 表頭未指定格式時同分片上傳：依設定或自動偵測
+        fmt = FORMAT_NAMES.get(header.format) or state.pixel_decoder.format_for(
+            device_id, raw, header.width, header.height)
+        img = state.pixel_decoder.decode(raw, header.width, header.height, fmt)
+    except ValueError as e:
+        state.frame_protocol_stats["rejected"] += 1
+        metrics.ERRORS.labels(stage).inc()
+        logger.warning(f"Rejected frame from {client_ip}: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    # frame id 在表頭內，解碼後才能建立 trace
+    trace = FrameTrace(frame_key(device_id, header.frame_id), started=decode_start)
+    trace.record("upload", upload_seconds)
+    trace.record("decode", time.perf_counter() - decode_start)
+    response.headers["X-Frame-Id"] = trace.frame_key
+
+    camera.record_chunk(len(body), client_ip)
+    camera.record_frame(header.frame_id, header.width, header.height)
+
+    stats = state.frame_protocol_stats
+    stats["frames"] += 1
+    stats["bytes"] += len(body)
+    stats["raw_bytes"] += header.raw_len
+    codec = CODECS[header.codec]
+    stats["by_codec"][codec] = stats["by_codec"].get(codec, 0) + 1
+    logger.info(f"Frame {header.frame_id} from {device_id} ({header.width}x{header.height}, {codec}, "
+                f"{len(body)} bytes)")
+    return queue_frame(device_id, header.frame_id, img, header.width, header.height, trace)
+
+
+@app.get("/api/device/{device_id}/command")
+def get_device_command(device_id: str):
+    return ring_command(device_id)
+
+
+@app.get("/api/system/pipeline")
+def get_pipeline_stats():
+    return state.pipeline.stats()
+
+
+@app.get("/api/system/motion")
+def get_motion_gate_stats():
+    stats = state.motion_gate.stats()
+    # 以平均單張推論延遲估算省下的 AI 時間
+    frame_latency = state.inference_client.frame_latency if state.inference_client else None
+    if frame_latency is not None and frame_latency.calls:
+        stats["estimated_saved_seconds"] = round(stats["skipped"] * frame_latency.total / frame_latency.calls, 2)
+    return stats
+
+
+@app.get("/api/system/tracks")
+def get_track_stats():
+    return {device_id: tracker.stats() for device_id, tracker in state.trackers.items()}
+
+
+@app.get("/api/system/db")
+def get_db_stats():
+    return {"writer": state.db_writer.stats(), "pool": engine.pool.status(), "async_pool": async_engine.pool.status()}
+
+
+@app.get("/api/system/evidence")
+def get_evidence_stats():
+    return state.evidence_store.stats()
+
+
+@app.get("/api/system/decoder")
+def get_decoder_stats():
+    return state.pixel_decoder.stats()
+
+
+@app.post("/api/system/decoder/{device_id}/redetect")
+def redetect_pixel_format(device_id: str):
+    """Detect the pixel format of `device_id` again from its next frames (PIXEL_FORMAT=auto)."""
+    state.pixel_decoder.forget(device_id)
+    return {"status": "scheduled", "device_id": device_id}
+
+
+@app.get("/api/system/uploads")
+def get_upload_stats():
+    stats = state.frame_assembler.stats()
+    frames = state.frame_protocol_stats["frames"]
+    stats["frame_protocol"] = {
+        **state.frame_protocol_stats,
+        "bytes_per_frame": round(state.frame_protocol_stats["bytes"] / frames) if frames else None,
+        "compression_ratio": round(state.frame_protocol_stats["bytes"] / state.frame_protocol_stats["raw_bytes"], 3)
+        if frames else None,
+    }
+    return stats
+
+
+@app.get("/api/zones")
+def get_zone_cache_stats():
+    return state.zone_cache.stats()
+
+
+@app.get("/api/zones/{device_id}")
+def get_device_zones(device_id: str):
+    entry = state.zone_cache.get(device_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="No cached zones for this device")
+    return {"device_id": device_id, "width": entry.width, "height": entry.height,
+            "updated_at": entry.updated_at, "zones": entry.zones}
+
+
+@app.post("/api/zones/{device_id}/refresh")
+def refresh_device_zones(device_id: str):
+    """Re-segment the road markings of `device_id` on its next analyzed frame."""
+    state.zone_cache.request_refresh(device_id)
+    return {"status": "scheduled", "device_id": device_id}
+
+
+HISTORY_COLUMNS = (
+    ParkingViolationLog.id,
+    ParkingViolationLog.timestamp,
+    ParkingViolationLog.status,
+    ParkingViolationLog.image_path,
+    ParkingViolationLog.thumbnail_path,
+    ParkingViolationLog.device_id,
+    ParkingViolationLog.zone_type,
+    ParkingViolationLog.started_at,
+    ParkingViolationLog.ended_at,
+    ParkingViolationLog.dwell_seconds,
+    ParkingViolationLog.event_state,
+)
 
 
 @app.get("/api/history")
-def get_history(db: Session = Depends(get_db)):
-    logs = db.query(ParkingViolationLog) \
-        .filter(ParkingViolationLog.is_violation == True) \
-        .order_by(ParkingViolationLog.id.desc()) \
-        .all()
-
-    results = []
-    for log in logs:
-        results.append({
-            "id": log.id,
-            "timestamp": log.timestamp,
-            "status": log.status,
-            "image_url": f"/{log.image_path}"
-        })
-    return results
+def get_history(
+        request: Request,
+        cursor: Optional[int] = Query(None, description="Return violations with id below this (next_cursor of the previous page)"),
+        limit: int = Query(50, ge=1, le=config.HISTORY_MAX_LIMIT),
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        violation_type: Optional[str] = Query(None, description="Red Line, Yellow Line or Crosswalk"),
+        device: Optional[str] = None,
+        db: Session = Depends(get_db)
+):
+    # 紀錄沒有變動且查詢條件相同 -> 304，不查 DB
+    params = f"{cursor}|{limit}|{since}|{until}|{violation_type}|{device}"
+    etag = f'W/"{state.history_epoch}-{state.history_version}-{hashlib.md5(params.encode()).hexdigest()[:12]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    # keyset 分頁：id < cursor，走 (is_violation, id) 索引，不用 OFFSET
+    query = db.query(*HISTORY_COLUMNS).filter(ParkingViolationLog.is_violation == True)
+    if cursor is not None:
+        query = query.filter(ParkingViolationLog.id < cursor)
+    if since is not None:
+        query = query.filter(ParkingViolationLog.timestamp >= since)
+    if until is not None:
+        query = query.filter(ParkingViolationLog.timestamp < until)
+    if device is not None:
+        query = query.filter(ParkingViolationLog.device_id == device)
+    if violation_type:
+        # 事件紀錄有 zone_type；舊紀錄只有 status 文字
+        query = query.filter(or_(ParkingViolationLog.zone_type.contains(violation_type),
+                                 ParkingViolationLog.status.contains(violation_type)))
+    rows = query.order_by(ParkingViolationLog.id.desc()).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    items = [{
+        "id": row.id,
+        "timestamp": row.timestamp,
+        "status": row.status,
+        "image_url": f"/{row.image_path}" if row.image_path else None,
+        # 舊紀錄沒有縮圖，退回原圖
+        "thumbnail_url": f"/{row.thumbnail_path or row.image_path}" if row.image_path else None,
+        "device_id": row.device_id,
+        "zone_type": row.zone_type,
+        "started_at": row.started_at,
+        "ended_at": row.ended_at,
+        "dwell_seconds": row.dwell_seconds,
+        "event_state": row.event_state
+    } for row in rows]
+
+    body = {"items": items, "next_cursor": rows[-1].id if has_more else None, "limit": limit}
+    return JSONResponse(content=jsonable_encoder(body), headers=headers)
+
+
+@app.get("/api/stream")
+async def stream_latest(request: Request, device: Optional[str] = None):
+    """Server-Sent Events: one `data:` message each time the dashboard state changes.
+
+    With `device` only that camera's updates are sent.
+    """
+    queue = state.broadcaster.subscribe(device)
+
+    async def events():
+        try:
+            # 連線後先送目前狀態，之後只在有變化時推送
+            current = latest_for(device)
+            if current is not None:
+                yield f"data: {json.dumps(current, default=str)}\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=config.STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    # 註解行保持連線 (proxy 閒置逾時)
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    break
+                yield f"data: {message}\n\n"
+        finally:
+            state.broadcaster.unsubscribe(queue)
 
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/api/system/stream")
+def get_stream_stats():
+    return state.broadcaster.stats()
+
+
+def latest_for(device_id=None):
+    """In-memory dashboard state of one device (or of the most recently active one)."""
+    if device_id is None:
+        return state.latest_cache if state.latest_cache["timestamp"] is not None else None
+    device = state.devices.get(device_id)
+    return device.latest if device is not None else None
 
-@app.get("/api/dashboard/latest")
-def get_latest_data(db: Session = Depends(get_db)):
-    if state.latest_cache["timestamp"] is not None:
-        return state.latest_cache
 
-    latest = db.query(ParkingViolationLog).order_by(ParkingViolationLog.id.desc()).first()
+@app.get("/api/dashboard/latest")
+def get_latest_data(device: Optional[str] = None, db: Session = Depends(get_db)):
+    current = latest_for(device)
+    if current is not None:
+        return current
+
+    query = db.query(ParkingViolationLog)
+    if device is not None:
+        query = query.filter(ParkingViolationLog.device_id == device)
+    latest = query.order_by(ParkingViolationLog.id.desc()).first()
     if not latest:
         return {"error": "No data"}
 
@@ -423,5 +1053,54 @@ def get_latest_data(db: Session = Depends(get_db)):
         "is_violation": latest.is_violation,
         "car_detected": latest.car_detected,
         "status": f"[History] {latest.status}",
-        "image_url": f"/{latest.image_path}"
+        "image_url": f"/{latest.image_path}" if latest.image_path else None,
+        "device_id": latest.device_id
     }
+
+
+class DeviceSettings(BaseModel):
+    name: Optional[str] = None
+    zone_types: Optional[List[str]] = None
+    dwell_seconds: Optional[float] = None
+
+
+@app.get("/api/devices")
+def list_devices():
+    return [device.as_dict() for device in state.devices.all()]
+
+
+@app.get("/api/devices/{device_id}")
+def get_device(device_id: str):
+    device = state.devices.get(device_id)
+    if device is None:
+        raise HTTPException(status_code=404, detail="Unknown device")
+    return device.as_dict()
+
+
+@app.delete("/api/devices/{device_id}")
+def delete_device(device_id: str):
+    """Remove a camera: its registry row, pipeline/motion/zone state and metric series (history is kept)."""
+    if not state.devices.remove(device_id):
+        raise HTTPException(status_code=404, detail="Unknown device")
+    forget_device_state(device_id)
+    return {"status": "deleted", "id": device_id}
+
+
+@app.patch("/api/devices/{device_id}")
+async def update_device(device_id: str, settings: DeviceSettings):
+    """Update name, enforced zone types and dwell time of a camera (only the fields sent)."""
+    changes = settings.model_dump(exclude_unset=True)
+    known = {zone_type for _, zone_type in ZONE_TYPES}
+    unknown = set(changes.get("zone_types") or []) - known
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown zone type(s): {', '.join(sorted(unknown))}")
+    if changes.get("dwell_seconds") is not None and changes["dwell_seconds"] < 0:
+        raise HTTPException(status_code=422, detail="dwell_seconds must be >= 0")
+
+    try:
+        device = state.devices.update_settings(device_id, **changes)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if device_id in state.trackers:
+        state.trackers[device_id].dwell_seconds = device_dwell_seconds(device_id)
+    return device.as_dict()
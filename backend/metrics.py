@@ -0,0 +1,94 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# 1 ms ~ 10 s：涵蓋解碼 (ms 級) 到 AI 來回 (秒級)
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGE_SECONDS = Histogram("traffic_stage_seconds", "Time spent on one frame in each processing stage",
+                          ["stage"], buckets=STAGE_BUCKETS)
+FRAMES = Counter("traffic_frames_total", "Complete frames received per device", ["device"])
+PROCESSED = Counter("traffic_frames_processed_total", "Frames through the pipeline per device and outcome",
+                    ["device", "outcome"])
+ERRORS = Counter("traffic_errors_total", "Errors per processing stage", ["stage"])
+DEVICE_FPS = Gauge("traffic_device_fps", "Upload rate per device over its recent frames", ["device"])
+# PROCESSED 的 outcome 值；device 標籤只用於已登錄 (id 驗證、數量有上限) 的裝置，移除裝置時一併刪除
+OUTCOMES = ("analyzed", "reused", "ai_offline", "error")
+QUEUE_DEPTH = Gauge("traffic_queue_depth", "Items waiting in each internal queue", ["queue"])
+AI_IN_FLIGHT = Gauge("traffic_ai_in_flight", "Requests in flight per AI endpoint", ["endpoint"])
+AI_UP = Gauge("traffic_ai_endpoint_up", "1 while the AI endpoint's circuit is closed", ["endpoint"])
+
+
+class FrameTrace:
+    """Stage timings (ms) of one frame, from upload to the dashboard.
+
+    `frame_key` ("device:frame") is sent to the AI service as X-Frame-Id so
+    log lines on both sides can be matched. Stages are also observed into
+    STAGE_SECONDS unless `observe=False` (timings reported by the AI
+    service, which exports its own histograms).
+    """
+
+    def __init__(self, frame_key, started=None):
+        self.frame_key = frame_key
+        self.started = time.perf_counter() if started is None else started
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            ERRORS.labels(name).inc()
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds, observe=True):
+        self.stages[name] = round(self.stages.get(name, 0.0) + seconds * 1000, 2)
+        if observe:
+            STAGE_SECONDS.labels(name).observe(seconds)
+
+    def finish(self):
+        """Record the total (frame received -> verdict published) and return all stages."""
+        if "total" not in self.stages:
+            self.record("total", time.perf_counter() - self.started)
+        return self.stages
+
+
+def frame_key(device_id, frame_id):
+    return f"{device_id}:{frame_id}"
+
+
+def forget_device(device_id):
+    """Drop the label series of a removed device so they are not exported forever."""
+    series = [(FRAMES, (device_id,)), (DEVICE_FPS, (device_id,))]
+    series += [(PROCESSED, (device_id, outcome)) for outcome in OUTCOMES]
+    for metric, labels in series:
+        try:
+            metric.remove(*labels)
+        except KeyError:
+            pass
+
+
+def record_db_batch(seconds, error=None):
+    STAGE_SECONDS.labels("db_commit").observe(seconds)
+    if error is not None:
+        ERRORS.labels("db_commit").inc()
+
+
+def render(devices, pipeline, db_writer, frame_assembler, broadcaster, tunnels):
+    """Refresh the gauges read from live objects and return (body, content type) for /metrics."""
+    for device in devices.all():
+        DEVICE_FPS.labels(device.id).set(device.fps)
+    pipeline_stats = pipeline.stats()
+    QUEUE_DEPTH.labels("pipeline_pending").set(pipeline_stats["pending"])
+    QUEUE_DEPTH.labels("pipeline_busy").set(pipeline_stats["busy"])
+    QUEUE_DEPTH.labels("db_writer").set(db_writer.stats()["queued"])
+    QUEUE_DEPTH.labels("assembling_frames").set(len(frame_assembler.stats()["in_progress"]))
+    QUEUE_DEPTH.labels("stream_subscribers").set(broadcaster.stats()["subscribers"])
+    for endpoint in tunnels.endpoints:
+        AI_IN_FLIGHT.labels(endpoint.name).set(endpoint.in_flight)
+        AI_UP.labels(endpoint.name).set(1 if endpoint.available else 0)
+    return generate_latest(), CONTENT_TYPE_LATEST
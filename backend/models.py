@@ -1,14 +1,53 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, Index
 from sqlalchemy.sql import func
 from database import Base
 
 
 class ParkingViolationLog(Base):
     __tablename__ = "parking_violation_logs"
+    __table_args__ = (
+        # /api/history: WHERE is_violation ORDER BY id DESC 與時間範圍查詢
+        Index("ix_parking_violation_logs_violation_id", "is_violation", "id"),
+        Index("ix_parking_violation_logs_timestamp", "timestamp"),
+        Index("ix_parking_violation_logs_device_id", "device_id", "id"),
+        Index("ix_parking_violation_logs_event_key", "event_key", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
     image_path = Column(String)
+    # 證據縮圖 (歷史列表用)；保留期限刪除檔案後兩者皆為 NULL
+    thumbnail_path = Column(String, nullable=True)
     is_violation = Column(Boolean, default=False)
     car_detected = Column(Boolean, default=False)
     status = Column(String)
+
+    # 違規事件 (同一台車停在禁停區期間只有一筆)
+    device_id = Column(String, nullable=True)
+    track_id = Column(Integer, nullable=True)
+    zone_type = Column(String, nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    last_seen_at = Column(DateTime(timezone=True), nullable=True)
+    ended_at = Column(DateTime(timezone=True), nullable=True)
+    dwell_seconds = Column(Float, nullable=True)
+    frames = Column(Integer, nullable=True)
+    event_state = Column(String, nullable=True)
+    # 寫入排隊時還沒有 id，事件更新以此鍵定位 (device:track:開始毫秒)
+    event_key = Column(String, nullable=True)
+
+
+class CameraDevice(Base):
+    __tablename__ = "devices"
+
+    id = Column(String, primary_key=True)
+    name = Column(String, nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    # 該攝影機要判定的禁停區類型 (逗號分隔，空白 = 全部)；停留秒數覆寫全域設定
+    zone_types = Column(String, nullable=True)
+    dwell_seconds = Column(Float, nullable=True)
+    first_seen = Column(DateTime(timezone=True), server_default=func.now())
+    last_seen = Column(DateTime(timezone=True), nullable=True)
+    remote_addr = Column(String, nullable=True)
+    frames_received = Column(Integer, default=0)
+    bytes_received = Column(Integer, default=0)
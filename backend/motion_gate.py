@@ -0,0 +1,71 @@
+import time
+
+from scene import changed_fraction
+
+
+class DeviceBaseline:
+    """Last analyzed frame of one device and the verdict it produced."""
+
+    def __init__(self, signature, frame_id, verdict):
+        self.signature = signature
+        self.frame_id = frame_id
+        self.verdict = verdict
+        self.analyzed_at = time.monotonic()
+
+
+class MotionGate:
+    """Skips inference when a frame looks like the last analyzed frame of its device.
+
+    A frame is analyzed when more than `threshold` of its luma signature
+    cells changed by more than `pixel_delta`, when the device has no
+    baseline yet, or when the baseline is older than `max_skip_seconds`
+    (periodic re-check). Otherwise the previous verdict is reused.
+    """
+
+    def __init__(self, threshold=0.004, pixel_delta=12.0, max_skip_seconds=30.0):
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.max_skip_seconds = max_skip_seconds
+        self._baselines = {}
+        self.analyzed = {}
+        self.skipped = 0
+        self.last_change = {}
+
+    def check(self, device_id, signature, now=None):
+        """Reason to analyze this frame, or None to reuse the previous verdict."""
+        baseline = self._baselines.get(device_id)
+        if baseline is None:
+            return "first_frame"
+        now = time.monotonic() if now is None else now
+        if now - baseline.analyzed_at > self.max_skip_seconds:
+            return "recheck"
+        change = changed_fraction(baseline.signature, signature, self.pixel_delta)
+        self.last_change[device_id] = round(change, 4)
+        if change > self.threshold:
+            return "motion"
+        self.skipped += 1
+        return None
+
+    def baseline(self, device_id):
+        return self._baselines.get(device_id)
+
+    def record(self, device_id, signature, frame_id, verdict, reason):
+        self._baselines[device_id] = DeviceBaseline(signature, frame_id, verdict)
+        self.analyzed[reason] = self.analyzed.get(reason, 0) + 1
+
+    def reset(self, device_id):
+        self._baselines.pop(device_id, None)
+
+    def stats(self):
+        analyzed = sum(self.analyzed.values())
+        total = analyzed + self.skipped
+        return {
+            "threshold": self.threshold,
+            "pixel_delta": self.pixel_delta,
+            "max_skip_seconds": self.max_skip_seconds,
+            "analyzed": analyzed,
+            "analyzed_by_reason": self.analyzed,
+            "skipped": self.skipped,
+            "skip_ratio": round(self.skipped / total, 3) if total else None,
+            "last_change": self.last_change,
+        }
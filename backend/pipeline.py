@@ -0,0 +1,89 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class InferencePipeline:
+    """Per-device frame queue processed by a pool of worker tasks.
+
+    Each device has a single pending slot: a newer frame replaces an older
+    one that has not been picked up yet (latest-frame-wins), so a slow AI
+    round trip never builds a backlog. Frames of one device are processed
+    in order by at most one worker at a time; different devices run in
+    parallel across workers.
+    """
+
+    def __init__(self, process, workers=2):
+        self.process = process
+        self.workers = workers
+        self._pending = {}
+        self._queued = set()
+        self._busy = set()
+        self._ready = asyncio.Queue()
+        self._tasks = []
+        self.submitted = 0
+        self.replaced = 0
+        self.processed = 0
+        self.failed = 0
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, device_id, job):
+        """Queue a frame for `device_id`. Returns True if it replaced an unprocessed frame."""
+        self.submitted += 1
+        replaced = device_id in self._pending
+        if replaced:
+            self.replaced += 1
+        self._pending[device_id] = job
+        self._schedule(device_id)
+        return replaced
+
+    def discard(self, device_id):
+        """Drop the device's pending frame, if any (a frame being processed finishes)."""
+        return self._pending.pop(device_id, None) is not None
+
+    def _schedule(self, device_id):
+        # 正在處理中的裝置等處理完再排入，確保同一裝置依序執行
+        if device_id in self._queued or device_id in self._busy:
+            return
+        self._queued.add(device_id)
+        self._ready.put_nowait(device_id)
+
+    async def _worker(self, index):
+        while True:
+            device_id = await self._ready.get()
+            self._queued.discard(device_id)
+            job = self._pending.pop(device_id, None)
+            if job is None:
+                continue
+
+            self._busy.add(device_id)
+            try:
+                await self.process(job)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Pipeline worker {index} failed on {device_id}: {e}")
+            finally:
+                self._busy.discard(device_id)
+                if device_id in self._pending:
+                    self._schedule(device_id)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "pending": len(self._pending),
+            "busy": len(self._busy),
+            "submitted": self.submitted,
+            "replaced": self.replaced,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
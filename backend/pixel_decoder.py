@@ -0,0 +1,182 @@
+import logging
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 相機原始像素格式 (每像素 2 bytes)
+#   rgb565 / bgr565  R 或 B 位於 16-bit word 的高 5 位元
+#   _be / _le        word 的位元組順序
+#   yuv422           Y0 U Y1 V (OV7670 的 YUV 模式)
+# 原本的解碼方式 (R 在低 5 位元、big-endian) 即 bgr565_be
+FORMATS = ("bgr565_be", "rgb565_be", "bgr565_le", "rgb565_le", "yuv422")
+
+# 自動偵測：最佳解讀的相鄰像素差須比次佳小 DETECT_MARGIN 倍、且通道標準差至少
+# DETECT_MIN_CONTRAST (暗場/平滑畫面無法判斷)，同一格式累積 DETECT_VOTES 張才確定
+DETECT_MARGIN = 2.0
+DETECT_MIN_CONTRAST = 6.0
+DETECT_VOTES = 3
+
+# 暫存緩衝區依像素數快取；尺寸由用戶端決定，只保留最近用到的幾種
+MAX_BUFFERS = 4
+
+
+def build_lut(fmt):
+    """65536-entry table: little-endian uint16 read from the buffer -> packed RGBX (uint32)."""
+    word = np.arange(65536, dtype=np.uint32)
+    if fmt.endswith("_be"):
+        word = ((word & 0xFF) << 8) | (word >> 8)
+    high = word >> 11
+    g = (word >> 5) & 0x3F
+    low = word & 0x1F
+    r, b = (high, low) if fmt.startswith("rgb") else (low, high)
+    # 位元複製展開到 8 bits，全白為 255 而非 248
+    r = (r << 3) | (r >> 2)
+    g = (g << 2) | (g >> 4)
+    b = (b << 3) | (b >> 2)
+    return (r | (g << 8) | (b << 16)).astype("<u4")
+
+
+class PixelDecoder:
+    """Raw camera buffers -> PIL RGB images.
+
+    RGB565 variants go through a lookup table: the buffer is viewed as
+    uint16 without copying and `np.take` gathers packed RGBX words into a
+    reused output array, which Pillow unpacks in a single pass. YUV422 is
+    expanded to YCbCr in the same buffer and converted by Pillow. With
+    `default_format="auto"` the format of each device is detected from its
+    frames (see format_for) and cached.
+    """
+
+    def __init__(self, default_format="bgr565_be"):
+        if default_format != "auto" and default_format not in FORMATS:
+            raise ValueError(f"Unknown pixel format {default_format!r}, expected auto or one of {', '.join(FORMATS)}")
+        self.default_format = default_format
+        self._luts = {}
+        self._buffers = OrderedDict()
+        self._detected = {}
+        # 偵測中的裝置：格式 -> 有把握的票數；以及偵測時的影像尺寸
+        self._votes = {}
+        self._sizes = {}
+        self.decoded = {}
+
+    def _lut(self, fmt):
+        lut = self._luts.get(fmt)
+        if lut is None:
+            lut = self._luts[fmt] = build_lut(fmt)
+        return lut
+
+    def _buffer(self, n):
+        # 解碼結果由 Image.frombytes 複製，緩衝區可以給下一張重複使用
+        out = self._buffers.get(n)
+        if out is None:
+            out = self._buffers[n] = np.empty(n, dtype="<u4")
+            if len(self._buffers) > MAX_BUFFERS:
+                self._buffers.popitem(last=False)
+        else:
+            self._buffers.move_to_end(n)
+        return out
+
+    def decode(self, buf, width, height, fmt=None):
+        fmt = fmt or self.default_format
+        img = self._decode(buf, width, height, fmt)
+        self.decoded[fmt] = self.decoded.get(fmt, 0) + 1
+        return img
+
+    def _decode(self, buf, width, height, fmt):
+        n = width * height
+        if len(buf) < n * 2:
+            raise ValueError(f"Buffer has {len(buf)} bytes, {width}x{height} needs {n * 2}")
+        if fmt == "yuv422":
+            # 只搬移位元組，色彩轉換交給 Pillow (C 實作的 BT.601 YCbCr -> RGB)
+            out = self._buffer(n).view(np.uint8)[:n * 3]
+            ycc = yuv422_to_ycbcr(buf, n, out)
+            img = Image.frombytes("YCbCr", (width, height), ycc).convert("RGB")
+        else:
+            words = np.frombuffer(buf, dtype="<u2", count=n)
+            out = self._buffer(n)
+            # 索引必在 0..65535，mode="wrap" 省去邊界檢查的暫存
+            np.take(self._lut(fmt), words, out=out, mode="wrap")
+            img = Image.frombytes("RGB", (width, height), out, "raw", "RGBX")
+        return img
+
+    def detect(self, buf, width, height, order="bgr"):
+        """(most likely format, confident) for one frame: the interpretation with the smoothest image.
+
+        Byte order and RGB565 vs YUV422 show up as noise between neighbouring
+        pixels; R/B order does not, so it comes from `order`. Dark, flat or
+        very smooth frames (camera warm-up, gradients) look smooth under
+        several interpretations: the result is only confident when the best
+        one is clearly smoother than the runner-up and has real contrast.
+        """
+        rows = list(range(0, height, max(1, height // 32)))
+        candidates = (f"{order}565_be", f"{order}565_le", "yuv422")
+        roughness = {}
+        contrast = {}
+        for fmt in candidates:
+            rgb = np.asarray(self._decode(_rows(buf, width, rows), width, len(rows), fmt), dtype=np.float32)
+            # 相鄰像素的平均差 (0~255)：正確解讀接近影像本身的細節，錯誤解讀接近雜訊
+            roughness[fmt] = float(np.abs(np.diff(rgb, axis=1)).mean())
+            contrast[fmt] = float(rgb.std(axis=(0, 1)).mean())
+        best, runner_up = sorted(candidates, key=roughness.get)[:2]
+        confident = (contrast[best] >= DETECT_MIN_CONTRAST
+                     and roughness[runner_up] >= DETECT_MARGIN * max(roughness[best], 0.5))
+        return best, confident
+
+    def format_for(self, device_id, buf, width, height):
+        """Format to decode this frame with.
+
+        In auto mode every frame of a device is checked until one format has
+        won DETECT_VOTES confident detections, then that format is kept. A
+        new frame size starts the detection over. Until then frames are
+        decoded with the leading format, or bgr565_be (the original decoding)
+        while nothing is confident yet.
+        """
+        if self.default_format != "auto":
+            return self.default_format
+        fmt = self._detected.get(device_id)
+        size = (width, height)
+        if fmt is not None and self._sizes.get(device_id) == size:
+            return fmt
+
+        votes = self._votes.get(device_id)
+        if votes is None or self._sizes.get(device_id) != size:
+            self._detected.pop(device_id, None)
+            votes = self._votes[device_id] = {}
+            self._sizes[device_id] = size
+        guess, confident = self.detect(buf, width, height)
+        if confident:
+            votes[guess] = votes.get(guess, 0) + 1
+            if votes[guess] >= DETECT_VOTES:
+                self._detected[device_id] = guess
+                del self._votes[device_id]
+                logger.info(f"Pixel format of {device_id}: {guess} ({width}x{height})")
+                return guess
+        return max(votes, key=votes.get) if votes else FORMATS[0]
+
+    def forget(self, device_id):
+        """Detect the format of `device_id` again from its next frames."""
+        self._detected.pop(device_id, None)
+        self._votes.pop(device_id, None)
+        self._sizes.pop(device_id, None)
+
+    def stats(self):
+        return {"default_format": self.default_format, "detected": self._detected, "detecting": self._votes,
+                "decoded": self.decoded}
+
+
+def _rows(buf, width, rows):
+    data = np.frombuffer(buf, dtype=np.uint8, count=width * 2 * (rows[-1] + 1)).reshape(-1, width * 2)
+    return data[rows].tobytes()
+
+
+def yuv422_to_ycbcr(buf, n, out):
+    """Expand Y0 U Y1 V into per-pixel YCbCr (chroma shared by each pixel pair) inside `out`."""
+    yuyv = np.frombuffer(buf, dtype=np.uint8, count=n * 2).reshape(-1, 4)
+    ycc = out.reshape(-1, 2, 3)
+    ycc[:, :, 0] = yuyv[:, 0::2]
+    ycc[:, :, 1] = yuyv[:, 1:2]
+    ycc[:, :, 2] = yuyv[:, 3:4]
+    return out
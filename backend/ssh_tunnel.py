@@ -1,22 +1,251 @@
+import asyncio
+import logging
+import os
 import subprocess
 import time
 
-def start_ssh_tunnel():
-    cmd = [
-        "ssh",
-        "-N",
-        "-L", "9000:localhost:8000",
-        "vcppx"
-    ]
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class AIUnavailable(Exception):
+    """No AI endpoint is healthy; raised immediately instead of waiting for a timeout."""
+
+
+class Endpoint:
+    """One AI service, reached directly or through its own `ssh -L` tunnel."""
+
+    def __init__(self, name, base_url, ssh_host=None, local_port=None, remote_port=None):
+        self.name = name
+        self.base_url = base_url
+        self.ssh_host = ssh_host
+        self.local_port = local_port
+        self.remote_port = remote_port
+        self.proc = None
+        # closed = 可送請求；open = 熔斷中，等健康檢查成功才恢復
+        self.circuit = "closed"
+        self.failures = 0
+        self.probe_failures = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.restarts = 0
+        self.backoff = 0.0
+        self.next_start = 0.0
+        self.opened_at = None
+        self.last_probe = None
+        self.last_ok = None
+        self.last_error = None
+
+    @property
+    def available(self):
+        return self.circuit == "closed"
+
+    def tunnel_alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "ssh_host": self.ssh_host,
+            "tunnel_pid": self.proc.pid if self.tunnel_alive() else None,
+            "circuit": self.circuit,
+            "failures": self.failures,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "restarts": self.restarts,
+            "backoff_seconds": self.backoff,
+            "last_probe": self.last_probe,
+            "last_ok": self.last_ok,
+            "last_error": self.last_error,
+        }
+
+
+class TunnelSupervisor:
+    """Keeps the AI endpoints reachable and routes requests to healthy ones.
+
+    A background task probes every endpoint's health URL each
+    `probe_interval` seconds and (re)starts dead ssh tunnels with
+    exponential backoff; a tunnel that is up but fails `restart_after`
+    probes in a row is killed and restarted. `failure_threshold`
+    consecutive failures (probes or real requests) open an endpoint's
+    circuit, so `acquire()` skips it or fails fast with AIUnavailable;
+    the next successful probe closes it again. Requests go to the
+    available endpoint with the fewest in flight.
+    """
+
+    def __init__(self, endpoints, health_path="/health", probe_interval=5.0, probe_timeout=2.0,
+                 failure_threshold=2, restart_after=3, backoff_initial=1.0, backoff_max=60.0,
+                 control_dir=None):
+        self.endpoints = endpoints
+        self.health_path = health_path
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.failure_threshold = failure_threshold
+        self.restart_after = restart_after
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.control_dir = control_dir
+        self.rejected = 0
+        self._rr = 0
+        self._task = None
+        self._client = None
+
+    def ssh_command(self, endpoint):
+        cmd = [
+            "ssh", "-N",
+            "-L", f"{endpoint.local_port}:localhost:{endpoint.remote_port}",
+            # 轉送埠被占用時直接結束，交給 supervisor 重試
+            "-o", "ExitOnForwardFailure=yes",
+            # 連線中斷 10 秒內 ssh 自行結束，不會留下看似存活的 tunnel
+            "-o", "ServerAliveInterval=5",
+            "-o", "ServerAliveCountMax=2",
+            "-o", "BatchMode=yes",
+        ]
+        if self.control_dir:
+            # 每個端點各自的 master socket，且不設 ControlPersist：受監控的 ssh 行程一定是
+            # 持有 -L 轉送的 master，terminate 後轉送埠即釋放，重啟不會遇到埠被占用。
+            # 其他 ssh 指令 (除錯、scp) 可經由此 socket 共用已驗證的連線
+            cmd += ["-o", "ControlMaster=auto",
+                    "-o", f"ControlPath={os.path.join(self.control_dir, f'%C-{endpoint.local_port}')}"]
+        return cmd + [endpoint.ssh_host]
+
+    def start(self):
+        if self.control_dir:
+            os.makedirs(self.control_dir, exist_ok=True)
+        self._client = httpx.AsyncClient(timeout=self.probe_timeout)
+        for endpoint in self.endpoints:
+            if endpoint.ssh_host:
+                self._spawn(endpoint)
+        self._task = asyncio.create_task(self._run())
 
-    proc = subprocess.Popen(
-        cmd
-    )
-
-    time.sleep(2)  # 等 tunnel 建立
-    if proc.poll() is not None:
-        print(f"SSH Tunnel failed to start with return code {proc.returncode}")
-    else:
-        print(f"SSH Tunnel started with PID {proc.pid}")
-        
-    return proc
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        for endpoint in self.endpoints:
+            if endpoint.tunnel_alive():
+                endpoint.proc.terminate()
+                try:
+                    await asyncio.to_thread(endpoint.proc.wait, 3)
+                except subprocess.TimeoutExpired:
+                    endpoint.proc.kill()
+                logger.info(f"SSH tunnel to {endpoint.ssh_host} closed.")
+
+    def _spawn(self, endpoint):
+        try:
+            endpoint.proc = subprocess.Popen(self.ssh_command(endpoint), stdin=subprocess.DEVNULL)
+            logger.info(f"SSH tunnel to {endpoint.ssh_host} started (PID {endpoint.proc.pid}, "
+                        f"localhost:{endpoint.local_port} -> {endpoint.remote_port})")
+        except OSError as e:
+            endpoint.proc = None
+            endpoint.last_error = f"ssh: {e}"
+            logger.error(f"SSH tunnel to {endpoint.ssh_host} could not start: {e}")
+        endpoint.restarts += 1
+        endpoint.backoff = min(endpoint.backoff * 2, self.backoff_max) if endpoint.backoff else self.backoff_initial
+        endpoint.next_start = time.monotonic() + endpoint.backoff
+
+    def _supervise(self, endpoint):
+        if not endpoint.ssh_host:
+            return
+        now = time.monotonic()
+        if endpoint.tunnel_alive() and endpoint.probe_failures >= self.restart_after and now >= endpoint.next_start:
+            logger.warning(f"SSH tunnel to {endpoint.ssh_host} is up but unhealthy, restarting")
+            endpoint.proc.terminate()
+            endpoint.probe_failures = 0
+        if not endpoint.tunnel_alive():
+            self._open(endpoint, f"ssh exited ({endpoint.proc.poll() if endpoint.proc else 'not running'})")
+            if now >= endpoint.next_start:
+                self._spawn(endpoint)
+
+    async def _run(self):
+        while True:
+            for endpoint in self.endpoints:
+                self._supervise(endpoint)
+            await asyncio.gather(*(self.probe(e) for e in self.endpoints))
+            await asyncio.sleep(self.probe_interval)
+
+    async def probe(self, endpoint):
+        endpoint.last_probe = time.time()
+        try:
+            resp = await self._client.get(endpoint.base_url + self.health_path)
+            resp.raise_for_status()
+        except httpx.HTTPError as e:
+            endpoint.probe_failures += 1
+            self.failure(endpoint, f"health: {e!r}")
+            return False
+        endpoint.probe_failures = 0
+        endpoint.last_ok = endpoint.last_probe
+        endpoint.backoff = 0.0
+        if endpoint.circuit != "closed":
+            logger.info(f"AI endpoint {endpoint.name} healthy again, closing circuit")
+        endpoint.circuit = "closed"
+        endpoint.failures = 0
+        return True
+
+    def _open(self, endpoint, reason):
+        endpoint.last_error = reason
+        if endpoint.circuit != "open":
+            endpoint.circuit = "open"
+            endpoint.opened_at = time.time()
+            logger.error(f"AI endpoint {endpoint.name} unavailable ({reason}), circuit open")
+
+    def failure(self, endpoint, reason):
+        endpoint.failures += 1
+        endpoint.last_error = reason
+        if endpoint.failures >= self.failure_threshold:
+            self._open(endpoint, reason)
+
+    def success(self, endpoint):
+        endpoint.failures = 0
+
+    def acquire(self, exclude=()):
+        """Least-loaded available endpoint (round-robin among ties); the caller must `release` it.
+
+        Endpoints in `exclude` (already tried for this request) are only
+        used when nothing else is available.
+        """
+        available = [e for e in self.endpoints if e.available]
+        candidates = [e for e in available if e not in exclude] or available
+        if not candidates:
+            self.rejected += 1
+            raise AIUnavailable("No healthy AI endpoint")
+        self._rr += 1
+        endpoint = min(candidates, key=lambda e: (e.in_flight, (self.endpoints.index(e) - self._rr) % len(self.endpoints)))
+        endpoint.in_flight += 1
+        endpoint.requests += 1
+        return endpoint
+
+    def release(self, endpoint):
+        endpoint.in_flight -= 1
+
+    @property
+    def healthy(self):
+        return any(e.available for e in self.endpoints)
+
+    def stats(self):
+        return {
+            "healthy": self.healthy,
+            "rejected": self.rejected,
+            "probe_interval": self.probe_interval,
+            "endpoints": [e.as_dict() for e in self.endpoints],
+        }
+
+
+def build_endpoints(tunnel_hosts, local_port, remote_port, direct_urls):
+    """Endpoints from config: one tunnel per ssh host on consecutive local ports, plus direct URLs."""
+    endpoints = [
+        Endpoint(host, f"http://localhost:{local_port + i}", ssh_host=host,
+                 local_port=local_port + i, remote_port=remote_port)
+        for i, host in enumerate(tunnel_hosts)
+    ]
+    endpoints += [Endpoint(url, url.rstrip("/")) for url in direct_urls]
+    return endpoints
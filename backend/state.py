@@ -1,6 +1,87 @@
-ssh_proc = None
+import time
 
-active_transmissions = {}
+import config
+from broadcaster import Broadcaster
+from evidence_store import EvidenceStore
+from frame_assembler import BufferPool, FrameAssembler
+from frame_store import FrameStore
+from motion_gate import MotionGate
+from pixel_decoder import PixelDecoder
+from zone_cache import ZoneCache
+
+# AI 端點 (ssh tunnel) 監控與分配，lifespan 建立
+tunnels = None
+
+inference_client = None
+
+pipeline = None
+
+# 背景批次寫入 DB (write-behind)，lifespan 建立
+db_writer = None
+
+# 攝影機登錄 (設定、上傳統計、最新判定)，啟動時由 DB 載入
+devices = None
+
+# 違規證據圖與縮圖 (內容雜湊、分層目錄、保留期限)
+evidence_store = EvidenceStore(
+    config.EVIDENCE_DIR,
+    config.BASE_DIR,
+    thumb_size=(config.EVIDENCE_THUMB_WIDTH, config.EVIDENCE_THUMB_HEIGHT),
+    thumb_format=config.EVIDENCE_THUMB_FORMAT,
+    thumb_quality=config.EVIDENCE_THUMB_QUALITY,
+    max_age=config.EVIDENCE_MAX_AGE_DAYS * 86400,
+    max_bytes=config.EVIDENCE_MAX_MB * 1024 ** 2,
+    legacy_dir=config.UPLOAD_DIR
+)
+
+# device id -> 最新一張已分析影像的警報指令
+device_commands = {}
+
+# 分片上傳組裝 (key: device id + frame id)
+frame_assembler = FrameAssembler(
+    BufferPool(max_free_per_size=config.FRAME_POOL_PER_SIZE),
+    ttl=config.FRAME_TTL_SECONDS,
+    max_partial_per_device=config.FRAME_MAX_PARTIAL_PER_DEVICE
+)
+
+# 相機原始像素 -> RGB (查表解碼，格式依設定或每台裝置自動偵測)
+pixel_decoder = PixelDecoder(config.PIXEL_FORMAT)
+
+# 每台裝置最新影像 (記憶體內，不落地)
+frame_store = FrameStore()
+
+# 每台攝影機的禁停區分割結果 (JSON 持久化，啟動時載入)
+zone_cache = ZoneCache(
+    config.ZONE_CACHE_PATH,
+    max_age=config.ZONE_REFRESH_SECONDS,
+    change_threshold=config.ZONE_SCENE_CHANGE_THRESHOLD
+)
+
+# 畫面無變化時沿用上次判定 (每台裝置一個基準影像)
+motion_gate = MotionGate(
+    threshold=config.MOTION_THRESHOLD,
+    pixel_delta=config.MOTION_PIXEL_DELTA,
+    max_skip_seconds=config.MOTION_MAX_SKIP_SECONDS
+)
+
+# device id -> ViolationTracker
+trackers = {}
+
+# 未帶 frame id 的舊版韌體：device id -> 目前 frame 編號
+legacy_frame_ids = {}
+
+# /api/frame 單次上傳：張數、實際/未壓縮位元組、各壓縮方式張數
+frame_protocol_stats = {"frames": 0, "rejected": 0, "bytes": 0, "raw_bytes": 0, "by_codec": {}}
+
+# /api/live/{device}.mjpeg 觀看者與送出/略過的影像數
+live_stats = {"viewers": 0, "sent": 0, "dropped": 0}
+
+# /api/stream 訂閱者 (latest_cache 每次更新即推送)
+broadcaster = Broadcaster()
+
+# /api/history ETag：每次寫入違規紀錄遞增；epoch 區分不同次啟動
+history_version = 0
+history_epoch = int(time.time())
 
 latest_cache = {
     "id": 0,
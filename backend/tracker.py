@@ -0,0 +1,147 @@
+import time
+
+import numpy as np
+
+from geometry import box_iou
+
+
+class Track:
+    """One car followed across frames of a single camera."""
+
+    def __init__(self, track_id, box, zone_types, now):
+        self.id = track_id
+        self.box = box
+        self.zone_types = set(zone_types)
+        self.first_seen = now
+        self.last_seen = now
+        self.hits = 1
+        # 連續停在禁停區的起始時間；離開即重設
+        self.in_zone_since = now if zone_types else None
+        self.out_of_zone_since = None
+        self.event_open = False
+        self.event_id = None
+        self.event_key = None
+        self.event_started = None
+        self.event_zone_types = set()
+        self.last_persisted = None
+
+    def dwell(self, now):
+        return now - self.in_zone_since if self.in_zone_since is not None else 0.0
+
+    def event_dwell(self):
+        """Seconds from the car entering the zone to its last sighting, for the current event."""
+        return self.last_seen - self.event_started if self.event_started is not None else 0.0
+
+
+class ViolationTracker:
+    """IoU tracker for one camera that turns per-frame overlaps into violation events.
+
+    Events (kind, track) returned by `update`:
+        open    the car has stayed in a zone for `dwell_seconds`
+        update  the event is still open; emitted at most every `update_seconds`
+        close   the car left the zone, or has not been seen, for `leave_seconds`
+    """
+
+    def __init__(self, iou_threshold=0.3, dwell_seconds=30.0, leave_seconds=20.0, update_seconds=60.0):
+        self.iou_threshold = iou_threshold
+        self.dwell_seconds = dwell_seconds
+        self.leave_seconds = leave_seconds
+        self.update_seconds = update_seconds
+        self.tracks = []
+        self.last_observations = ([], [])
+        self.last_update = None
+        self._next_id = 1
+
+    def _match(self, boxes):
+        """Greedy highest-IoU-first assignment: {track index: detection index}."""
+        iou = box_iou([t.box for t in self.tracks], boxes)
+        matches = {}
+        if iou.size == 0:
+            return matches
+        used = set()
+        for flat in np.argsort(iou, axis=None)[::-1]:
+            i, j = divmod(int(flat), iou.shape[1])
+            if iou[i, j] < self.iou_threshold:
+                break
+            if i in matches or j in used:
+                continue
+            matches[i] = j
+            used.add(j)
+        return matches
+
+    def update(self, car_boxes, zone_types, now=None):
+        """Feed one frame: car boxes and, per car, the set of zone types it overlaps."""
+        now = time.time() if now is None else now
+        self.last_observations = (car_boxes, zone_types)
+        self.last_update = now
+
+        matches = self._match(car_boxes)
+        for i, j in matches.items():
+            track = self.tracks[i]
+            track.box = car_boxes[j]
+            track.zone_types = set(zone_types[j])
+            track.last_seen = now
+            track.hits += 1
+            if track.zone_types:
+                track.out_of_zone_since = None
+                if track.in_zone_since is None:
+                    track.in_zone_since = now
+            elif track.event_open:
+                if track.out_of_zone_since is None:
+                    track.out_of_zone_since = now
+            else:
+                track.in_zone_since = None
+
+        matched = set(matches.values())
+        for j, box in enumerate(car_boxes):
+            if j not in matched:
+                self.tracks.append(Track(self._next_id, box, zone_types[j], now))
+                self._next_id += 1
+
+        events = []
+        for track in self.tracks:
+            gone = now - track.last_seen > self.leave_seconds
+            left = track.out_of_zone_since is not None and now - track.out_of_zone_since > self.leave_seconds
+            if track.event_open:
+                if gone or left:
+                    track.event_open = False
+                    track.in_zone_since = None
+                    track.out_of_zone_since = None
+                    events.append(("close", track))
+                elif now - track.last_persisted >= self.update_seconds:
+                    track.event_zone_types |= track.zone_types
+                    track.last_persisted = now
+                    events.append(("update", track))
+            elif not gone and track.zone_types and track.dwell(now) >= self.dwell_seconds:
+                track.event_open = True
+                track.event_started = track.in_zone_since
+                track.event_zone_types = set(track.zone_types)
+                track.last_persisted = now
+                events.append(("open", track))
+
+        self.tracks = [t for t in self.tracks if now - t.last_seen <= self.leave_seconds]
+        return events
+
+    def open_tracks(self):
+        return [t for t in self.tracks if t.event_open]
+
+    def pending_tracks(self):
+        """Cars in a zone in the last frame whose dwell time has not reached the threshold yet."""
+        return [t for t in self.tracks if not t.event_open and t.zone_types and t.last_seen == self.last_update]
+
+    def stats(self, now=None):
+        now = time.time() if now is None else now
+        return {
+            "tracks": len(self.tracks),
+            "open_events": len(self.open_tracks()),
+            "cars": [
+                {
+                    "track_id": t.id,
+                    "box": t.box,
+                    "zones": sorted(t.zone_types),
+                    "dwell_seconds": round(t.dwell(now), 1),
+                    "event_id": t.event_id,
+                }
+                for t in self.tracks
+            ],
+        }
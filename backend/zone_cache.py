@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from scene import scene_difference
+
+logger = logging.getLogger(__name__)
+
+
+class ZoneEntry:
+    """Restricted zones segmented for one camera, plus the scene they came from."""
+
+    def __init__(self, zones, width, height, signature, updated_at=None):
+        self.zones = zones
+        self.width = width
+        self.height = height
+        self.signature = np.asarray(signature, dtype=np.float32) if signature is not None else None
+        self.updated_at = time.time() if updated_at is None else updated_at
+
+    def as_json(self):
+        return {
+            "zones": self.zones,
+            "width": self.width,
+            "height": self.height,
+            "signature": self.signature.round(1).tolist() if self.signature is not None else None,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data["zones"], data["width"], data["height"], data.get("signature"), data["updated_at"])
+
+
+class ZoneCache:
+    """Per-camera cache of segmented road markings, persisted as JSON.
+
+    Cameras are fixed, so red/yellow lines and crosswalks are segmented
+    once and reused. An entry is refreshed when it is older than
+    `max_age` seconds, when the scene has drifted more than
+    `change_threshold` from the frame it was segmented on, when the frame
+    size changes, or when an operator requests it.
+    """
+
+    def __init__(self, path, max_age=3600.0, change_threshold=0.15):
+        self.path = path
+        self.max_age = max_age
+        self.change_threshold = change_threshold
+        self._entries = {}
+        self._forced = set()
+        self.hits = 0
+        self.refreshes = {}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._entries = {device: ZoneEntry.from_json(e) for device, e in data.items()}
+            logger.info(f"Zone cache loaded: {len(self._entries)} camera(s) from {self.path}")
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Zone cache {self.path} unreadable, starting empty: {e}")
+            self._entries = {}
+
+    def save(self):
+        # 先寫暫存檔再 rename，避免中途斷電留下半個 JSON
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({device: e.as_json() for device, e in self._entries.items()}, f)
+        os.replace(tmp, self.path)
+
+    def get(self, device_id):
+        return self._entries.get(device_id)
+
+    def refresh_reason(self, device_id, width, height, signature, now=None):
+        """Why `device_id` needs a new segmentation, or None if the cached zones are still valid."""
+        entry = self._entries.get(device_id)
+        now = time.time() if now is None else now
+        if device_id in self._forced:
+            return "operator"
+        if entry is None:
+            return "missing"
+        if (entry.width, entry.height) != (width, height):
+            return "resolution"
+        if now - entry.updated_at > self.max_age:
+            return "schedule"
+        if scene_difference(entry.signature, signature) > self.change_threshold:
+            return "scene_change"
+        self.hits += 1
+        return None
+
+    def update(self, device_id, zones, width, height, signature, reason):
+        self._entries[device_id] = ZoneEntry(zones, width, height, signature)
+        self._forced.discard(device_id)
+        self.refreshes[reason] = self.refreshes.get(reason, 0) + 1
+        try:
+            self.save()
+        except OSError as e:
+            logger.error(f"Zone cache save failed: {e}")
+
+    def remove(self, device_id):
+        self._forced.discard(device_id)
+        if self._entries.pop(device_id, None) is not None:
+            try:
+                self.save()
+            except OSError as e:
+                logger.error(f"Zone cache save failed: {e}")
+
+    def request_refresh(self, device_id):
+        """Segment `device_id` again on its next analyzed frame."""
+        self._forced.add(device_id)
+
+    def stats(self):
+        now = time.time()
+        return {
+            "path": self.path,
+            "max_age": self.max_age,
+            "change_threshold": self.change_threshold,
+            "hits": self.hits,
+            "refreshes": self.refreshes,
+            "pending_refresh": sorted(self._forced),
+            "cameras": {
+                device: {
+                    "zones": len(e.zones),
+                    "size": f"{e.width}x{e.height}",
+                    "age_seconds": round(now - e.updated_at, 1),
+                }
+                for device, e in self._entries.items()
+            },
+        }
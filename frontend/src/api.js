@@ -14,4 +14,7 @@ export const getImageUrl = (path) => {
     return `${cleanBase}${cleanPath}`;
 };
 
+// Server-Sent Events 端點 (EventSource 需要完整網址)
+export const getStreamUrl = (path) => `${API_BASE_URL.replace(/\/$/, '')}${path}`;
+
 export default apiClient;
\ No newline at end of file
@@ -0,0 +1,423 @@
+"""Load test: N simulated Pico cameras against a running backend.
+
+Each device uploads frames on its own schedule over a keep-alive connection
+(chunked /api/upload or single-request /api/frame) and listens on
+/api/stream?device=... for the verdict of each frame. End-to-end latency
+runs from the first byte sent to the dashboard update carrying that frame id.
+Frames that never get a verdict count as dropped: either a newer frame
+replaced them in the pipeline, or they were lost. Backend memory is sampled
+from /metrics (process_resident_memory_bytes).
+
+Start the backend against the deterministic mock AI service first:
+    python ai_service/mock_yolo.py --port 9000 --detect-ms 40 --segment-ms 120
+    cd backend && AI_TUNNEL_HOSTS= AI_SERVICE_URLS=http://127.0.0.1:9000 uvicorn main:app
+
+Usage:
+    python loadtest.py run --devices 20 --interval 1 --duration 60 --label baseline
+    python loadtest.py run --devices 50 --protocol chunked --chunk-size 4096 --jitter-ms 20
+    python loadtest.py compare loadtest_results/baseline.json loadtest_results/after.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from frame_protocol import CODEC_NONE, CODEC_ROW_XOR_RLE, encode_frame  # noqa: E402
+
+RESULTS_DIR = "loadtest_results"
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(values):
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 2),
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(max(values), 2),
+    }
+
+
+class Results:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.frames_sent = 0
+        self.frames_uploaded = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.dropped = 0
+        self.errors = {}
+        self.latency_ms = []
+        self.upload_ms = []
+        self.stages_ms = {}
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def verdict(self, seconds, timings):
+        self.latency_ms.append(seconds * 1000)
+        for stage, ms in (timings or {}).items():
+            self.stages_ms.setdefault(stage, []).append(ms)
+
+
+class SimulatedDevice:
+    """One camera: an upload loop plus an SSE listener matching verdicts to frame ids."""
+
+    def __init__(self, device_id, args, seed, results):
+        self.id = device_id
+        self.args = args
+        self.rng = random.Random(seed)
+        self.results = results
+        self.width, self.height = (int(v) for v in args.resolution.lower().split("x"))
+        self.total = self.width * self.height * 2
+        self.static_frame = self.rng.randbytes(self.total)
+        # frame id -> 送出第一個位元組的時間
+        self.pending = {}
+        self.frame_id = 0
+
+    def next_frame(self):
+        # noise：每張都不同 (全部送 AI)；static：畫面不變 (motion gate 沿用判定)
+        return self.static_frame if self.args.image == "static" else self.rng.randbytes(self.total)
+
+    async def jitter(self):
+        if self.args.jitter_ms:
+            await asyncio.sleep(self.rng.uniform(0, self.args.jitter_ms) / 1000)
+
+    async def listen(self, client, ready):
+        params = {"device": self.id}
+        async with client.stream("GET", f"{self.args.url}/api/stream", params=params, timeout=None) as resp:
+            ready.set()
+            async for line in resp.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                message = json.loads(line[6:])
+                frame_id = message.get("frame_id")
+                if frame_id not in self.pending:
+                    continue
+                now = time.perf_counter()
+                # 同一裝置依序處理：較新的影像已有判定，較舊的未判定影像已被取代
+                for older in [f for f in self.pending if f < frame_id]:
+                    del self.pending[older]
+                    self.results.dropped += 1
+                self.results.verdict(now - self.pending.pop(frame_id), message.get("timings"))
+
+    async def post(self, client, url, **kwargs):
+        await self.jitter()
+        self.results.requests += 1
+        try:
+            resp = await client.post(url, **kwargs)
+        except httpx.HTTPError as e:
+            self.results.error(type(e).__name__)
+            return None
+        if resp.status_code != 200:
+            self.results.error(f"http_{resp.status_code}")
+            return None
+        body = resp.json()
+        if body.get("status") == "error":
+            self.results.error("upload")
+            return None
+        return body
+
+    async def upload_chunked(self, client, raw):
+        for offset in range(0, self.total, self.args.chunk_size):
+            chunk = raw[offset:offset + self.args.chunk_size]
+            params = {"offset": offset, "total": self.total, "width": self.width, "height": self.height,
+                      "device": self.id, "frame": self.frame_id}
+            body = await self.post(client, f"{self.args.url}/api/upload", params=params, content=chunk)
+            if body is None:
+                return False
+            self.results.bytes_sent += len(chunk)
+        return body.get("status") == "complete"
+
+    async def upload_frame(self, client, raw):
+        codec = CODEC_ROW_XOR_RLE if self.args.codec == "rle" else CODEC_NONE
+        packet = encode_frame(self.id, self.frame_id, self.width, self.height, raw, codec)
+        body = await self.post(client, f"{self.args.url}/api/frame", content=packet,
+                               headers={"Content-Type": "application/octet-stream"})
+        if body is None:
+            return False
+        self.results.bytes_sent += len(packet)
+        return True
+
+    async def run(self, client, stop_at):
+        # 各裝置錯開起始時間，避免所有影像同時到達
+        await asyncio.sleep(self.rng.uniform(0, self.args.interval))
+        next_send = time.perf_counter()
+        while next_send < stop_at:
+            self.frame_id += 1
+            raw = self.next_frame()
+            self.results.frames_sent += 1
+            start = time.perf_counter()
+            self.pending[self.frame_id] = start
+            upload = self.upload_chunked if self.args.protocol == "chunked" else self.upload_frame
+            if await upload(client, raw):
+                self.results.frames_uploaded += 1
+                self.results.upload_ms.append((time.perf_counter() - start) * 1000)
+            else:
+                self.pending.pop(self.frame_id, None)
+            next_send += self.args.interval
+            await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+
+
+async def sample_memory(client, url, samples, interval=1.0):
+    while True:
+        try:
+            resp = await client.get(f"{url}/metrics")
+            for line in resp.text.splitlines():
+                if line.startswith("process_resident_memory_bytes "):
+                    samples.append(float(line.split()[1]) / 1024 ** 2)
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(interval)
+
+
+async def drain(devices, timeout):
+    """Wait for verdicts of frames still in flight."""
+    until = time.perf_counter() + timeout
+    while any(d.pending for d in devices) and time.perf_counter() < until:
+        await asyncio.sleep(0.1)
+
+
+async def run_load(args):
+    results = Results()
+    devices = [SimulatedDevice(f"{args.device_prefix}{i:03d}", args, args.seed * 100003 + i, results)
+               for i in range(args.devices)]
+    limits = httpx.Limits(max_connections=2, max_keepalive_connections=2)
+    clients = [httpx.AsyncClient(timeout=args.timeout, limits=limits) for _ in devices]
+    control = httpx.AsyncClient(timeout=args.timeout)
+    memory = []
+
+    try:
+        (await control.get(f"{args.url}/api/system/status")).raise_for_status()
+        pipeline_before = (await control.get(f"{args.url}/api/system/pipeline")).json()
+
+        ready = [asyncio.Event() for _ in devices]
+        listeners = [asyncio.create_task(d.listen(c, r)) for d, c, r in zip(devices, clients, ready)]
+        await asyncio.wait_for(asyncio.gather(*(r.wait() for r in ready)), timeout=30)
+
+        if args.warmup:
+            # 暖機：第一張影像要做禁停區分割、AI 端載入模型，不計入結果
+            print(f"warming up for {args.warmup}s...")
+            await asyncio.gather(*(d.run(c, time.perf_counter() + args.warmup) for d, c in zip(devices, clients)))
+            await drain(devices, args.drain)
+            for d in devices:
+                d.pending.clear()
+            results.reset()
+            pipeline_before = (await control.get(f"{args.url}/api/system/pipeline")).json()
+        sampler = asyncio.create_task(sample_memory(control, args.url, memory))
+
+        print(f"{args.devices} device(s), {args.resolution} {args.protocol}, one frame every {args.interval}s "
+              f"for {args.duration}s...")
+        start = time.perf_counter()
+        await asyncio.gather(*(d.run(c, start + args.duration) for d, c in zip(devices, clients)))
+        elapsed = time.perf_counter() - start
+
+        await drain(devices, args.drain)
+        for d in devices:
+            results.dropped += len(d.pending)
+
+        pipeline_after = (await control.get(f"{args.url}/api/system/pipeline")).json()
+        sampler.cancel()
+        for task in listeners:
+            task.cancel()
+        await asyncio.gather(*listeners, sampler, return_exceptions=True)
+    finally:
+        if not args.keep_devices:
+            # 模擬裝置不留在後端的裝置登錄 (與其 metrics 標籤) 中
+            await asyncio.gather(*(control.delete(f"{args.url}/api/devices/{d.id}") for d in devices),
+                                 return_exceptions=True)
+        await asyncio.gather(*(c.aclose() for c in clients), control.aclose())
+
+    verdicts = len(results.latency_ms)
+    return {
+        "duration_s": round(elapsed, 2),
+        "frames_sent": results.frames_sent,
+        "frames_uploaded": results.frames_uploaded,
+        "verdicts": verdicts,
+        "dropped": results.dropped,
+        "dropped_pct": round(results.dropped / results.frames_uploaded * 100, 2) if results.frames_uploaded else None,
+        "errors": results.errors,
+        "requests": results.requests,
+        "throughput": {
+            "frames_per_s": round(results.frames_uploaded / elapsed, 2),
+            "verdicts_per_s": round(verdicts / elapsed, 2),
+            "upload_mb_per_s": round(results.bytes_sent / elapsed / 1024 ** 2, 3),
+        },
+        "latency_ms": summarize(results.latency_ms),
+        "upload_ms": summarize(results.upload_ms),
+        "stages_ms": {stage: summarize(values) for stage, values in sorted(results.stages_ms.items())},
+        "backend": {
+            "memory_mb": {
+                "start": round(memory[0], 1) if memory else None,
+                "peak": round(max(memory), 1) if memory else None,
+                "end": round(memory[-1], 1) if memory else None,
+            },
+            "pipeline": {key: pipeline_after[key] - pipeline_before.get(key, 0)
+                         for key in ("submitted", "replaced", "processed", "failed") if key in pipeline_after},
+        },
+    }
+
+
+def print_summary(results):
+    latency = results["latency_ms"]
+    print(f"frames: {results['frames_uploaded']}/{results['frames_sent']} uploaded, {results['verdicts']} verdicts, "
+          f"{results['dropped']} dropped ({results['dropped_pct']}%), errors: {results['errors'] or 'none'}")
+    print(f"throughput: {results['throughput']['frames_per_s']} frames/s in, "
+          f"{results['throughput']['verdicts_per_s']} verdicts/s out, "
+          f"{results['throughput']['upload_mb_per_s']} MB/s")
+    print(f"end-to-end latency (ms): p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  "
+          f"max {latency['max']}")
+    print(f"upload (ms): p50 {results['upload_ms']['p50']}  p95 {results['upload_ms']['p95']}")
+    memory = results["backend"]["memory_mb"]
+    print(f"backend memory (MB): start {memory['start']}  peak {memory['peak']}  end {memory['end']}")
+    if results["stages_ms"]:
+        print(f"{'stage':>16s} {'p50':>9s} {'p95':>9s} {'p99':>9s}")
+        for stage, s in results["stages_ms"].items():
+            print(f"{stage:>16s} {s['p50']:9.2f} {s['p95']:9.2f} {s['p99']:9.2f}")
+
+
+def cmd_run(args):
+    results = asyncio.run(run_load(args))
+    print_summary(results)
+
+    config = {k: v for k, v in vars(args).items() if k not in ("func", "output", "label")}
+    label = args.label or datetime.now().strftime("%Y%m%d-%H%M%S")
+    report = {
+        "label": label,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "config": config,
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{label}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"saved {output}")
+
+
+# (路徑, 數值越大越好)；stages_ms 的各階段 p95 另外加入
+COMPARED = [
+    (("throughput", "frames_per_s"), True),
+    (("throughput", "verdicts_per_s"), True),
+    (("latency_ms", "p50"), False),
+    (("latency_ms", "p95"), False),
+    (("latency_ms", "p99"), False),
+    (("upload_ms", "p95"), False),
+    (("dropped_pct",), False),
+    (("backend", "memory_mb", "peak"), False),
+]
+
+# 設定不同的兩次執行無法直接比較
+CONFIG_KEYS = ("devices", "resolution", "protocol", "codec", "chunk_size", "interval", "image", "jitter_ms",
+               "duration", "warmup")
+
+
+def lookup(data, path):
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def cmd_compare(args):
+    with open(args.baseline) as f:
+        base = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    for key in CONFIG_KEYS:
+        if base["config"].get(key) != current["config"].get(key):
+            print(f"warning: {key} differs ({base['config'].get(key)} vs {current['config'].get(key)})")
+
+    metrics = list(COMPARED)
+    stages = sorted(set(base["results"].get("stages_ms", {})) | set(current["results"].get("stages_ms", {})))
+    metrics += [(("stages_ms", stage, "p95"), False) for stage in stages]
+
+    regressions = 0
+    print(f"{'metric':>28s} {base['label']:>12.12s} {current['label']:>12.12s} {'change':>9s}")
+    for path, higher_is_better in metrics:
+        old = lookup(base["results"], path)
+        new = lookup(current["results"], path)
+        name = ".".join(path)
+        if old is None or new is None:
+            print(f"{name:>28s} {str(old):>12s} {str(new):>12s}")
+            continue
+        change = (new - old) / old * 100 if old else (0.0 if new == old else float("inf"))
+        worse = -change if higher_is_better else change
+        # 絕對差太小 (如 0.1 ms -> 0.2 ms) 不視為退步
+        flag = ""
+        if worse > args.threshold and abs(new - old) >= args.min_delta:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{name:>28s} {old:12.2f} {new:12.2f} {change:+8.1f}%{flag}")
+
+    if regressions:
+        print(f"{regressions} metric(s) regressed by more than {args.threshold}%")
+        sys.exit(1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="simulate devices against a running backend and save the results")
+    run.add_argument("--url", default="http://127.0.0.1:8000", help="backend base URL")
+    run.add_argument("--devices", type=int, default=10)
+    run.add_argument("--duration", type=float, default=30, help="seconds of uploads")
+    run.add_argument("--interval", type=float, default=1.0, help="seconds between frames of one device")
+    run.add_argument("--resolution", default="320x240", help="WIDTHxHEIGHT (RGB565)")
+    run.add_argument("--protocol", choices=["frame", "chunked"], default="frame")
+    run.add_argument("--codec", choices=["none", "rle"], default="none", help="frame protocol compression")
+    run.add_argument("--chunk-size", type=int, default=4096, help="bytes per /api/upload request")
+    run.add_argument("--jitter-ms", type=float, default=0, help="random delay 0..N ms before every request")
+    run.add_argument("--image", choices=["noise", "static"], default="noise",
+                     help="noise: every frame differs; static: same frame (motion gate reuses the verdict)")
+    run.add_argument("--warmup", type=float, default=0, help="seconds of uploads before measuring")
+    run.add_argument("--drain", type=float, default=10, help="seconds to wait for outstanding verdicts")
+    run.add_argument("--timeout", type=float, default=30, help="HTTP timeout per request")
+    run.add_argument("--device-prefix", default="load-")
+    run.add_argument("--keep-devices", action="store_true",
+                     help="leave the simulated devices registered on the backend after the run")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--label", help="name of the run (default: timestamp)")
+    run.add_argument("--output", help=f"result file (default: {RESULTS_DIR}/<label>.json)")
+    run.set_defaults(func=cmd_run)
+
+    compare = sub.add_parser("compare", help="compare a run against a baseline; exits 1 on regressions")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=10, help="percent change counted as a regression")
+    compare.add_argument("--min-delta", type=float, default=1.0,
+                         help="ignore absolute changes smaller than this (ms, MB, frames/s or percent points)")
+    compare.set_defaults(func=cmd_compare)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.func(args)
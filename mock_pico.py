@@ -1,31 +1,63 @@
+import argparse
 import requests
 import os
 import math
+import sys
 import time
 import random
 
-URL = 'http://127.0.0.1:8000/api/upload'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from frame_protocol import CODEC_NONE, CODEC_ROW_XOR_RLE, encode_frame
+
+BASE_URL = 'http://127.0.0.1:8000'
+URL = f'{BASE_URL}/api/upload'
+FRAME_URL = f'{BASE_URL}/api/frame'
 
 WIDTH = 320
 HEIGHT = 240
 BYTES_PER_PIXEL = 2
 TOTAL_SIZE = WIDTH * HEIGHT * BYTES_PER_PIXEL
 
-CHUNK_SIZE = 4096 
+CHUNK_SIZE = 4096
+
+DEVICE_ID = "mock-pico"
+frame_id = 0
+
+# keep-alive：所有請求共用同一條連線
+session = requests.Session()
+
 
 def create_dummy_image():
     print(f"產生虛擬影像: {WIDTH}x{HEIGHT} (RGB565), 大小: {TOTAL_SIZE} bytes")
     return os.urandom(TOTAL_SIZE)
 
-def run_simulation():
-    raw_data = create_dummy_image()
-    
+
+def create_scene_image():
+    """Flat road, lane marking and a car, with a little sensor noise; compresses like a real still camera."""
+    print(f"產生模擬場景: {WIDTH}x{HEIGHT} (RGB565), 大小: {TOTAL_SIZE} bytes")
+    road, line, car = 0x632C, 0xF800, 0x001F
+    car_x = random.randint(0, WIDTH - 80)
+    raw = bytearray(TOTAL_SIZE)
+    for y in range(HEIGHT):
+        row = [road] * WIDTH
+        if HEIGHT - 40 <= y < HEIGHT - 30:
+            row[:] = [line] * WIDTH
+        if 100 <= y < 160:
+            row[car_x:car_x + 80] = [car] * 80
+        for _ in range(4):
+            x = random.randrange(WIDTH)
+            row[x] ^= 0x0021
+        raw[y * WIDTH * 2:(y + 1) * WIDTH * 2] = b"".join(p.to_bytes(2, "big") for p in row)
+    return bytes(raw)
+
+
+def send_chunked(raw_data):
     offset = 0
     total_chunks = math.ceil(TOTAL_SIZE / CHUNK_SIZE)
     chunk_idx = 0
+    sent = 0
 
     print(f"開始模擬上傳 (共 {total_chunks} 個分片)...")
-    start_time = time.time()
 
     while offset < TOTAL_SIZE:
         chunk = raw_data[offset : offset + CHUNK_SIZE]
@@ -34,16 +66,19 @@ def run_simulation():
             "offset": offset,
             "total": TOTAL_SIZE,
             "width": WIDTH,
-            "height": HEIGHT
+            "height": HEIGHT,
+            "device": DEVICE_ID,
+            "frame": frame_id
         }
 
         try:
-            response = requests.post(URL, params=params, data=chunk)
+            response = session.post(URL, params=params, data=chunk)
+            sent += len(chunk)
 
             if response.status_code == 200:
                 resp_json = response.json()
                 chunk_idx += 1
-                
+
                 progress = int((offset / TOTAL_SIZE) * 20)
                 bar = "#" * progress + "-" * (20 - progress)
                 print(f"\r[{bar}] Chunk {chunk_idx}/{total_chunks} | {resp_json.get('status')}", end="")
@@ -61,21 +96,76 @@ def run_simulation():
             break
 
         offset += len(chunk)
-        
+
         time.sleep(0.01)
 
+    return chunk_idx, sent
+
+
+def send_frame(raw_data, codec):
+    start = time.time()
+    packet = encode_frame(DEVICE_ID, frame_id, WIDTH, HEIGHT, raw_data, codec)
+    encode_ms = (time.time() - start) * 1000
+    print(f"封包 {len(packet)} bytes (原始 {TOTAL_SIZE}，{len(packet) / TOTAL_SIZE:.1%})，編碼 {encode_ms:.0f} ms")
+
+    try:
+        response = session.post(FRAME_URL, data=packet, headers={"Content-Type": "application/octet-stream"})
+        if response.status_code == 200:
+            print(f"Server 回應: {response.json()['message']}")
+        else:
+            print(f"Error: {response.status_code} - {response.text}")
+    except Exception as e:
+        print(f"連線失敗: {e}")
+        return 0, 0
+    return 1, len(packet)
+
+
+def run_simulation(args):
+    global frame_id
+    frame_id += 1
+    raw_data = create_scene_image() if args.image == "scene" else create_dummy_image()
+
+    start_time = time.time()
+    if args.protocol == "chunked":
+        requests_sent, bytes_sent = send_chunked(raw_data)
+    else:
+        codec = CODEC_ROW_XOR_RLE if args.codec == "rle" else CODEC_NONE
+        requests_sent, bytes_sent = send_frame(raw_data, codec)
+
     duration = time.time() - start_time
-    print(f"總耗時: {duration:.2f} 秒")
+    print(f"總耗時: {duration:.2f} 秒 | requests/frame: {requests_sent} | bytes/frame: {bytes_sent}")
+    return requests_sent, bytes_sent
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulate the Pico camera uploading RGB565 frames")
+    parser.add_argument("--protocol", choices=["frame", "chunked"], default="frame",
+                        help="frame: one binary request per frame (/api/frame); chunked: legacy /api/upload")
+    parser.add_argument("--codec", choices=["none", "rle"], default="none", help="frame protocol compression")
+    parser.add_argument("--image", choices=["scene", "noise"], default="scene",
+                        help="scene compresses like a still camera, noise does not compress at all")
+    parser.add_argument("--frames", type=int, default=0, help="stop after N frames (0 = run forever)")
+    parser.add_argument("--interval", type=int, default=30, help="seconds between frames")
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
+    args = parse_args()
+    totals = [0, 0]
     try:
         while True:
-            run_simulation()
+            requests_sent, bytes_sent = run_simulation(args)
+            totals[0] += requests_sent
+            totals[1] += bytes_sent
+            if args.frames and frame_id >= args.frames:
+                break
             print("等待下一輪...", end="")
-            for i in range(30, 0, -1):
+            for i in range(args.interval, 0, -1):
                 print(f"\r下次上傳還有: {i} 秒  ", end="")
                 time.sleep(1)
             print("\r" + " " * 30 + "\r", end="")
-            
+
     except KeyboardInterrupt:
-        print("程式已手動停止")
\ No newline at end of file
+        print("程式已手動停止")
+    if frame_id:
+        print(f"平均 requests/frame: {totals[0] / frame_id:.1f}, bytes/frame: {totals[1] / frame_id:.0f}")
@@ -11,7 +11,9 @@ import ssl
 import time
 import socketpool
 import gc
+import struct
 import pwmio
+import microcontroller
 from adafruit_ov7670 import (
     OV7670,
     OV7670_COLOR_RGB,   # <--- 修正這裡：原本是 _RGB565，改成 _RGB
@@ -19,6 +21,15 @@ from adafruit_ov7670 import (
 )
 
 POST_URL = "http://10.50.79.127:8000/api/upload"
+# 單次上傳：表頭 + 整張影像一個 request (backend/frame_protocol.py)；False 退回分片上傳
+FRAME_URL = "http://10.50.79.127:8000/api/frame"
+USE_FRAME_PROTOCOL = True
+# 行差分 + RLE 壓縮：純 Python 逐位元組編碼較慢，且需額外一塊輸出緩衝；記憶體足夠時再開啟
+COMPRESS = False
+
+# 裝置識別碼 (晶片 UID)，後端以 device + frame 組裝分片
+DEVICE_ID = binascii.hexlify(microcontroller.cpu.uid).decode()
+frame_id = 0
 
 CIRCUITPY_WIFI_SSID = "tomorin"
 CIRCUITPY_WIFI_PASSWORD = "12345678"
@@ -82,8 +93,16 @@ height = cam.height
 TOTAL_SIZE = width * height * 2
 print(f"Resolution: {width}x{height}")
 
-# 建立緩衝區 (RGB565 每個像素 2 bytes)
-buf = bytearray(2 * width * height)
+# 封包表頭 (與 backend/frame_protocol.py 相同)：magic, version, format, codec, flags,
+# width, height, frame id, raw_len, data_len, crc32, id_len，後接裝置 id
+HEADER_FORMAT = "<4sBBBBHHIIIIB"
+DEVICE_BYTES = DEVICE_ID.encode()
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT) + len(DEVICE_BYTES)
+
+# 建立緩衝區 (RGB565 每個像素 2 bytes)，前面預留表頭，整塊直接送出不必再複製
+packet = bytearray(HEADER_SIZE + TOTAL_SIZE)
+packet[HEADER_SIZE - len(DEVICE_BYTES):HEADER_SIZE] = DEVICE_BYTES
+buf = memoryview(packet)[HEADER_SIZE:]
 
 # 4. 暖機
 print("Warming up camera (2s)...")
@@ -130,7 +149,84 @@ def play_alarm(duration=0.2):
     pwm.duty_cycle = 0
     time.sleep(0.2)
     
+def handle_command(response):
+    if response.status_code == 200:
+        try:
+            res_json = response.json()
+            if res_json.get("command") == "ring":
+                if res_json.get("value") == "true":
+                    print("收到後端指令：觸發蜂鳴器！")
+                    play_alarm(0.5) # 響 0.5 秒
+        except Exception as e:
+            print("解析回傳 JSON 失敗:", e)
+    else:
+        print(f"Upload rejected: {response.status_code}")
+
+
+def row_xor_inplace(data, row_bytes):
+    # 由下往上，每一行與上一行 XOR (上一行尚未改動)；以大整數一次處理整行
+    for start in range(len(data) - row_bytes, 0, -row_bytes):
+        row = int.from_bytes(data[start:start + row_bytes], "big")
+        above = int.from_bytes(data[start - row_bytes:start], "big")
+        data[start:start + row_bytes] = (row ^ above).to_bytes(row_bytes, "big")
+
+
+def packbits(data):
+    out = bytearray()
+    n = len(data)
+    i = 0
+    while i < n:
+        j = i + 1
+        while j < n and j - i < 128 and data[j] == data[i]:
+            j += 1
+        if j - i >= 3:
+            out.append(257 - (j - i))
+            out.append(data[i])
+            i = j
+            continue
+        j = i
+        while j < n and j - i < 128:
+            if j + 2 < n and data[j] == data[j + 1] == data[j + 2]:
+                break
+            j += 1
+        out.append(j - i - 1)
+        out += data[i:j]
+        i = j
+    return out
+
+
+def upload_frame():
+    global frame_id
+    frame_id += 1
+    print("Capturing...")
+    cam.capture(buf)
+    crc = binascii.crc32(buf)
+
+    if COMPRESS:
+        row_xor_inplace(buf, width * 2)
+        payload = packbits(buf)
+        struct.pack_into(HEADER_FORMAT, packet, 0, b"TPF1", 1, 0, 1, 0, width, height, frame_id,
+                         TOTAL_SIZE, len(payload), crc, len(DEVICE_BYTES))
+        data = bytes(packet[:HEADER_SIZE]) + payload
+    else:
+        struct.pack_into(HEADER_FORMAT, packet, 0, b"TPF1", 1, 0, 0, 0, width, height, frame_id,
+                         TOTAL_SIZE, TOTAL_SIZE, crc, len(DEVICE_BYTES))
+        data = packet
+
+    # 每張影像只清一次記憶體；Session 保持連線，不必每張重新握手
+    gc.collect()
+    try:
+        response = requests.post(FRAME_URL, data=data)
+        print(f"Sent frame {frame_id}: {len(data)} bytes, {response.status_code}")
+        handle_command(response)
+        response.close()
+    except Exception as e:
+        print(f"Frame upload failed: {e}")
+
+
 def upload_in_chunks():
+    global frame_id
+    frame_id += 1
     print("Capturing 320x240...")
     cam.capture(buf)
     
@@ -145,7 +241,7 @@ def upload_in_chunks():
         chunk = memoryview(buf)[offset : offset + chunk_size]
         
         # 建立帶參數的 URL
-        url = f"{POST_URL}?offset={offset}&total={TOTAL_SIZE}&width={width}&height={height}"
+        url = f"{POST_URL}?offset={offset}&total={TOTAL_SIZE}&width={width}&height={height}&device={DEVICE_ID}&frame={frame_id}"
         
         try:
             # 拍照後每一段的傳送都需要清理記憶體
@@ -154,15 +250,7 @@ def upload_in_chunks():
             print(f"Sent {offset}: {response.status_code}")
             # --- 關鍵：只在最後一個片段檢查回傳值 ---
             if offset + chunk_size >= TOTAL_SIZE:
-                if response.status_code == 200:
-                    try:
-                        res_json = response.json()
-                        if res_json.get("command") == "ring":
-                            if res_json.get("value") == "true":
-                                print("收到後端指令：觸發蜂鳴器！")
-                                play_alarm(0.5) # 響 0.5 秒
-                    except Exception as e:
-                        print("解析回傳 JSON 失敗:", e)
+                handle_command(response)
 
             response.close()
         except Exception as e:
@@ -173,7 +261,10 @@ def upload_in_chunks():
 
 # 執行
 while True:
-    upload_in_chunks()
+    if USE_FRAME_PROTOCOL:
+        upload_frame()
+    else:
+        upload_in_chunks()
     time.sleep(10)
     
 pwm.deinit()